@@ -145,6 +145,18 @@ class CommonCommand:
     def process_status(self, _line, pid):
         return False
 
+    @staticmethod
+    def process_out_payload(process_out, payload, pid):
+        # Process output can be batched by the daemon into one payload of newline separated lines.
+        # Sub-topics like 'exec/<id>/stats/out' are passed through as they are.
+        if "/" in pid:
+            return process_out(payload, pid)
+
+        for line in payload.split("\n"):
+            if not process_out(line, pid):
+                return False
+        return True
+
     def print_out_command(self, execute_command, process_line, header, footer):
         self.client = mqtt.Client("PyROS." + uniqueId)
 
@@ -247,7 +259,7 @@ class CommonCommand:
                 if topic.startswith("exec/"):
                     if topic.endswith("/out"):
                         pid = topic[5:len(topic)-4]
-                        self.connected = process_out(payload, pid)
+                        self.connected = self.process_out_payload(process_out, payload, pid)
                     elif topic.endswith("/status"):
                         pid = topic[5:len(topic)-7]
                         self.connected = process_status(payload, pid)
@@ -325,7 +337,7 @@ class CommonCommand:
                 if current_topic.startswith("exec/"):
                     if current_topic.endswith("/out"):
                         pid = current_topic[5:len(current_topic)-4]
-                        self.connected = process_out(payload, pid)
+                        self.connected = self.process_out_payload(process_out, payload, pid)
                     elif current_topic.endswith("/status"):
                         pid = current_topic[5:len(current_topic)-7]
                         self.connected = process_status(payload, pid)
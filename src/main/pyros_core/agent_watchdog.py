@@ -0,0 +1,87 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import heapq
+import threading
+import time
+
+
+DEFAULT_AGENT_KILL_TIMEOUT = 180
+
+# Heap is rebuilt from current deadlines once stale entries outnumber live ones by this much
+COMPACT_THRESHOLD = 64
+
+
+class AgentWatchdog:
+    # Calls on_expired(process_id) for agents that were not pinged within 'timeout' seconds.
+    # Deadlines are kept in a heap with lazy invalidation - a ping only pushes a new entry and
+    # older entries of the same agent become stale. Only one scheduler timer is armed, for the earliest deadline.
+    def __init__(self, scheduler, on_expired, timeout=DEFAULT_AGENT_KILL_TIMEOUT):
+        self.scheduler = scheduler
+        self.on_expired = on_expired
+        self.timeout = timeout
+        self._deadlines = {}
+        self._heap = []
+        self._timer = None
+        self._timer_deadline = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def watch(self, process_id, last_ping):
+        # Agent that was never pinged gets whole timeout from now
+        deadline = (last_ping if last_ping is not None else time.time()) + self.timeout
+        with self._lock:
+            self._deadlines[process_id] = deadline
+            heapq.heappush(self._heap, (deadline, process_id))
+            if len(self._heap) > 2 * len(self._deadlines) + COMPACT_THRESHOLD:
+                self._heap = [(d, p) for p, d in self._deadlines.items()]
+                heapq.heapify(self._heap)
+            self._arm()
+
+    def forget(self, process_id):
+        with self._lock:
+            self._deadlines.pop(process_id, None)
+
+    def _is_stale(self, entry):
+        deadline, process_id = entry
+        return self._deadlines.get(process_id) != deadline
+
+    def _arm(self):
+        while len(self._heap) > 0 and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+
+        if len(self._heap) == 0:
+            self.scheduler.cancel(self._timer)
+            self._timer = None
+            self._timer_deadline = None
+        elif self._timer is None or self._heap[0][0] < self._timer_deadline:
+            self.scheduler.cancel(self._timer)
+            self._timer_deadline = self._heap[0][0]
+            self._timer = self.scheduler.schedule(max(0.0, self._timer_deadline - time.time()), self._expire)
+
+    def _expire(self):
+        expired = []
+        with self._lock:
+            self._timer = None
+            self._timer_deadline = None
+            now = time.time()
+            while len(self._heap) > 0 and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                if not self._is_stale(entry):
+                    del self._deadlines[entry[1]]
+                    expired.append(entry[1])
+            self._arm()
+
+        for process_id in expired:
+            self.on_expired(process_id)
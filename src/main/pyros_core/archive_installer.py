@@ -0,0 +1,109 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import os
+import shutil
+import tarfile
+
+
+STAGING_SUFFIX = ".staging"
+OLD_SUFFIX = ".old"
+
+# Files in process' directory which are not uploaded but belong to the daemon
+KEPT_FILES = [".process"]
+
+MAX_MEMBERS = 10000
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _sibling(process_dir, suffix):
+    parent, name = os.path.split(os.path.normpath(process_dir))
+    return os.path.join(parent, "." + name + suffix)
+
+
+def archive_path(process_dir):
+    return _sibling(process_dir, ".archive")
+
+
+def _extract(archive, staging):
+    # Only plain files and directories, and nothing outside of staging directory
+    staging = os.path.abspath(staging)
+    files = []
+    with tarfile.open(archive, "r:*") as tar:
+        members = tar.getmembers()
+        if len(members) > MAX_MEMBERS:
+            raise ArchiveError(f"more than {MAX_MEMBERS} entries")
+        for member in members:
+            path = os.path.abspath(os.path.join(staging, member.name))
+            if not path.startswith(staging + os.sep):
+                raise ArchiveError("entry outside of process directory " + member.name)
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+            elif member.isfile():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with tar.extractfile(member) as source, open(path, "wb") as target:
+                    shutil.copyfileobj(source, target)
+                files.append(os.path.relpath(path, staging))
+            else:
+                raise ArchiveError("unsupported entry " + member.name)
+    return files
+
+
+def install_archive(archive, process_dir, prepare=None):
+    # Extracts archive to a staging directory next to process' directory and swaps it in place
+    # with two renames, so process' directory is either all old or all new files. Files daemon
+    # keeps in process' directory (.process) are carried over. 'prepare' is called with staging
+    # directory and list of extracted files before the swap. Returns list of extracted files.
+    staging = _sibling(process_dir, STAGING_SUFFIX)
+    old = _sibling(process_dir, OLD_SUFFIX)
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        try:
+            files = _extract(archive, staging)
+        except (tarfile.TarError, EOFError) as tar_error:
+            raise ArchiveError(str(tar_error))
+
+        for kept in KEPT_FILES:
+            if os.path.exists(os.path.join(process_dir, kept)) and kept not in files:
+                shutil.copy2(os.path.join(process_dir, kept), os.path.join(staging, kept))
+
+        if prepare is not None:
+            prepare(staging, files)
+
+        if os.path.exists(process_dir):
+            os.rename(process_dir, old)
+        os.rename(staging, process_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    shutil.rmtree(old, ignore_errors=True)
+    return files
+
+
+def recover(code_dir):
+    # Finishes or undoes swaps interrupted by daemon stopping between two renames
+    for name in os.listdir(code_dir):
+        if name.startswith(".") and name.endswith(OLD_SUFFIX):
+            process_dir = os.path.join(code_dir, name[1:-len(OLD_SUFFIX)])
+            old = os.path.join(code_dir, name)
+            if os.path.exists(process_dir):
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.rename(old, process_dir)
+        elif name.startswith(".") and name.endswith(STAGING_SUFFIX):
+            shutil.rmtree(os.path.join(code_dir, name), ignore_errors=True)
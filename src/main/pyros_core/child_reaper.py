@@ -0,0 +1,123 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import os
+import signal
+
+
+class ChildExit:
+    __slots__ = ["pid", "returncode", "rusage"]
+
+    def __init__(self, pid, returncode, rusage):
+        self.pid = pid
+        self.returncode = returncode
+        self.rusage = rusage
+
+
+def exit_code_of(status):
+    # Same as Popen.returncode; os.waitstatus_to_exitcode is only in python 3.9+
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def pidfd_supported():
+    # pidfd_open can be in os module and still fail: kernel before 5.3 or blocked by seccomp
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+class ChildReaper:
+    # Reaps children as soon as they exit. Each child gets a pidfd registered with the reactor;
+    # where pidfd_open is not available, SIGCHLD wakes the reactor through a wakeup pipe and
+    # all watched children are checked. All methods but start_signal_fallback are called
+    # from the reactor's thread.
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.use_pidfd = pidfd_supported()
+        self._watched = {}
+        self._signal_read = None
+
+    def start_signal_fallback(self):
+        # Must be called from the main thread as it installs a signal handler
+        if self.use_pidfd or self._signal_read is not None:
+            return
+
+        self._signal_read, signal_write = os.pipe()
+        os.set_blocking(self._signal_read, False)
+        os.set_blocking(signal_write, False)
+        signal.signal(signal.SIGCHLD, lambda _signum, _frame: None)
+        signal.set_wakeup_fd(signal_write)
+        self.reactor.add_reader(self._signal_read, self._signal_received)
+
+    def watch(self, process, callback):
+        pid = process.pid
+        if self.use_pidfd:
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError:
+                # Out of file descriptors; child is still reaped when any other watched child exits
+                self._watched[pid] = (process, callback, None)
+                self._reap(pid)
+                return
+
+            self._watched[pid] = (process, callback, pidfd)
+            self.reactor.add_reader_now(pidfd, lambda: self._pidfd_ready(pid))
+        else:
+            self._watched[pid] = (process, callback, None)
+
+        # Process might have exited before we started watching it
+        self._reap(pid)
+
+    def _pidfd_ready(self, pid):
+        self._reap(pid)
+        # Children watch couldn't open pidfd for are checked along
+        for other_pid in [other_pid for other_pid, watched in self._watched.items() if watched[2] is None]:
+            self._reap(other_pid)
+
+    def _signal_received(self):
+        try:
+            while os.read(self._signal_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        for pid in list(self._watched):
+            self._reap(pid)
+
+    def _reap(self, pid):
+        if pid not in self._watched:
+            return
+
+        process, callback, pidfd = self._watched[pid]
+        try:
+            reaped_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if reaped_pid == 0:
+                return
+            returncode = exit_code_of(status)
+        except ChildProcessError:
+            # Already reaped by someone else (Popen.poll/wait)
+            if process.returncode is None:
+                return
+            returncode = process.returncode
+            rusage = None
+
+        process.returncode = returncode
+        del self._watched[pid]
+        if pidfd is not None:
+            self.reactor.remove_reader(pidfd)
+            os.close(pidfd)
+
+        callback(ChildExit(pid, returncode, rusage))
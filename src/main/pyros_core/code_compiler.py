@@ -0,0 +1,64 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import os
+import py_compile
+import sys
+import threading
+import traceback
+
+from queue import Queue
+
+
+class CodeCompiler:
+    # Compiles stored python files to bytecode on a background thread so processes start from
+    # ready .pyc files. With 'pycache_prefix' set .pyc files are written as python does with
+    # PYTHONPYCACHEPREFIX set to the same path, instead of to __pycache__ next to the sources.
+    def __init__(self, pycache_prefix=None):
+        self.pycache_prefix = pycache_prefix
+        self.thread = None
+        self._queue = Queue()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def compile(self, filename, callback):
+        # callback is called with None when compiled (or not a python file) or with compile error
+        self._queue.put((filename, callback))
+
+    def cache_file(self, filename):
+        if self.pycache_prefix is None:
+            return None
+        directory, name = os.path.split(os.path.abspath(filename))
+        return os.path.join(self.pycache_prefix, directory.lstrip(os.sep), os.path.splitext(name)[0] + "." + sys.implementation.cache_tag + ".pyc")
+
+    def compile_now(self, filename):
+        if not filename.endswith(".py"):
+            return None
+        try:
+            py_compile.compile(filename, cfile=self.cache_file(filename), doraise=True)
+            return None
+        except py_compile.PyCompileError as compile_error:
+            return compile_error.exc_type_name + ": " + str(compile_error.exc_value)
+        except OSError as os_error:
+            return str(os_error)
+
+    def _run(self):
+        while True:
+            filename, callback = self._queue.get()
+            # noinspection PyBroadException
+            try:
+                callback(self.compile_now(filename))
+            except Exception as exception:
+                print("ERROR: Got exception in code compiler; " + str(exception) + "\n" + ''.join(traceback.format_tb(exception.__traceback__)))
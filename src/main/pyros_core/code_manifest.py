@@ -0,0 +1,82 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import hashlib
+import json
+import os
+
+
+MANIFEST_FILENAME = ".manifest"
+
+READ_SIZE = 65536
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class CodeManifest:
+    # sha256 of files in process' directory by their relative name, kept in '.manifest' along with
+    # size and modification time files had when hashed. A file is hashed again only if it changed
+    # since, so files written by other means (or while daemon was not running) are still noticed.
+    def __init__(self, process_dir):
+        self.process_dir = process_dir
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def manifest_filename(self):
+        return os.path.join(self.process_dir, MANIFEST_FILENAME)
+
+    def load(self):
+        try:
+            with open(self.manifest_filename(), "rt") as f:
+                entries = json.load(f).items()
+            # Malformed entries are dropped; their files are simply hashed again
+            self.entries = {name: tuple(entry) for name, entry in entries if isinstance(entry, list) and len(entry) == 3}
+        except (OSError, ValueError, AttributeError):
+            self.entries = {}
+
+    def save(self):
+        if self.dirty:
+            filename = self.manifest_filename()
+            with open(filename + ".tmp", "wt") as f:
+                json.dump(self.entries, f)
+            os.replace(filename + ".tmp", filename)
+            self.dirty = False
+
+    def stored(self, name, path, sha256):
+        # File was just written with known content; no need to read it again
+        stat = os.stat(path)
+        self.entries[name] = (sha256, stat.st_size, stat.st_mtime_ns)
+        self.dirty = True
+
+    def sha256(self, name, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if self.entries.pop(name, None) is not None:
+                self.dirty = True
+            return None
+
+        entry = self.entries.get(name)
+        if entry is not None and entry[1] == stat.st_size and entry[2] == stat.st_mtime_ns:
+            return entry[0]
+
+        sha256 = file_sha256(path)
+        self.entries[name] = (sha256, stat.st_size, stat.st_mtime_ns)
+        self.dirty = True
+        return sha256
@@ -0,0 +1,75 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import threading
+import traceback
+
+from collections import deque
+
+
+DEFAULT_COMMAND_WORKERS = 4
+
+
+class CommandExecutor:
+    # Runs submitted commands on a pool of worker threads. Commands with the same key run one
+    # at a time in order they were submitted; commands with different keys run in parallel.
+    # Keys with pending commands take turns, so one key with many commands doesn't starve others.
+    def __init__(self, workers=DEFAULT_COMMAND_WORKERS):
+        self.workers = workers
+        self.threads = []
+        self._pending = {}
+        self._ready = deque()
+        self._condition = threading.Condition()
+
+    def start(self):
+        if len(self.threads) == 0:
+            for i in range(max(1, self.workers)):
+                thread = threading.Thread(target=self._run, name=f"pyros-command-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, key, command, *args):
+        with self._condition:
+            commands = self._pending.get(key)
+            if commands is None:
+                # Key is not queued nor running
+                self._pending[key] = deque([(command, args)])
+                self._ready.append(key)
+                self._condition.notify()
+            else:
+                commands.append((command, args))
+
+    def _next(self):
+        with self._condition:
+            while len(self._ready) == 0:
+                self._condition.wait()
+            key = self._ready.popleft()
+            return key, self._pending[key].popleft()
+
+    def _done(self, key):
+        with self._condition:
+            if len(self._pending[key]) > 0:
+                self._ready.append(key)
+                self._condition.notify()
+            else:
+                del self._pending[key]
+
+    def _run(self):
+        while True:
+            key, (command, args) = self._next()
+            # noinspection PyBroadException
+            try:
+                command(*args)
+            except Exception as exception:
+                print("ERROR: Got exception in command for " + str(key) + "; " + str(exception) + "\n" + ''.join(traceback.format_tb(exception.__traceback__)))
+            finally:
+                self._done(key)
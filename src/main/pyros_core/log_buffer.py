@@ -0,0 +1,120 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import struct
+import threading
+import time
+
+
+DEFAULT_LOG_BUFFER_SIZE = 128 * 1024
+
+# Each record is stored as timestamp, length of line in bytes and line's utf-8 bytes
+RECORD_HEADER = struct.Struct("<dI")
+
+
+class LogRingBuffer:
+    def __init__(self, capacity=DEFAULT_LOG_BUFFER_SIZE, first_offset=0):
+        if capacity <= RECORD_HEADER.size:
+            raise ValueError(f"Log buffer capacity must be bigger than {RECORD_HEADER.size} bytes; got {capacity}")
+
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._head = 0
+        self._tail = 0
+        self._used = 0
+        self._first_offset = first_offset
+        self.next_offset = first_offset
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.next_offset - self._first_offset
+
+    def _write(self, position, data):
+        first = min(len(data), self.capacity - position)
+        self._buffer[position:position + first] = data[:first]
+        if first < len(data):
+            self._buffer[0:len(data) - first] = data[first:]
+        return (position + len(data)) % self.capacity
+
+    def _read(self, position, length):
+        first = min(length, self.capacity - position)
+        if first == length:
+            return bytes(self._buffer[position:position + length])
+        return bytes(self._buffer[position:position + first]) + bytes(self._buffer[0:length - first])
+
+    def _evict(self):
+        if self._head + RECORD_HEADER.size <= self.capacity:
+            _, length = RECORD_HEADER.unpack_from(self._buffer, self._head)
+        else:
+            _, length = RECORD_HEADER.unpack(self._read(self._head, RECORD_HEADER.size))
+        record_length = RECORD_HEADER.size + length
+        self._head = (self._head + record_length) % self.capacity
+        self._used -= record_length
+        self._first_offset += 1
+
+    def append(self, line, timestamp=None):
+        self.extend([line], timestamp)
+
+    def extend(self, lines, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        max_length = self.capacity - RECORD_HEADER.size
+        records = []
+        for line in lines:
+            data = line.encode("utf-8") if isinstance(line, str) else line
+            if len(data) > max_length:
+                data = data[:max_length]
+            records.append(RECORD_HEADER.pack(timestamp, len(data)) + data)
+
+        with self._lock:
+            for record in records:
+                while self.capacity - self._used < len(record):
+                    self._evict()
+
+                self._tail = self._write(self._tail, record)
+                self._used += len(record)
+            self.next_offset += len(records)
+
+    @property
+    def first_offset(self):
+        return self._first_offset
+
+    def offset_for_time(self, _timestamp):
+        return self._first_offset
+
+    def records(self, start_offset=0):
+        # Copies one record at a time so appending is not blocked while history is replayed.
+        # Records evicted while iterating are skipped and records appended after
+        # iteration started are not included.
+        position = None
+        offset = None
+        end_offset = self.next_offset
+        while True:
+            with self._lock:
+                if offset is None or offset < self._first_offset:
+                    position = self._head
+                    offset = self._first_offset
+                if offset >= end_offset:
+                    return
+
+                timestamp, length = RECORD_HEADER.unpack(self._read(position, RECORD_HEADER.size))
+                data = None
+                if offset >= start_offset:
+                    data = self._read((position + RECORD_HEADER.size) % self.capacity, length)
+                position = (position + RECORD_HEADER.size + length) % self.capacity
+                offset += 1
+
+            if data is not None:
+                yield offset - 1, timestamp, data.decode("utf-8", errors="replace")
+
+    def lines(self):
+        for _, _, line in self.records():
+            yield line
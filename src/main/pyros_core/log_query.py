@@ -0,0 +1,92 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import re
+import shlex
+import time
+
+from collections import deque
+
+
+TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_since(value, now=None):
+    # Either absolute time in seconds since epoch or relative like '90s', '10m', '2h' or '1d'
+    if len(value) > 1 and value[-1] in TIME_UNITS:
+        return (time.time() if now is None else now) - float(value[:-1]) * TIME_UNITS[value[-1]]
+    return float(value)
+
+
+class LogQuery:
+    def __init__(self):
+        self.tail = None
+        self.since = None
+        self.start_offset = None
+        self.pattern = None
+        self.substring = None
+
+    @staticmethod
+    def parse(arguments):
+        query = LogQuery()
+        args = shlex.split(arguments)
+        i = 0
+        while i < len(args):
+            option = args[i]
+            if i + 1 >= len(args):
+                raise ValueError(f"missing value for '{option}'")
+            value = args[i + 1]
+            if option in ["-n", "--tail"]:
+                query.tail = int(value)
+                if query.tail < 0:
+                    raise ValueError(f"number of lines must not be negative; got '{value}'")
+            elif option == "--since":
+                query.since = parse_since(value)
+            elif option == "--from":
+                query.start_offset = int(value)
+            elif option == "--grep":
+                try:
+                    query.pattern = re.compile(value)
+                except re.error as e:
+                    raise ValueError(f"invalid regular expression '{value}'; {e}")
+            elif option == "--match":
+                query.substring = value
+            else:
+                raise ValueError(f"unknown option '{option}'")
+            i += 2
+        return query
+
+    def has_filter(self):
+        return self.pattern is not None or self.substring is not None
+
+    def matches(self, timestamp, line):
+        if self.since is not None and timestamp < self.since:
+            return False
+        if self.substring is not None and self.substring not in line:
+            return False
+        if self.pattern is not None and self.pattern.search(line) is None:
+            return False
+        return True
+
+    def select(self, log):
+        # Selects (offset, timestamp, line) records from LogRingBuffer or SegmentedLog.
+        # With a filter 'tail' means last N matching lines.
+        start_offset = self.start_offset if self.start_offset is not None else 0
+        if self.since is not None:
+            start_offset = max(start_offset, log.offset_for_time(self.since))
+        if self.tail is not None and not self.has_filter():
+            start_offset = max(start_offset, log.next_offset - self.tail)
+
+        records = (record for record in log.records(start_offset) if self.matches(record[1], record[2]))
+        if self.tail is not None and self.has_filter():
+            return deque(records, maxlen=self.tail)
+        return records
@@ -0,0 +1,290 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import traceback
+
+from queue import Queue, Empty
+
+from pyros_core.log_buffer import RECORD_HEADER
+
+
+DEFAULT_SEGMENT_SIZE = 1024 * 1024
+DEFAULT_MAX_SEGMENTS = 8
+DEFAULT_INDEX_INTERVAL = 4096
+DEFAULT_FSYNC_INTERVAL = 1.0
+DEFAULT_STOP_TIMEOUT = 5.0
+
+MAX_WRITE_BATCH = 1024
+
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".index"
+
+# Sparse index entry: offset (line number) of a record, its position in the segment and its timestamp
+INDEX_ENTRY = struct.Struct("<QQd")
+
+
+class SegmentedLog:
+    # Append only log of one process kept in 'path' as a sequence of segment files named
+    # by offset of their first record. Each segment has a sparse index with an entry
+    # for a record each 'index_interval' bytes. Only LogWriter's thread appends to it.
+    def __init__(self, path, segment_size=DEFAULT_SEGMENT_SIZE, max_segments=DEFAULT_MAX_SEGMENTS, index_interval=DEFAULT_INDEX_INTERVAL):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.index_interval = index_interval
+        self.next_offset = 0
+        self._segments = []
+        self._file = None
+        self._index_file = None
+        self._segment_position = 0
+        self._last_indexed_position = None
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        self._recover()
+
+    def _segment_filename(self, base_offset):
+        return os.path.join(self.path, f"{base_offset:020d}{SEGMENT_SUFFIX}")
+
+    def _index_filename(self, base_offset):
+        return os.path.join(self.path, f"{base_offset:020d}{INDEX_SUFFIX}")
+
+    def _read_index(self, base_offset):
+        try:
+            with open(self._index_filename(base_offset), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        return [INDEX_ENTRY.unpack_from(data, i) for i in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+
+    def _recover(self):
+        self._segments = sorted(int(f[:-len(SEGMENT_SUFFIX)]) for f in os.listdir(self.path)
+                                if f.endswith(SEGMENT_SUFFIX) and f[:-len(SEGMENT_SUFFIX)].isdigit())
+        if len(self._segments) == 0:
+            return
+
+        base_offset = self._segments[-1]
+        segment_filename = self._segment_filename(base_offset)
+        segment_size = os.path.getsize(segment_filename)
+
+        index = [entry for entry in self._read_index(base_offset) if entry[1] < segment_size]
+        offset, position = (index[-1][0], index[-1][1]) if len(index) > 0 else (base_offset, 0)
+
+        with open(segment_filename, "rb") as f:
+            f.seek(position)
+            data = f.read()
+
+        # Find where the last complete record ends; anything after it was not fully written
+        scanned = 0
+        while scanned + RECORD_HEADER.size <= len(data):
+            _, length = RECORD_HEADER.unpack_from(data, scanned)
+            if scanned + RECORD_HEADER.size + length > len(data):
+                break
+            scanned += RECORD_HEADER.size + length
+            offset += 1
+
+        valid_size = position + scanned
+        if valid_size < segment_size:
+            os.truncate(segment_filename, valid_size)
+
+        index = [entry for entry in index if entry[1] < valid_size]
+        with open(self._index_filename(base_offset), "wb") as f:
+            for entry in index:
+                f.write(INDEX_ENTRY.pack(*entry))
+
+        self.next_offset = offset
+        self._file = open(segment_filename, "ab")
+        self._index_file = open(self._index_filename(base_offset), "ab")
+        self._segment_position = valid_size
+        self._last_indexed_position = index[-1][1] if len(index) > 0 else None
+
+    def _roll(self):
+        self._close_files()
+
+        base_offset = self.next_offset
+        self._file = open(self._segment_filename(base_offset), "wb")
+        self._index_file = open(self._index_filename(base_offset), "wb")
+        self._segment_position = 0
+        self._last_indexed_position = None
+        self._segments.append(base_offset)
+
+        while len(self._segments) > self.max_segments:
+            oldest = self._segments.pop(0)
+            for filename in [self._segment_filename(oldest), self._index_filename(oldest)]:
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+
+    def _close_files(self):
+        if self._file is not None:
+            self._file.close()
+            self._index_file.close()
+            self._file = None
+            self._index_file = None
+
+    def append(self, timestamp, data):
+        with self._lock:
+            if self._file is None or self._segment_position >= self.segment_size:
+                self._roll()
+
+            if self._last_indexed_position is None or self._segment_position - self._last_indexed_position >= self.index_interval:
+                self._index_file.write(INDEX_ENTRY.pack(self.next_offset, self._segment_position, timestamp))
+                self._last_indexed_position = self._segment_position
+
+            self._file.write(RECORD_HEADER.pack(timestamp, len(data)))
+            self._file.write(data)
+            self._segment_position += RECORD_HEADER.size + len(data)
+            self.next_offset += 1
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._index_file.flush()
+
+    def sync(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._index_file.flush()
+                os.fsync(self._file.fileno())
+                os.fsync(self._index_file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+
+    def offset_for_time(self, timestamp):
+        # Offset of a record at or before the first record logged at 'timestamp' (within index resolution)
+        with self._lock:
+            segments = list(self._segments)
+
+        result = segments[0] if len(segments) > 0 else self.next_offset
+        for base_offset in segments:
+            index = self._read_index(base_offset)
+            if len(index) == 0 or index[0][2] >= timestamp:
+                break
+            for offset, _, entry_timestamp in index:
+                if entry_timestamp >= timestamp:
+                    break
+                result = offset
+        return result
+
+    def records(self, start_offset=0):
+        with self._lock:
+            segments = list(self._segments)
+            end_offset = self.next_offset
+
+        for i, base_offset in enumerate(segments):
+            next_base_offset = segments[i + 1] if i + 1 < len(segments) else end_offset
+            if next_base_offset <= start_offset:
+                continue
+
+            offset, position = base_offset, 0
+            if start_offset > base_offset:
+                index = self._read_index(base_offset)
+                entry_index = bisect.bisect_right([entry[0] for entry in index], start_offset) - 1
+                if entry_index >= 0:
+                    offset, position = index[entry_index][0], index[entry_index][1]
+
+            try:
+                with open(self._segment_filename(base_offset), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+                    while offset < next_base_offset and position + RECORD_HEADER.size <= len(segment):
+                        timestamp, length = RECORD_HEADER.unpack_from(segment, position)
+                        if position + RECORD_HEADER.size + length > len(segment):
+                            break
+                        if offset >= start_offset:
+                            line = segment[position + RECORD_HEADER.size:position + RECORD_HEADER.size + length]
+                            yield offset, timestamp, line.decode("utf-8", errors="replace")
+                        position += RECORD_HEADER.size + length
+                        offset += 1
+            except (FileNotFoundError, ValueError):
+                # Segment removed in the meantime or it is still empty
+                pass
+
+
+class LogWriter:
+    # Single background thread appending to all process logs. Logs are flushed after
+    # each batch of records and fsync-ed at most once each 'fsync_interval' seconds.
+    def __init__(self, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.fsync_interval = fsync_interval
+        self.thread = None
+        self._queue = Queue()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def append(self, log, timestamp, data):
+        self._queue.put((log, timestamp, [data]))
+
+    def extend(self, log, timestamp, lines):
+        self._queue.put((log, timestamp, lines))
+
+    def close_log(self, log):
+        self._queue.put((log, None, None))
+
+    def stop(self, timeout=DEFAULT_STOP_TIMEOUT):
+        # Writes everything queued so far, syncs and waits (up to timeout) for it to be done
+        if self.thread is not None:
+            self._queue.put((None, None, None))
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _run(self):
+        dirty = set()
+        last_sync = time.monotonic()
+        stopping = False
+        while not stopping:
+            # noinspection PyBroadException
+            try:
+                timeout = max(0.0, last_sync + self.fsync_interval - time.monotonic()) if len(dirty) > 0 else None
+                batch = []
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                    while len(batch) < MAX_WRITE_BATCH:
+                        batch.append(self._queue.get_nowait())
+                except Empty:
+                    pass
+
+                if len(dirty) == 0:
+                    last_sync = time.monotonic()
+
+                for log, timestamp, lines in batch:
+                    if log is None:
+                        stopping = True
+                    elif lines is None:
+                        dirty.discard(log)
+                        log.close()
+                    else:
+                        for data in lines:
+                            log.append(timestamp, data)
+                        dirty.add(log)
+
+                for log in dirty:
+                    log.flush()
+
+                if len(dirty) > 0 and (stopping or time.monotonic() - last_sync >= self.fsync_interval):
+                    for log in dirty:
+                        log.sync()
+                    dirty.clear()
+            except Exception as exception:
+                print("ERROR: Got exception in log writer; " + str(exception) + "\n" + ''.join(traceback.format_tb(exception.__traceback__)))
@@ -0,0 +1,214 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import os
+import threading
+import time
+
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+
+METER_WINDOW = 10
+
+PERCENTILES = [50.0, 90.0, 99.0, 99.9]
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class Counter:
+    __slots__ = ["value", "_lock"]
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+class Meter:
+    # Counter which also knows rate over last METER_WINDOW whole seconds
+    __slots__ = ["value", "_second", "_slots", "_lock"]
+
+    def __init__(self):
+        self.value = 0
+        self._second = int(time.monotonic())
+        self._slots = [0] * (METER_WINDOW + 1)
+        self._lock = threading.Lock()
+
+    def _roll(self, second):
+        if second != self._second:
+            for s in range(self._second + 1, min(second, self._second + METER_WINDOW + 1) + 1):
+                self._slots[s % len(self._slots)] = 0
+            self._second = second
+
+    def mark(self, n=1):
+        with self._lock:
+            self._roll(int(time.monotonic()))
+            self._slots[self._second % len(self._slots)] += n
+            self.value += n
+
+    def rate(self):
+        with self._lock:
+            self._roll(int(time.monotonic()))
+            current = self._second % len(self._slots)
+            return sum(count for i, count in enumerate(self._slots) if i != current) / METER_WINDOW
+
+
+class Histogram:
+    # Log-linear buckets as in HdrHistogram: values below SUB_BUCKET_COUNT are exact, above that
+    # each power of two range is split into SUB_BUCKET_HALF buckets, so any recorded value is
+    # reported with less than 1 / SUB_BUCKET_HALF relative error. Values are non negative integers.
+    __slots__ = ["count", "total", "min", "max", "_counts", "_lock"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self._counts = [0] * SUB_BUCKET_COUNT
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index(value):
+        if value < SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (value >> shift) - SUB_BUCKET_HALF
+
+    @staticmethod
+    def _highest_value(index):
+        if index < SUB_BUCKET_COUNT:
+            return index
+        shift = (index - SUB_BUCKET_COUNT) // SUB_BUCKET_HALF + 1
+        sub_bucket = (index - SUB_BUCKET_COUNT) % SUB_BUCKET_HALF + SUB_BUCKET_HALF
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(0, int(value))
+        index = self._index(value)
+        with self._lock:
+            if index >= len(self._counts):
+                self._counts.extend([0] * (index + 1 - len(self._counts)))
+            self._counts[index] += 1
+            if self.count == 0 or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+            self.count += 1
+            self.total += value
+
+    def percentiles(self, percentiles):
+        # Highest value equivalent to the value at each of given percentiles
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+            maximum = self.max
+
+        result = []
+        index = 0
+        seen = counts[0]
+        for percentile in percentiles:
+            rank = max(1, int(count * percentile / 100.0 + 0.5)) if count > 0 else 0
+            while seen < rank and index < len(counts) - 1:
+                index += 1
+                seen += counts[index]
+            result.append(min(self._highest_value(index), maximum))
+        return result
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0
+
+
+class Metrics:
+    # Named counters, meters, histograms and gauges (callables returning current value)
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = {}
+        self.meters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metrics, name, factory):
+        metric = metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = metrics.get(name)
+                if metric is None:
+                    metric = metrics[name] = factory()
+        return metric
+
+    def counter(self, name):
+        return self._get(self.counters, name, Counter)
+
+    def meter(self, name):
+        return self._get(self.meters, name, Meter)
+
+    def histogram(self, name):
+        return self._get(self.histograms, name, Histogram)
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def lines(self):
+        # Histogram values are microseconds and are reported in milliseconds
+        lines = [f"uptime {time.monotonic() - self.started:.1f}"]
+        for name, gauge in sorted(self.gauges.items()):
+            lines.append(f"{name} {gauge()}")
+        for name, counter in sorted(self.counters.items()):
+            lines.append(f"{name} {counter.value}")
+        for name, meter in sorted(self.meters.items()):
+            lines.append(f"{name} {meter.value}")
+            lines.append(f"{name}.rate {meter.rate():.1f}")
+        for name, histogram in sorted(self.histograms.items()):
+            values = " ".join(f"p{percentile:g}={value / 1000.0:.3f}" for percentile, value in zip(PERCENTILES, histogram.percentiles(PERCENTILES)))
+            lines.append(f"{name} count={histogram.count} mean={histogram.mean() / 1000.0:.3f} {values} max={histogram.max / 1000.0:.3f}")
+        return lines
+
+
+def self_rss():
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def _prometheus_name(name):
+    return "pyros_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_lines(metrics):
+    # Text exposition format; histograms (in microseconds) are exposed as summaries in seconds
+    lines = ["# TYPE pyros_uptime_seconds gauge", f"pyros_uptime_seconds {time.monotonic() - metrics.started:.3f}"]
+    for name, gauge in sorted(metrics.gauges.items()):
+        lines.append(f"# TYPE {_prometheus_name(name)} gauge")
+        lines.append(f"{_prometheus_name(name)} {gauge()}")
+    for name, counter in sorted(list(metrics.counters.items()) + list(metrics.meters.items()), key=lambda item: item[0]):
+        lines.append(f"# TYPE {_prometheus_name(name)}_total counter")
+        lines.append(f"{_prometheus_name(name)}_total {counter.value}")
+    for name, histogram in sorted(metrics.histograms.items()):
+        prometheus_name = _prometheus_name(name) + "_seconds"
+        lines.append(f"# TYPE {prometheus_name} summary")
+        for percentile, value in zip(PERCENTILES, histogram.percentiles(PERCENTILES)):
+            lines.append(f"{prometheus_name}{{quantile=\"{percentile / 100.0:g}\"}} {value / 1000000.0}")
+        lines.append(f"{prometheus_name}_sum {histogram.total / 1000000.0}")
+        lines.append(f"{prometheus_name}_count {histogram.count}")
+    return lines
@@ -0,0 +1,96 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import os
+import socketserver
+import threading
+import traceback
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_PORT = 0
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        # noinspection PyBroadException
+        try:
+            body = self.server.render().encode("utf-8")
+        except Exception as exception:
+            print("ERROR: Got exception rendering metrics; " + str(exception) + "\n" + ''.join(traceback.format_tb(exception.__traceback__)))
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, _format, *_args):
+        pass
+
+
+class _QuietServer:
+    # Scrapers going away mid response are not worth a stack trace
+    def handle_error(self, _request, _client_address):
+        pass
+
+
+class _TCPHTTPServer(_QuietServer, HTTPServer):
+    pass
+
+
+class _UnixHTTPServer(_QuietServer, socketserver.UnixStreamServer):
+    pass
+
+
+class MetricsServer:
+    # Serves metrics in Prometheus text format over HTTP on its own thread, bound to host and
+    # port or, when 'unix_socket' is given, to that unix socket. 'render' returns whole response body.
+    def __init__(self, render, host=DEFAULT_METRICS_HOST, port=DEFAULT_METRICS_PORT, unix_socket=None):
+        self.render = render
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.server = None
+        self.thread = None
+
+    def enabled(self):
+        return self.port > 0 or self.unix_socket is not None
+
+    def start(self):
+        if self.unix_socket is not None:
+            if os.path.exists(self.unix_socket):
+                os.unlink(self.unix_socket)
+            self.server = _UnixHTTPServer(self.unix_socket, _MetricsHandler)
+        else:
+            self.server = _TCPHTTPServer((self.host, self.port), _MetricsHandler)
+        self.server.render = self.render
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if self.unix_socket is not None and os.path.exists(self.unix_socket):
+                os.unlink(self.unix_socket)
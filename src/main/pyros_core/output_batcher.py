@@ -0,0 +1,61 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import threading
+
+
+DEFAULT_BATCH_INTERVAL = 0.05
+DEFAULT_BATCH_SIZE = 8192
+
+
+class OutputBatcher:
+    # Coalesces output lines (bytes) into a single newline separated payload which is
+    # published after 'interval' seconds or as soon as 'size' bytes are collected. Payload is
+    # never over 'size' bytes, unless it is a single line longer than that.
+    def __init__(self, publish, scheduler, interval=DEFAULT_BATCH_INTERVAL, size=DEFAULT_BATCH_SIZE):
+        self.publish = publish
+        self.scheduler = scheduler
+        self.interval = interval
+        self.size = size
+        self._lines = []
+        self._collected = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, line):
+        self.extend([line])
+
+    def extend(self, lines):
+        with self._lock:
+            for line in lines:
+                # Payload is collected bytes less one separator
+                if len(self._lines) > 0 and self._collected + len(line) > self.size:
+                    self._flush()
+                self._lines.append(line)
+                self._collected += len(line) + 1
+                if self._collected - 1 >= self.size:
+                    self._flush()
+            if len(self._lines) > 0 and self._timer is None:
+                self._timer = self.scheduler.schedule(self.interval, self.flush)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self.scheduler.cancel(self._timer)
+        self._timer = None
+        if len(self._lines) > 0:
+            payload = b"\n".join(self._lines)
+            self._lines = []
+            self._collected = 0
+            self.publish(payload)
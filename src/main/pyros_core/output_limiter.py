@@ -0,0 +1,131 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import threading
+import time
+
+
+DEFAULT_RATE_LINES = 0
+DEFAULT_RATE_BYTES = 0
+DEFAULT_RATE_SAMPLE = 10
+DEFAULT_BACKLOG_LIMIT = 1000
+
+# Lines over the limit are: dropped, only each n-th published, or only kept in logs
+POLICY_DROP = "drop"
+POLICY_SAMPLE = "sample"
+POLICY_DISK = "disk"
+DEFAULT_RATE_POLICY = POLICY_DISK
+
+MAX_MID = 65535
+
+
+class TokenBucket:
+    # Allows 'rate' units a second with bursts of up to one second worth of units
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+
+class OutputLimiter:
+    # Splits process output into lines that can be published and lines over the limit.
+    # Split is called from the output reactor's thread for process' output and from command workers,
+    # boot and shutdown threads for daemon's own messages to the process' output, so it is done under lock.
+    def __init__(self, lines_rate=DEFAULT_RATE_LINES, bytes_rate=DEFAULT_RATE_BYTES, policy=DEFAULT_RATE_POLICY, sample=DEFAULT_RATE_SAMPLE):
+        self.lines = TokenBucket(lines_rate) if lines_rate > 0 else None
+        self.bytes = TokenBucket(bytes_rate) if bytes_rate > 0 else None
+        self.policy = policy if policy in (POLICY_DROP, POLICY_SAMPLE, POLICY_DISK) else DEFAULT_RATE_POLICY
+        self.sample = max(1, sample)
+        self.suppressed = 0
+        self.report_timer = None
+        self._over = 0
+        self._lock = threading.Lock()
+
+    def split(self, lines, congested):
+        # Returns lines to be published and lines over the limit
+        if self.lines is None and self.bytes is None and not congested:
+            return lines, []
+
+        passed = []
+        over = []
+        with self._lock:
+            now = time.monotonic()
+            if self.lines is not None:
+                self.lines.refill(now)
+            if self.bytes is not None:
+                self.bytes.refill(now)
+
+            for line in lines:
+                if (not congested
+                        and (self.lines is None or self.lines.tokens >= 1)
+                        and (self.bytes is None or self.bytes.tokens >= len(line))):
+                    if self.lines is not None:
+                        self.lines.tokens -= 1
+                    if self.bytes is not None:
+                        self.bytes.tokens -= len(line)
+                    passed.append(line)
+                elif self.policy == POLICY_SAMPLE and self._over % self.sample == 0:
+                    self._over += 1
+                    passed.append(line)
+                else:
+                    self._over += 1
+                    over.append(line)
+
+            self.suppressed += len(over)
+        return passed, over
+
+    def take_suppressed(self):
+        with self._lock:
+            suppressed = self.suppressed
+            self.suppressed = 0
+            return suppressed
+
+
+class PublishBacklog:
+    # Number of messages handed to paho but not yet written to the socket. Paho assigns
+    # message ids in sequence (1 to MAX_MID, then 1 again) and, for QoS 0, calls on_publish in
+    # the same order as messages are written. Published ids are counted without wrapping and
+    # sent id is placed relative to the last published one, so backlog is the distance between the two.
+    # Only the last id of several published at once needs to be given to 'sent' and ids given out
+    # of order (from different threads) don't move backlog back. Messages dropped on disconnect are
+    # never published; congestion then clears only when a later message, not counted here
+    # (status such as suppressed lines report), is published.
+    def __init__(self, limit=DEFAULT_BACKLOG_LIMIT):
+        self.limit = limit
+        self._sent = 0
+        self._published = 0
+        self._published_mid = 0
+        self._lock = threading.Lock()
+
+    def sent(self, mid):
+        with self._lock:
+            distance = (mid - self._published_mid) % MAX_MID
+            # Otherwise it is already published
+            if distance < MAX_MID // 2:
+                self._sent = max(self._sent, self._published + distance)
+
+    def published(self, mid):
+        # on_publish is called from paho's network thread only, in order
+        with self._lock:
+            self._published += (mid - self._published_mid) % MAX_MID
+            self._published_mid = mid
+
+    def __len__(self):
+        with self._lock:
+            return max(0, self._sent - self._published)
+
+    def congested(self):
+        return 0 < self.limit <= len(self)
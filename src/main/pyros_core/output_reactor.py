@@ -0,0 +1,169 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import functools
+import os
+import selectors
+import threading
+import traceback
+
+from collections import deque
+
+from pyros_core.child_reaper import ChildReaper
+
+
+READ_CHUNK_SIZE = 65536
+# Longer lines are split
+MAX_LINE_LENGTH = 65536
+
+
+class OutputReactor:
+    # Single thread multiplexing output of all processes, their exit notifications
+    # (through ChildReaper) and any other registered file descriptors. Output is read into
+    # a buffer kept for each stream and passed to on_lines as a list of complete lines (bytes without newlines).
+    def __init__(self, on_lines, on_exit):
+        self.on_lines = on_lines
+        self.on_exit = on_exit
+        self.selector = selectors.DefaultSelector()
+        self.thread = None
+        self.child_reaper = ChildReaper(self)
+        self._pending = deque()
+        self._process_streams = {}
+        self._partial_lines = {}
+        self._buffers = {}
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        self.selector.register(self._wakeup_read, selectors.EVENT_READ, None)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def register_process(self, process_id, process, reaper=None):
+        # Reaper is what reports process' exit - ChildReaper unless given (for processes that are not our children)
+        self._pending.append(functools.partial(self._register_process, process_id, process, reaper if reaper is not None else self.child_reaper))
+        self._wakeup()
+
+    def add_reader(self, fd, callback):
+        self._pending.append(functools.partial(self.add_reader_now, fd, callback))
+        self._wakeup()
+
+    def add_reader_now(self, fd, callback):
+        # Only from reactor's thread
+        self.selector.register(fd, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fd):
+        # Only from reactor's thread
+        self.selector.unregister(fd)
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _register_pending(self):
+        while len(self._pending) > 0:
+            self._pending.popleft()()
+
+    def _register_process(self, process_id, process, reaper):
+        streams = [stream for stream in (process.stdout, process.stderr) if stream is not None]
+        self._process_streams[process] = streams
+        for stream in streams:
+            fd = stream.fileno()
+            os.set_blocking(fd, False)
+            self._partial_lines[fd] = b""
+            self._buffers[fd] = bytearray(READ_CHUNK_SIZE)
+            self.add_reader_now(fd, functools.partial(self._read, process_id, process, stream))
+
+        reaper.watch(process, functools.partial(self._process_reaped, process_id, process))
+
+    def _read(self, process_id, process, stream):
+        fd = stream.fileno()
+        buffer = self._buffers[fd]
+        try:
+            count = stream.readinto(buffer)
+        except OSError:
+            count = 0
+
+        if count is None:
+            # Nothing to read from non-blocking stream
+            return False
+
+        if count == 0:
+            self._close_stream(process_id, process, stream)
+            return False
+
+        # Complete lines are copied out of the buffer in one go and split at C speed
+        with memoryview(buffer) as view:
+            partial_line = self._partial_lines[fd]
+            end = buffer.rfind(b"\n", 0, count)
+            if end < 0:
+                partial_line += view[:count]
+                lines = []
+            else:
+                lines = (partial_line + view[:end]).split(b"\n")
+                partial_line = view[end + 1:count].tobytes()
+
+        if len(partial_line) >= MAX_LINE_LENGTH:
+            lines.append(partial_line)
+            partial_line = b""
+        self._partial_lines[fd] = partial_line
+
+        if len(lines) > 0:
+            self.on_lines(process_id, lines)
+        return True
+
+    def _close_stream(self, process_id, process, stream):
+        fd = stream.fileno()
+        self.remove_reader(fd)
+        del self._buffers[fd]
+        partial_line = self._partial_lines.pop(fd)
+        if len(partial_line) > 0:
+            self.on_lines(process_id, [partial_line])
+        stream.close()
+
+        streams = self._process_streams[process]
+        streams.remove(stream)
+        if len(streams) == 0:
+            del self._process_streams[process]
+
+    def _process_reaped(self, process_id, process, child_exit):
+        # Everything process wrote before it exited is already in the pipes so drain them
+        # before reporting exit. Streams stay registered if something else (a grandchild) still holds them open.
+        for stream in list(self._process_streams.get(process, [])):
+            while self._read(process_id, process, stream):
+                pass
+
+        self.on_exit(process_id, process, child_exit)
+
+    def _run(self):
+        while True:
+            # noinspection PyBroadException
+            try:
+                for key, _events in self.selector.select():
+                    if key.data is None:
+                        self._drain_wakeup()
+                        self._register_pending()
+                    else:
+                        key.data()
+            except Exception as exception:
+                print("ERROR: Got exception in output reactor; " + str(exception) + "\n" + ''.join(traceback.format_tb(exception.__traceback__)))
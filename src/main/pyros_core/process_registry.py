@@ -0,0 +1,175 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import threading
+
+from enum import Enum
+
+
+class ProcessType(Enum):
+    PROCESS = "process"
+    SERVICE = "service"
+    AGENT = "agent"
+
+    @staticmethod
+    def from_name(name):
+        try:
+            return ProcessType(name)
+        except ValueError:
+            return ProcessType.PROCESS
+
+
+class ProcessState(Enum):
+    NEW = "new"
+    RUNNING = "running"
+    STOPPED = "stopped"
+
+
+class StopRequest:
+    __slots__ = ["restart", "killed", "timer"]
+
+    def __init__(self, restart, timer):
+        self.restart = restart
+        self.killed = False
+        self.timer = timer
+
+
+class ProcessRecord:
+    __slots__ = ["process_id", "type", "enabled", "executable", "state", "process", "old",
+                 "last_ping", "stop_response", "stopping", "logs", "log_store", "batcher", "limiter",
+                 "rusage", "resources", "output_lines", "output_suppressed", "restarts"]
+
+    def __init__(self, process_id, process_type=ProcessType.PROCESS, executable="python3"):
+        self.process_id = process_id
+        self.type = process_type
+        self.enabled = False
+        self.executable = executable
+        self.state = ProcessState.NEW
+        self.process = None
+        self.old = False
+        self.last_ping = None
+        self.stop_response = False
+        self.stopping = None
+        self.logs = None
+        self.log_store = None
+        self.batcher = None
+        self.limiter = None
+        self.rusage = None
+        self.resources = None
+        self.output_lines = 0
+        self.output_suppressed = 0
+        self.restarts = 0
+
+    def type_name(self):
+        if self.type == ProcessType.SERVICE and not self.enabled:
+            return "service(disabled)"
+        return self.type.value
+
+
+class RegistrySnapshot:
+    # Immutable view of the registry - never changed once published
+    __slots__ = ["records", "services", "agents", "running"]
+
+    def __init__(self, records, services, agents, running):
+        self.records = records
+        self.services = services
+        self.agents = agents
+        self.running = running
+
+
+class ProcessRegistry:
+    # Process records by process id with secondary indexes of services, agents and running processes.
+    # Type and state of records must be changed through registry so indexes are kept up to date.
+    # Writers, serialised by a lock, publish a new snapshot (copy on write) with a single assignment,
+    # so readers never lock and always iterate a consistent view.
+    def __init__(self):
+        self._snapshot = RegistrySnapshot({}, frozenset(), frozenset(), frozenset())
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def services(self):
+        return self._snapshot.services
+
+    @property
+    def agents(self):
+        return self._snapshot.agents
+
+    @property
+    def running(self):
+        return self._snapshot.running
+
+    def __contains__(self, process_id):
+        return process_id in self._snapshot.records
+
+    def __getitem__(self, process_id):
+        return self._snapshot.records[process_id]
+
+    def __iter__(self):
+        return iter(self._snapshot.records)
+
+    def __len__(self):
+        return len(self._snapshot.records)
+
+    def get(self, process_id):
+        return self._snapshot.records.get(process_id)
+
+    def records(self):
+        return self._snapshot.records.values()
+
+    def add(self, record):
+        with self._lock:
+            records = dict(self._snapshot.records)
+            records[record.process_id] = record
+            self._publish(record.process_id, records)
+        return record
+
+    def remove(self, process_id):
+        with self._lock:
+            records = dict(self._snapshot.records)
+            record = records.pop(process_id, None)
+            if record is not None:
+                self._publish(process_id, records)
+        return record
+
+    def set_type(self, record, process_type):
+        with self._lock:
+            record.type = process_type
+            self._publish(record.process_id, self._snapshot.records)
+
+    def set_running(self, record, process):
+        with self._lock:
+            record.process = process
+            record.state = ProcessState.RUNNING
+            self._publish(record.process_id, self._snapshot.records)
+
+    def set_stopped(self, record):
+        with self._lock:
+            record.state = ProcessState.STOPPED
+            self._publish(record.process_id, self._snapshot.records)
+
+    def _publish(self, process_id, records):
+        # Called with lock held; only indexes of given process id can have changed
+        def index(current, member):
+            if (process_id in current) == member:
+                return current
+            return current | {process_id} if member else current - {process_id}
+
+        record = records.get(process_id)
+        snapshot = self._snapshot
+        self._snapshot = RegistrySnapshot(
+            records,
+            index(snapshot.services, record is not None and record.type == ProcessType.SERVICE),
+            index(snapshot.agents, record is not None and record.type == ProcessType.AGENT),
+            index(snapshot.running, record is not None and record.state == ProcessState.RUNNING))
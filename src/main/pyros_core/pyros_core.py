@@ -14,6 +14,8 @@
 
 import argparse
 import os
+import shutil
+import signal
 import sys
 import time
 import subprocess
@@ -22,28 +24,93 @@ import traceback
 
 import paho.mqtt.client as mqtt
 
-from queue import Queue, Empty
-from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 
+from pyros_core.agent_watchdog import AgentWatchdog
+from pyros_core.archive_installer import ArchiveError, install_archive, recover
+from pyros_core.code_compiler import CodeCompiler
+from pyros_core.command_executor import CommandExecutor
+from pyros_core.log_buffer import LogRingBuffer, DEFAULT_LOG_BUFFER_SIZE
+from pyros_core.log_query import LogQuery
+from pyros_core.log_store import LogWriter, SegmentedLog, DEFAULT_SEGMENT_SIZE, DEFAULT_MAX_SEGMENTS, DEFAULT_FSYNC_INTERVAL
+from pyros_core.metrics import Metrics, self_rss, prometheus_label, prometheus_lines
+from pyros_core.metrics_server import MetricsServer
+from pyros_core.output_batcher import OutputBatcher, DEFAULT_BATCH_INTERVAL, DEFAULT_BATCH_SIZE
+from pyros_core.output_limiter import OutputLimiter, PublishBacklog, POLICY_DISK, DEFAULT_RATE_LINES, DEFAULT_RATE_BYTES, DEFAULT_RATE_POLICY, DEFAULT_RATE_SAMPLE
+from pyros_core.output_reactor import OutputReactor
+from pyros_core.process_registry import ProcessRegistry, ProcessRecord, ProcessState, ProcessType, StopRequest
+from pyros_core.resource_sampler import ResourceSampler
+from pyros_core.scheduler import Scheduler
+from pyros_core.service_boot import ServiceBoot, BootState, READY_STATUS, DEFAULT_BOOT_CONCURRENCY, DEFAULT_READY_TIMEOUT
+from pyros_core.upload_receiver import UploadReceiver
+from pyros_core.zygote import Zygote, DEFAULT_ZYGOTE_PRELOAD, DEFAULT_ZYGOTE_EXEC
+
 
 DEFAULT_TIMEOUT = 60
 DEFAULT_RECONNECT_RETRIES = 20  # number of reconnect timeouts before process exits
 
 DEFAULT_THREAD_KILL_TIMEOUT = 1.0
+DEFAULT_SHUTDOWN_TIMEOUT = 8.0
+DEFAULT_PUBLISH_TIMEOUT = 1.0
+DEFAULT_SUPPRESSED_REPORT_INTERVAL = 5.0
+
+# Commands for which time from receiving message to command being handled is measured
+TIMED_COMMANDS = {"start", "stop", "restart"}
+TIMED_SYSTEM_COMMANDS = {"ps"}
+
+MAX_CACHED_PROCESS_IDS = 1024
 
-DEFAULT_AGENTS_CHECK_TIMEOUT = 1.0
-DEFAULT_AGENT_KILL_TIMEOT = 180
 DEFAULT_DEBUG_LEVEL = 1
+DEFAULT_OUTPUT_BATCH = False
+DEFAULT_LOGS_PERSIST = False
+
+
+def read_config_str(cfg, property_name, default):
+    return cfg[property_name] if property_name in cfg else default
+
+
+def read_config_int(cfg, property_name, default):
+    if property_name in cfg:
+        # noinspection PyBroadException
+        try:
+            return int(cfg[property_name])
+        except Exception:
+            print(f"  error: cannot convert '{property_name}' to integer; got '{cfg[property_name]}'")
+    return default
+
+
+def read_config_float(cfg, property_name, default):
+    if property_name in cfg:
+        # noinspection PyBroadException
+        try:
+            return float(cfg[property_name])
+        except Exception:
+            print(f"  error: cannot convert '{property_name}' to float; got '{cfg[property_name]}'")
+    return default
+
+
+def read_config_bool(cfg, property_name, default):
+    if property_name in cfg:
+        return cfg[property_name].lower() in ["true", "yes", "1"]
+    return default
 
 
 class PyrosDaemon:
     def __init__(self):
-        self.do_exit = False
+        self.exit_event = threading.Event()
         self.home_dir = os.path.abspath(os.getcwd())
         self.thread_kill_timeout = DEFAULT_THREAD_KILL_TIMEOUT
-        self.agents_check_timeout = DEFAULT_AGENTS_CHECK_TIMEOUT
-        self.agents_kill_timeout = DEFAULT_AGENT_KILL_TIMEOT
+        self.shutdown_timeout = DEFAULT_SHUTDOWN_TIMEOUT
+        self.shutting_down = False
+        self.boot_concurrency = DEFAULT_BOOT_CONCURRENCY
+        self.boot_ready_timeout = DEFAULT_READY_TIMEOUT
+        self.service_boot = None
+        self.zygote = None
+        self.zygote_failed = False
+        self.zygote_exec = DEFAULT_ZYGOTE_EXEC
+        self.zygote_preload = DEFAULT_ZYGOTE_PRELOAD
+        self.zygote_lock = threading.Lock()
+        self.code_compiler = CodeCompiler()
         self.debug_level = DEFAULT_DEBUG_LEVEL
         self.code_dir_name = "code"
         self.data_dir_name = "data"
@@ -54,7 +121,46 @@ class PyrosDaemon:
         self.max_reconnect_retries = DEFAULT_RECONNECT_RETRIES
         self.this_cluster_id = None
         self.client = None
-        self.processes = {}
+        self.processes = ProcessRegistry()
+        self.scheduler = Scheduler()
+        self.output_reactor = OutputReactor(self.process_output, self.process_exited)
+        self.process_exit_condition = threading.Condition()
+        self.agent_watchdog = AgentWatchdog(self.scheduler, self._agent_expired)
+        self.output_batch = DEFAULT_OUTPUT_BATCH
+        self.output_batch_interval = DEFAULT_BATCH_INTERVAL
+        self.output_batch_size = DEFAULT_BATCH_SIZE
+        self.output_rate_lines = DEFAULT_RATE_LINES
+        self.output_rate_bytes = DEFAULT_RATE_BYTES
+        self.output_rate_policy = DEFAULT_RATE_POLICY
+        self.output_rate_sample = DEFAULT_RATE_SAMPLE
+        self.suppressed_report_interval = DEFAULT_SUPPRESSED_REPORT_INTERVAL
+        self.publish_backlog = PublishBacklog()
+        self.resource_sampler = ResourceSampler(self.scheduler, self._resource_roots, self._resources_sampled)
+        self.metrics = Metrics()
+        self.metrics.gauge("threads", threading.active_count)
+        self.metrics.gauge("rss.bytes", self_rss)
+        self.metrics.gauge("publish.backlog", lambda: len(self.publish_backlog))
+        self.metrics.gauge("processes.running", lambda: len(self.processes.running))
+        self.output_lines = self.metrics.meter("output.lines")
+        self.output_suppressed = self.metrics.meter("output.suppressed")
+        self.metrics_server = MetricsServer(self.prometheus_metrics)
+        # Topic, function returning key commands are serialised on (None - ignore message), handler
+        self.routes = [
+            ("system/+", self._system_key, self._on_system_command),
+            ("exec/+", self._process_key, self._on_process_command),
+            ("exec/+/process", self._process_key, self._on_process_code),
+            ("exec/+/process/#", self._process_key, self._on_extra_code),
+            ("exec/+/upload", self._process_key, self._on_upload),
+            ("exec/+/system/stop", self._process_key, self._on_stop_response)
+        ]
+        self.command_executor = CommandExecutor()
+        self.upload_receiver = UploadReceiver(self._upload_stored, self.output_status, self._install_archive)
+        self._local_process_ids = {}
+        self.logs_buffer_size = DEFAULT_LOG_BUFFER_SIZE
+        self.logs_persist = DEFAULT_LOGS_PERSIST
+        self.logs_segment_size = DEFAULT_SEGMENT_SIZE
+        self.logs_max_segments = DEFAULT_MAX_SEGMENTS
+        self.log_writer = LogWriter()
 
     @staticmethod
     def important(line):
@@ -73,27 +179,6 @@ class PyrosDaemon:
             print(line)
 
     def process_configuration(self, name, arguments):
-        def read_config_str(cfg, property_name, default):
-            return cfg[property_name] if property_name in cfg else default
-
-        def read_config_int(cfg, property_name, default):
-            if property_name in cfg:
-                # noinspection PyBroadException
-                try:
-                    return int(cfg[property_name])
-                except Exception:
-                    print(f"  error: cannot convert '{property_name}' to integer; got '{cfg[property_name]}'")
-            return default
-
-        def read_config_float(cfg, property_name, default):
-            if property_name in cfg:
-                # noinspection PyBroadException
-                try:
-                    return float(cfg[property_name])
-                except Exception:
-                    print(f"  error: cannot convert '{property_name}' to float; got '{cfg[property_name]}'")
-            return default
-
         def ensure_dir(dir_name):
             path = os.path.join(self.home_dir, dir_name)
             if not os.path.exists(path):
@@ -175,9 +260,36 @@ class PyrosDaemon:
         if 'PYROS_CLUSTER_ID' in os.environ:
             self.this_cluster_id = os.environ['PYROS_CLUSTER_ID']
 
-        self.agents_kill_timeout = read_config_int(config, 'agents.kill.timeout', self.agents_kill_timeout)
-        self.agents_check_timeout = read_config_float(config, 'agents.check.timeout', self.agents_check_timeout)
+        self.agent_watchdog.timeout = read_config_int(config, 'agents.kill.timeout', self.agent_watchdog.timeout)
         self.thread_kill_timeout = read_config_float(config, 'thread.kill.timeout', self.thread_kill_timeout)
+        self.shutdown_timeout = read_config_float(config, 'shutdown.timeout', self.shutdown_timeout)
+        self.boot_concurrency = read_config_int(config, 'services.boot.concurrency', self.boot_concurrency)
+        self.boot_ready_timeout = read_config_float(config, 'services.ready.timeout', self.boot_ready_timeout)
+        self.zygote_exec = read_config_str(config, 'zygote.exec', self.zygote_exec)
+        self.zygote_preload = read_config_str(config, 'zygote.preload', self.zygote_preload)
+        self.code_compiler.pycache_prefix = read_config_str(config, 'python.pycache.prefix', self.code_compiler.pycache_prefix)
+
+        self.logs_buffer_size = read_config_int(config, 'logs.buffer.size', self.logs_buffer_size)
+        self.logs_persist = read_config_bool(config, 'logs.persist', self.logs_persist)
+        self.logs_segment_size = read_config_int(config, 'logs.segment.size', self.logs_segment_size)
+        self.logs_max_segments = read_config_int(config, 'logs.segments.max', self.logs_max_segments)
+        self.log_writer.fsync_interval = read_config_float(config, 'logs.fsync.interval', DEFAULT_FSYNC_INTERVAL)
+
+        self.output_batch = read_config_bool(config, 'output.batch', self.output_batch)
+        self.output_batch_interval = read_config_float(config, 'output.batch.interval', self.output_batch_interval)
+        self.output_batch_size = read_config_int(config, 'output.batch.size', self.output_batch_size)
+        self.output_rate_lines = read_config_float(config, 'output.rate.lines', self.output_rate_lines)
+        self.output_rate_bytes = read_config_float(config, 'output.rate.bytes', self.output_rate_bytes)
+        self.output_rate_policy = read_config_str(config, 'output.rate.policy', self.output_rate_policy)
+        self.output_rate_sample = read_config_int(config, 'output.rate.sample', self.output_rate_sample)
+        self.suppressed_report_interval = read_config_float(config, 'output.suppressed.interval', self.suppressed_report_interval)
+        self.publish_backlog.limit = read_config_int(config, 'output.backlog.limit', self.publish_backlog.limit)
+        self.command_executor.workers = read_config_int(config, 'commands.workers', self.command_executor.workers)
+        self.upload_receiver.timeout = read_config_float(config, 'upload.timeout', self.upload_receiver.timeout)
+        self.resource_sampler.interval = read_config_float(config, 'resources.interval', self.resource_sampler.interval)
+        self.metrics_server.host = read_config_str(config, 'metrics.http.host', self.metrics_server.host)
+        self.metrics_server.port = read_config_int(config, 'metrics.http.port', self.metrics_server.port)
+        self.metrics_server.unix_socket = read_config_str(config, 'metrics.http.socket', self.metrics_server.unix_socket)
 
     def complex_process_id(self, process_id: str) -> str:
         if self.this_cluster_id is not None:
@@ -231,34 +343,148 @@ class PyrosDaemon:
             f.write(lines)
 
     def is_running(self, process_id: str) -> bool:
-        if process_id in self.processes:
-            process = self.get_process_process(process_id)
-            if process is not None:
-                return_code = process.returncode
-                if return_code is None:
-                    return True
-    
-        return False
+        return process_id in self.processes.running
+
+    def _publish_output(self, process_id, payload):
+        self.publish_backlog.sent(self.client.publish("exec/" + self.complex_process_id(process_id) + "/out", payload).mid)
+
+    def on_publish(self, _mqtt_client, _data, mid):
+        self.publish_backlog.published(mid)
+
+    def configure_output(self, process_id: str, properties: Dict[str, str]) -> None:
+        record = self.processes[process_id]
+        if record.batcher is not None:
+            record.batcher.flush()
+            record.batcher = None
+
+        if read_config_bool(properties, "output.batch", self.output_batch):
+            record.batcher = OutputBatcher(
+                lambda payload: self._publish_output(process_id, payload),
+                self.scheduler,
+                read_config_float(properties, "output.batch.interval", self.output_batch_interval),
+                read_config_int(properties, "output.batch.size", self.output_batch_size))
+
+        if record.limiter is not None:
+            self.scheduler.cancel(record.limiter.report_timer)
+            self._report_suppressed(process_id, record.limiter)
+        record.limiter = OutputLimiter(
+            read_config_float(properties, "output.rate.lines", self.output_rate_lines),
+            read_config_float(properties, "output.rate.bytes", self.output_rate_bytes),
+            properties.get("output.rate.policy", self.output_rate_policy),
+            read_config_int(properties, "output.rate.sample", self.output_rate_sample))
+
+    def _report_suppressed(self, process_id, limiter):
+        limiter.report_timer = None
+        suppressed = limiter.take_suppressed()
+        if suppressed > 0:
+            self.output_status(process_id, f"PyROS: suppressed {suppressed} lines ({limiter.policy})")
+
+    def log_buffer(self, process_id: str) -> LogRingBuffer:
+        record = self.processes[process_id]
+        if record.logs is None:
+            record.logs = LogRingBuffer(self.logs_buffer_size)
+        return record.logs
+
+    def configure_logs(self, process_id: str, properties: Dict[str, str]) -> None:
+        record = self.processes[process_id]
+        if read_config_bool(properties, "logs.persist", self.logs_persist):
+            if record.log_store is None:
+                # noinspection PyBroadException
+                try:
+                    record.log_store = SegmentedLog(
+                        os.path.join(self.home_dir, self.logs_dir_name, process_id),
+                        read_config_int(properties, "logs.segment.size", self.logs_segment_size),
+                        read_config_int(properties, "logs.segments.max", self.logs_max_segments))
+                except Exception as e:
+                    self.important(f"ERROR: Cannot open persistent logs for {process_id}; {e}")
+        elif record.log_store is not None:
+            self.log_writer.close_log(record.log_store)
+            record.log_store = None
+
+        buffer_size = read_config_int(properties, "logs.buffer.size", self.logs_buffer_size)
+        if record.logs is not None and record.logs.capacity == buffer_size:
+            return
+
+        old_logs = record.logs
+        try:
+            logs = LogRingBuffer(buffer_size, old_logs.first_offset if old_logs is not None else 0)
+        except ValueError as e:
+            self.important(f"ERROR: Cannot configure logs for {process_id}; {e}")
+            return
 
-    def _output(self, process_id, line):
-        line = line[:-1] if  line.endswith("\n") else line
+        if old_logs is not None:
+            for _, timestamp, line in old_logs.records():
+                logs.append(line, timestamp)
+        record.logs = logs
 
-        self.client.publish("exec/" + self.complex_process_id(process_id) + "/out", line)
-        if self.debug_level > 2:
-            self.trace("exec/" + self.complex_process_id(process_id) + "/out > " + line)
+    def flush_output(self, process_id: str) -> None:
+        record = self.processes.get(process_id)
+        if record is not None and record.batcher is not None:
+            record.batcher.flush()
 
     def output(self, process_id, line):
-        if "logs" not in self.processes[process_id]:
-            logs = []
-            self.processes[process_id]["logs"] = logs
+        line = line[:-1] if line.endswith("\n") else line
+        self.process_output(process_id, [line.encode("utf-8")])
+
+    @staticmethod
+    def _valid_utf8(line: bytes) -> bytes:
+        try:
+            line.decode("utf-8")
+            return line
+        except UnicodeDecodeError:
+            return line.decode("utf-8", errors="replace").encode("utf-8")
+
+    def process_output(self, process_id, lines):
+        # Lines are kept as bytes all the way to publish; only ones that are not plain ascii
+        # are checked as clients expect valid utf-8 (native executables can output anything)
+        lines = [line if line.isascii() else self._valid_utf8(line) for line in lines]
+
+        record = self.processes.get(process_id)
+        if record is not None:
+            timestamp = time.time()
+            service_boot = self.service_boot
+            if service_boot is not None:
+                for line in lines:
+                    service_boot.line(process_id, line)
+
+            # Lines over process' rate limit (or all while broker is behind) are not published;
+            # with 'disk' policy they are still logged
+            limiter = record.limiter
+            if limiter is not None:
+                published, over = limiter.split(lines, self.publish_backlog.congested())
+                if len(over) > 0:
+                    self.output_suppressed.mark(len(over))
+                    record.output_suppressed += len(over)
+                    if limiter.policy != POLICY_DISK:
+                        lines = published
+                    if limiter.report_timer is None:
+                        limiter.report_timer = self.scheduler.schedule(self.suppressed_report_interval, self._report_suppressed, process_id, limiter)
+            else:
+                published = lines
+
+            (record.logs if record.logs is not None else self.log_buffer(process_id)).extend(lines, timestamp)
+            if record.log_store is not None:
+                self.log_writer.extend(record.log_store, timestamp, lines)
+            lines = published
+            record.output_lines += len(lines)
+
+        if len(lines) == 0:
+            return
+
+        self.output_lines.mark(len(lines))
+        if record is not None and record.batcher is not None:
+            record.batcher.extend(lines)
+            if self.debug_level > 2:
+                for line in lines:
+                    self.trace("exec/" + self.complex_process_id(process_id) + "/out (batched) > " + line.decode("utf-8"))
         else:
-            logs = self.processes[process_id]["logs"]
-    
-        if len(logs) > 1000:
-            del logs[0]
-    
-        logs.append(line)
-        self._output(process_id, line)
+            topic = "exec/" + self.complex_process_id(process_id) + "/out"
+            message_info = None
+            for line in lines:
+                message_info = self.client.publish(topic, line)
+                if self.debug_level > 2:
+                    self.trace(topic + " > " + line.decode("utf-8"))
+            self.publish_backlog.sent(message_info.mid)
     
     def output_status(self, process_id, status):
         self.client.publish("exec/" + self.complex_process_id(process_id) + "/status", status)
@@ -266,52 +492,62 @@ class PyrosDaemon:
             self.trace("exec/" + self.complex_process_id(process_id) + "/status > " + status)
 
     def system_output(self, command_id, line):
-        self.client.publish("system/" + command_id + "/out", line + "\n")
+        message_info = self.client.publish("system/" + command_id + "/out", line + "\n")
         if self.debug_level > 2:
             if line.endswith("\n"):
                 self.trace("system/" + command_id + "/out > " + line[:len(line) - 1])
             else:
                 self.trace("system/" + command_id + "/out > " + line)
+        return message_info
     
     def system_output_eof(self, command_id):
-        self.client.publish("system/" + command_id + "/out", "")
-
-    def is_service(self, process_id: str) -> str:
-        return process_id in self.processes and self.processes[process_id]["type"] == "service"
-    
-    def is_agent(self, process_id: str) -> str:
-        return process_id in self.processes and self.processes[process_id]["type"] == "agent"
-
-    def run_process(self, process_id: str) -> None:
-        def _enqueue_output(file, queue):
-            for _line in iter(file.readline, ''):
-                queue.put(_line)
-            file.close()
-
-        def _read_popen_pipes(p):
-            with ThreadPoolExecutor(2) as pool:
-                q_stdout, q_stderr = Queue(), Queue()
+        return self.client.publish("system/" + command_id + "/out", "")
 
-                pool.submit(_enqueue_output, p.stdout, q_stdout)
-                pool.submit(_enqueue_output, p.stderr, q_stderr)
+    def is_service(self, process_id: str) -> bool:
+        return process_id in self.processes.services
 
-                while True:
-                    if p.poll() is not None and q_stdout.empty() and q_stderr.empty():
-                        break
+    def is_agent(self, process_id: str) -> bool:
+        return process_id in self.processes.agents
 
-                    try:
-                        stdout_line = q_stdout.get_nowait()
-                    except Empty:
-                        stdout_line = ""
-
-                    try:
-                        strerr_line = q_stderr.get_nowait()
-                    except Empty:
-                        strerr_line = ""
+    def process_environment(self) -> Dict[str, str]:
+        new_env = os.environ.copy()
+        code_dir = os.path.join(self.home_dir, self.code_dir_name)
+        if "PYTHONPATH" in new_env:
+            new_env["PYTHONPATH"] = new_env["PYTHONPATH"] + ":" + code_dir
+        else:
+            new_env["PYTHONPATH"] = code_dir
+
+        new_env["PYROS_MQTT"] = self.host + ":" + str(self.port)
+        new_env["PYROS_CODE"] = code_dir
+        new_env["PYROS_LOGS"] = os.path.join(self.home_dir, self.logs_dir_name)
+        new_env["PYROS_DATA"] = os.path.join(self.home_dir, self.data_dir_name)
+        if self.code_compiler.pycache_prefix is not None:
+            new_env["PYTHONPYCACHEPREFIX"] = self.code_compiler.pycache_prefix
+        return new_env
+
+    def get_zygote(self):
+        with self.zygote_lock:
+            if self.zygote_failed:
+                # Processes are started without zygote rather than waiting for it to fail again
+                return None
+            if self.zygote is None or not self.zygote.is_running():
+                self.info("Starting zygote preloading " + self.zygote_preload)
+                zygote = Zygote(self.output_reactor, self.zygote_exec, [module.strip() for module in self.zygote_preload.split(",")])
+                # noinspection PyBroadException
+                try:
+                    zygote.start(self.process_environment())
+                except Exception as exception:
+                    self.important("PyROS ERROR: cannot start zygote; " + str(exception))
+                    self.zygote_failed = True
+                    return None
+                self.zygote = zygote
+            return self.zygote
 
-                    yield stdout_line, strerr_line
+    @staticmethod
+    def uses_zygote(record, properties) -> bool:
+        return properties.get("zygote") == "True" and record.executable.startswith("python")
 
-        time.sleep(0.25)
+    def run_process(self, process_id: str) -> None:
         process_is_service = self.is_service(process_id)
     
         if process_is_service:
@@ -320,28 +556,18 @@ class PyrosDaemon:
             self.info("Starting new process " + process_id)
     
         filename = self.process_filename(process_id)
+        reaper = None
         try:
             subprocess_dir = os.path.join(self.home_dir, os.path.dirname(filename))
             self.debug("Starting " + filename + " at dir " + subprocess_dir)
     
-            new_env = os.environ.copy()
-            code_dir = os.path.join(self.home_dir, self.code_dir_name)
-            if "PYTHONPATH" in new_env:
-                new_env["PYTHONPATH"] = new_env["PYTHONPATH"] + ":" + code_dir
-            else:
-                new_env["PYTHONPATH"] = code_dir
+            new_env = self.process_environment()
+            record = self.processes[process_id]
+            properties = self.load_service_file(process_id)
+            self.configure_logs(process_id, properties)
+            self.configure_output(process_id, properties)
 
-            new_env["PYROS_MQTT"] = self.host + ":" + str(self.port)
-            new_env["PYROS_CODE"] = code_dir
-            new_env["PYROS_LOGS"] = os.path.join(self.home_dir, self.logs_dir_name)
-            new_env["PYROS_DATA"] = os.path.join(self.home_dir, self.data_dir_name)
-            process_def = self.processes[process_id]
-    
-            if "exec" in process_def:
-                executable = process_def["exec"]
-            else:
-                executable = "python3"
-    
+            executable = record.executable
             if executable.startswith("python"):
                 command = [executable, "-u", process_id + "_main.py", process_id]
             else:
@@ -353,87 +579,72 @@ class PyrosDaemon:
             elif self.debug_level > 1:
                 self.debug(f"Starting {command}")
 
-            process = subprocess.Popen(command,
-                                       env=new_env,
-                                       bufsize=0,
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE,
-                                       shell=False,
-                                       universal_newlines=True,
-                                       cwd=subprocess_dir)
+            process = None
+            if self.uses_zygote(record, properties):
+                zygote = self.get_zygote()
+                if zygote is not None:
+                    process = zygote.spawn(command[2:], subprocess_dir, new_env, [subprocess_dir] + new_env["PYTHONPATH"].split(":"))
+                    reaper = zygote
+                else:
+                    self.important("PyROS WARNING: zygote is not available; starting " + process_id + " as new process")
+
+            if process is None:
+                process = subprocess.Popen(command,
+                                           env=new_env,
+                                           bufsize=0,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE,
+                                           shell=False,
+                                           cwd=subprocess_dir,
+                                           start_new_session=True)
             self.output_status(process_id, "PyROS: started process.")
         except Exception as exception:
             self.important("Start file " + filename + " (" + os.path.abspath(filename) + ") failed; " + str(exception))
             self.output_status(process_id, "PyROS: exit.")
+            if self.service_boot is not None:
+                self.service_boot.failed(process_id, "failed to start; " + str(exception))
             return
     
-        self.processes[process_id]["process"] = process
-        if "old" in self.processes[process_id]:
-            del self.processes[process_id]["old"]
-
-        # pid = process.pid
-
-        process.poll()
-
-        return_code = process.returncode
-        while return_code is None:
-            for out_line, err_line in _read_popen_pipes(process):
-                if err_line is not None and err_line != "":
-                    self.output(process_id, err_line)
-                if out_line is not None and out_line != "":
-                    self.output(process_id, out_line)
-                # print(out_line, end='')
-                # print(err_line, end='')
-                if out_line == "" and err_line == "":
-                    time.sleep(0.25)
-            return_code = process.poll()
-
-        # noinspection PyBroadException
-        try:
-            for line in process.stdout.readlines():
-                if len(line) > 0:
-                    self.output(process_id, line)
-        except Exception:
-            pass
-
-        # noinspection PyBroadException
-        try:
-            for line in process.stderr.readlines():
-                if len(line) > 0:
-                    self.output(process_id, line)
-        except Exception:
-            pass
-
-        self.output_status(process_id, "PyROS: exit " + str(process.returncode))
+        self.processes.set_running(record, process)
+        record.old = False
+        if record.type == ProcessType.AGENT:
+            # Armed only once agent is running; expiring before that would find nothing to stop
+            self.agent_watchdog.watch(process_id, record.last_ping)
+
+        if self.service_boot is not None:
+            self.service_boot.started(process_id)
+        self.output_reactor.register_process(process_id, process, reaper)
+
+    def process_exited(self, process_id: str, process, child_exit) -> None:
+        self.flush_output(process_id)
+        self.output_status(process_id, "PyROS: exit " + str(child_exit.returncode))
+        if self.service_boot is not None:
+            self.service_boot.failed(process_id, "exited with " + str(child_exit.returncode) + " before it was ready")
+
+        record = self.processes.get(process_id)
+        if record is not None and record.process is process:
+            record.rusage = child_exit.rusage
+            with self.process_exit_condition:
+                self.processes.set_stopped(record)
+                self.process_exit_condition.notify_all()
+            if record.stopping is not None:
+                stopping = record.stopping
+                record.stopping = None
+                self.scheduler.cancel(stopping.timer)
+                self.scheduler.call_soon(self._complete_stop, process_id, process, stopping)
 
     def get_process_type_name(self, process_id: str) -> str:
-        if self.is_service(process_id):
-            if "enabled" in self.processes[process_id] and self.processes[process_id]["enabled"] == "True":
-                return "service"
-            else:
-                return "service(disabled)"
-        elif self.is_agent(process_id):
-            return "agent"
-        elif "type" in self.processes[process_id]:
-            return self.processes[process_id]["type"]
-        else:
-            return "process"
+        return self.processes[process_id].type_name()
 
     def get_process_process(self, process_id: str):
-        if process_id in self.processes:
-            if "process" in self.processes[process_id]:
-                return self.processes[process_id]["process"]
-    
-        return None
+        record = self.processes.get(process_id)
+        return record.process if record is not None else None
 
     def start_process(self, process_id: str) -> None:
         if process_id in self.processes:
-            process = self.get_process_process(process_id)
-            if process is not None:
-                return_code = process.returncode
-                if return_code is None:
-                    self.output(process_id, "PyrROS WARNING: process " + process_id + " is already running")
-                    return
+            if self.is_running(process_id):
+                self.output(process_id, "PyrROS WARNING: process " + process_id + " is already running")
+                return
 
             thread = threading.Thread(target=self.run_process, args=(process_id,), daemon=True)
             thread.start()
@@ -450,19 +661,13 @@ class PyrosDaemon:
 
     def store_code(self, process_id, payload):
         if process_id in self.processes:
-            self.processes[process_id]["old"] = True
-    
+            self.processes[process_id].old = True
+
         self.make_process_dir(process_id)
-    
+
         if process_id not in self.processes:
-            self.processes[process_id] = {}
-    
-        if "type" not in self.processes[process_id]:
-            self.processes[process_id]["type"] = "process"
-    
-        if "exec" not in self.processes[process_id]:
-            self.processes[process_id]["exec"] = "python3"
-    
+            self.processes.add(ProcessRecord(process_id))
+
         filename = self.process_filename(process_id)
         init_filename = self.process_init_filename(process_id)
 
@@ -472,8 +677,9 @@ class PyrosDaemon:
                 textFile.write(payload)
             with open(init_filename, "wt") as textFile:
                 textFile.write("from " + process_id + "." + process_id + "_main import *\n")
-    
-            self.output_status(process_id, "stored " + self._sanitise_filename(process_id, filename))
+
+            self.code_compiler.compile(init_filename, lambda _error: None)
+            self._compile_stored(process_id, filename)
         except Exception:
             self.important("ERROR: Cannot save file " + filename + " (" + os.path.abspath(filename) + "); ")
             self.output_status(process_id, "store error")
@@ -493,80 +699,135 @@ class PyrosDaemon:
         try:
             with open(filename, "wb") as file:
                 file.write(payload)
-    
-            self.output_status(process_id, "stored " + self._sanitise_filename(process_id, filename))
+
+            self._compile_stored(process_id, filename)
         except Exception:
             self.important("ERROR: Cannot save file " + filename + " (" + os.path.abspath(filename) + "); ")
             self.output_status(process_id, "store error")
 
-    def stop_process(self, process_id, restart=False):
-    
-        def start_it_again(process_id_to_start):
-            self.start_process(process_id_to_start)
-            if self.is_service(process_id_to_start):
-                self.output(process_id_to_start, "PyROS: Restarted service " + process_id_to_start)
-            else:
-                self.output(process_id_to_start, "PyROS: Restarted process " + process_id_to_start)
-    
-        def final_process_kill(process_id_to_kill):
-            time.sleep(0.01)
-            # Just in case - we really need that process killed!!!
-            cmd_and_args = ["/usr/bin/pkill -9 -f 'python3 -u " + process_id_to_kill + ".py " + process_id_to_kill + "'"]
-            res = subprocess.call(cmd_and_args, shell=True)
-            if res != -9 and res != 0:
-                self.info("Tried to kill " + process_id_to_kill + " but got result " + str(res) + "; command: " + str(cmd_and_args))
-            if restart:
-                start_it_again(process_id_to_kill)
+    def _upload_stored(self, process_id, name, _path):
+        self._compile_stored(process_id, os.path.join(self.process_dir(process_id), os.path.normpath(name)))
 
-        def wait_for_process_stop(process_id_stop):
-            def kill_process(process):
-                process.kill()
-                os.system(f"kill -9 {process.pid}")
+    def _install_archive(self, process_id, name, path):
+        process_dir = self.process_dir(process_id)
+        main_filename = process_id + "_main.py"
 
-            _now = time.time()
-            while time.time() - _now < self.thread_kill_timeout and 'stop_response' not in self.processes[process_id_stop]:
-                time.sleep(0.05)
-    
-            _process = self.get_process_process(process_id_stop)
-            if 'stop_response' in self.processes[process_id_stop]:
-                del self.processes[process_id_stop]['stop_response']
-                while time.time() - _now < self.thread_kill_timeout and _process.returncode is None:
-                    time.sleep(0.05)
-                if _process.returncode is None:
-                    kill_process(_process)
-                    self.info(f"PyROS: responded with stopping but didn't stop. Killed now {self.get_process_type_name(process_id_stop)}; pid={_process.pid}")
-                    self.output(process_id_stop, "PyROS: responded with stopping but didn't stop. Killed now {self.get_process_type_name(process_id_stop)}; pid={_process.pid}")
-                else:
-                    self.info(f"PyROS: stopped {self.get_process_type_name(process_id_stop)}")
-                    self.output(process_id_stop, f"PyROS: stopped {self.get_process_type_name(process_id_stop)}")
-            else:
-                kill_process(_process)
-                self.info(f"PyROS: didn't respond so killed {self.get_process_type_name(process_id_stop)}; pid={_process.pid}")
-                self.output(process_id_stop, f"PyROS: didn't respond so killed {self.get_process_type_name(process_id_stop)}; pid={_process.pid}")
-    
-            final_process_kill(process_id_stop)
-    
+        def prepare(staging, files):
+            if main_filename not in files:
+                raise ArchiveError("no " + main_filename + " in archive")
+            with open(os.path.join(staging, "__init__.py"), "wt") as init_file:
+                init_file.write("from " + process_id + "." + process_id + "_main import *\n")
+
+        try:
+            files = install_archive(path, process_dir, prepare)
+        except (ArchiveError, OSError) as install_error:
+            self.important("ERROR: Cannot install archive for " + process_id + "; " + str(install_error))
+            self.output_status(process_id, f"upload-error {name}; {install_error}")
+            return
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        if process_id in self.processes:
+            self.processes[process_id].old = True
+        else:
+            self.processes.add(ProcessRecord(process_id))
+
+        # Compiled here, on command's worker, so 'installed' is sent only after compile errors
+        for filename in files + ["__init__.py"]:
+            error = self.code_compiler.compile_now(os.path.join(process_dir, filename))
+            if error is not None:
+                self.output_status(process_id, "stored " + filename + "; compile error: " + error)
+        self.output_status(process_id, f"installed {len(files)} files from {name}")
+
+    def _compile_stored(self, process_id, filename):
+        # 'stored' status is sent once file is compiled so compile errors are reported along with it
+        def compiled(error):
+            status = "stored " + self._sanitise_filename(process_id, filename)
+            if error is not None:
+                status += "; compile error: " + error
+            self.output_status(process_id, status)
+
+        self.code_compiler.compile(filename, compiled)
+
+    def _start_it_again(self, process_id: str) -> None:
+        record = self.processes.get(process_id)
+        if record is not None:
+            record.restarts += 1
+        self.start_process(process_id)
+        if self.is_service(process_id):
+            self.output(process_id, "PyROS: Restarted service " + process_id)
+        else:
+            self.output(process_id, "PyROS: Restarted process " + process_id)
+
+    @staticmethod
+    def _signal_process_group(process, signal_number) -> bool:
+        # Each process is started in its own session so its pid is also id of its process group
+        try:
+            os.killpg(process.pid, signal_number)
+            return True
+        except ProcessLookupError:
+            return False
+
+    def _stop_deadline_reached(self, process_id: str) -> None:
+        record = self.processes.get(process_id)
+        if record is None or record.stopping is None or not self.is_running(process_id):
+            return
+
+        process = record.process
+        record.stopping.killed = True
+        self._signal_process_group(process, signal.SIGKILL)
+        if record.stop_response:
+            record.stop_response = False
+            self.info(f"PyROS: responded with stopping but didn't stop. Killed now {self.get_process_type_name(process_id)}; pid={process.pid}")
+            self.output(process_id, f"PyROS: responded with stopping but didn't stop. Killed now {self.get_process_type_name(process_id)}; pid={process.pid}")
+        else:
+            self.info(f"PyROS: didn't respond so killed {self.get_process_type_name(process_id)}; pid={process.pid}")
+            self.output(process_id, f"PyROS: didn't respond so killed {self.get_process_type_name(process_id)}; pid={process.pid}")
+        # stop is completed by process_exited once the killed process is reaped
+
+    def _complete_stop(self, process_id: str, process, stopping: StopRequest) -> None:
+        if process_id not in self.processes:
+            # Removed in the meantime
+            self._signal_process_group(process, signal.SIGKILL)
+            return
+
+        if not stopping.killed:
+            self.info(f"PyROS: stopped {self.get_process_type_name(process_id)}")
+            self.output(process_id, f"PyROS: stopped {self.get_process_type_name(process_id)}")
+        # Anything process left behind in its group goes with it
+        self._signal_process_group(process, signal.SIGKILL)
+        if stopping.restart:
+            self._start_it_again(process_id)
+
+    def stop_process(self, process_id, restart=False):
         if process_id in self.processes:
-            process = self.get_process_process(process_id)
+            record = self.processes[process_id]
+            process = record.process
             if process is not None:
-                if process.returncode is None:
+                if self.is_running(process_id):
+                    if record.stopping is not None:
+                        record.stopping.restart |= restart
+                        return
+
+                    record.stop_response = False
+                    record.stopping = StopRequest(restart, self.scheduler.schedule(self.thread_kill_timeout, self._stop_deadline_reached, process_id))
                     self.client.publish("exec/" + process_id + "/system", "stop")
-                    thread = threading.Thread(target=wait_for_process_stop, args=(process_id,), daemon=True)
-                    thread.start()
                 else:
                     self.info("PyROS self.info: already finished " + self.get_process_type_name(process_id) + " return code " + str(process.returncode))
                     self.output(process_id, "PyROS self.info: already finished " + self.get_process_type_name(process_id) + " return code " + str(process.returncode))
-                    final_process_kill(process_id)
+                    if restart:
+                        self._start_it_again(process_id)
             else:
                 self.info("PyROS self.info: process " + process_id + " is not running.")
                 self.output(process_id, "PyROS self.info: process " + process_id + " is not running.")
-                final_process_kill(process_id)
+                if restart:
+                    self._start_it_again(process_id)
         else:
             self.info("PyROS ERROR: process " + process_id + " does not exist.")
             self.output(process_id, "PyROS ERROR: process " + process_id + " does not exist.")
-            # final_process_kill(process_id)
             if restart:
-                start_it_again(process_id)
+                self._start_it_again(process_id)
 
     def restart_process(self, process_id: str) -> None:
         if process_id in self.processes:
@@ -579,9 +840,33 @@ class PyrosDaemon:
         else:
             self.output(process_id, "PyROS ERROR: process " + process_id + " does not exist.")
 
+    def _stop_for_removal(self, process_id: str) -> bool:
+        # Process has to be gone before its record is; stop deadline would find no record to kill.
+        # Escalated here: stop message, SIGTERM and SIGKILL, each given thread.kill.timeout to take effect.
+        record = self.processes[process_id]
+        self.stop_process(process_id)
+        stopping = record.stopping
+        if stopping is not None:
+            self.scheduler.cancel(stopping.timer)
+
+        for signal_number in [None, signal.SIGTERM, signal.SIGKILL]:
+            if signal_number is not None:
+                if stopping is not None:
+                    stopping.killed = True
+                self._signal_process_group(record.process, signal_number)
+            with self.process_exit_condition:
+                if self.process_exit_condition.wait_for(lambda: record.state != ProcessState.RUNNING, self.thread_kill_timeout):
+                    return True
+        return False
+
     def remove_process(self, process_id: str) -> None:
         if process_id in self.processes:
-            self.stop_process(process_id)
+            if not self.is_running(process_id):
+                self.stop_process(process_id)
+            elif not self._stop_for_removal(process_id):
+                self.output(process_id, "PyROS ERROR: cannot stop " + process_id + "; not removed")
+                return
+            self.upload_receiver.forget(process_id)
     
             if os.path.exists(self.process_dir(process_id)):
                 p_dir = self.process_dir(process_id)
@@ -589,38 +874,56 @@ class PyrosDaemon:
                 self.output(process_id, "PyROS ERROR: cannot find process files")
                 return
     
-            files = os.listdir(p_dir)
-            for file in files:
-                os.remove(p_dir + "/" + file)
-                if os.path.exists(p_dir + "/" + file):
-                    self.output(process_id, "PyROS ERROR: cannot remove file " + p_dir + "/" + file)
-    
-            os.removedirs(p_dir)
+            # Process' directory has subdirectories: __pycache__, extra packages and installed archives
+            shutil.rmtree(p_dir, ignore_errors=True)
             if os.path.exists(p_dir):
                 self.output(process_id, "PyROS ERROR: cannot remove dir " + p_dir)
     
-            del self.processes[process_id]
-    
-            self.output(process_id, "PyROS: removed " + self.get_process_type_name(process_id))
+            type_name = self.get_process_type_name(process_id)
+            record = self.processes.remove(process_id)
+            self.agent_watchdog.forget(process_id)
+            if record.log_store is not None:
+                self.log_writer.close_log(record.log_store)
+
+            self.output(process_id, "PyROS: removed " + type_name)
         else:
             self.output(process_id, "PyROS ERROR: process " + process_id + " does not exist.")
 
-    def read_log(self, process_id: str) -> None:
+    def read_log(self, process_id: str, arguments: str = "") -> None:
         if process_id in self.processes:
-            logs = self.processes[process_id]["logs"]
-            if logs is None:
-                logs = []
-    
-            for log in logs:
-                self._output(process_id, log)
+            try:
+                query = LogQuery.parse(arguments)
+            except ValueError as e:
+                self.output(process_id, "PyROS ERROR: logs " + str(e))
+                return
+
+            if self.processes[process_id].log_store is not None:
+                logs = self.processes[process_id].log_store
+            else:
+                logs = self.log_buffer(process_id)
+
+            lines = []
+            lines_size = 0
+            for _, _, line in query.select(logs):
+                lines.append(line)
+                lines_size += len(line) + 1
+                if lines_size >= self.output_batch_size:
+                    self._publish_output(process_id, "\n".join(lines))
+                    lines = []
+                    lines_size = 0
+            if len(lines) > 0:
+                self._publish_output(process_id, "\n".join(lines))
+
+            self.output_status(process_id, "PyROS: logs end " + str(logs.next_offset))
 
     def make_service_process(self, process_id: str) -> None:
         if process_id in self.processes:
-            if self.processes[process_id]["type"] == "service":
+            if self.is_service(process_id):
                 self.output(process_id, "PyROS: " + process_id + " is already service")
             else:
-                self.processes[process_id]["type"] = "service"
-                self.processes[process_id]["enabled"] = "True"
+                self.processes.set_type(self.processes[process_id], ProcessType.SERVICE)
+                self.agent_watchdog.forget(process_id)
+                self.processes[process_id].enabled = True
 
                 properties = self.load_service_file(process_id)
                 properties["type"] = "service"
@@ -634,7 +937,7 @@ class PyrosDaemon:
         if len(args) > 0:
             if process_id in self.processes:
                 properties = self.load_service_file(process_id)
-                self.processes[process_id]["exec"] = args[0]
+                self.processes[process_id].executable = args[0]
                 properties["exec"] = args[0]
                 self.save_service_file(process_id, properties)
             else:
@@ -648,35 +951,35 @@ class PyrosDaemon:
                 if not os.remove(self.process_service_filename(process_id)):
                     self.output(process_id, "PyROS ERROR: failed to unmake process " + process_id + "; failed deleting .process file.")
     
-            self.processes[process_id]["type"] = "process"
-            del self.processes[process_id]["enabled"]
+            self.processes.set_type(self.processes[process_id], ProcessType.PROCESS)
+            self.processes[process_id].enabled = False
     
         else:
             self.output(process_id, "PyROS ERROR: process " + process_id + " does not exist.")
 
     def enable_service_process(self, process_id: str) -> None:
         if process_id in self.processes:
-            if self.processes[process_id]["type"] != "service":
+            if not self.is_service(process_id):
                 self.make_service_process(process_id)
             else:
                 properties = self.load_service_file(process_id)
                 properties["enabled"] = "True"
                 self.save_service_file(process_id, properties)
     
-                self.processes[process_id]["enabled"] = "True"
-    
+                self.processes[process_id].enabled = True
+
             self.output(process_id, "PyROS: enabled " + process_id + " service")
         else:
             self.output(process_id, "PyROS ERROR: process " + process_id + " does not exist.")
 
     def disable_service_process(self, process_id: str) -> None:
         if process_id in self.processes:
-            if self.processes[process_id]["type"] == "service":
+            if self.is_service(process_id):
                 properties = self.load_service_file(process_id)
                 properties["enabled"] = "False"
                 self.save_service_file(process_id, properties)
-    
-                self.processes[process_id]["enabled"] = "False"
+
+                self.processes[process_id].enabled = False
     
                 self.output(process_id, "PyROS: enabled " + process_id + " service")
             else:
@@ -687,47 +990,46 @@ class PyrosDaemon:
 
     def make_agent_process(self, process_id: str) -> None:
         if process_id in self.processes:
-            if self.processes[process_id]["type"] == "agent":
+            if self.is_agent(process_id):
                 self.output(process_id, "PyROS: " + process_id + " is already agent")
-    
-                self.processes[process_id]["lastPing"] = time.time()
+
+                self.ping_process(process_id)
             else:
-                self.processes[process_id]["type"] = "agent"
-                self.processes[process_id]["enabled"] = "True"
-                self.processes[process_id]["lastPing"] = time.time()
+                self.processes.set_type(self.processes[process_id], ProcessType.AGENT)
+                self.processes[process_id].enabled = True
+                self.processes[process_id].last_ping = time.time()
     
                 properties = self.load_service_file(process_id)
                 properties["type"] = "agent"
                 properties["enabled"] = "True"
                 self.save_service_file(process_id, properties)
                 self.output(process_id, "PyROS: made " + process_id + " an agent")
+                self.agent_watchdog.watch(process_id, self.processes[process_id].last_ping)
         else:
             self.output(process_id, "PyROS ERROR: process " + process_id + " does not exist.")
 
     def ping_process(self, process_id: str) -> None:
         if process_id in self.processes:
-            self.processes[process_id]["lastPing"] = time.time()
+            record = self.processes[process_id]
+            record.last_ping = time.time()
+            if record.type == ProcessType.AGENT:
+                self.agent_watchdog.watch(process_id, record.last_ping)
         else:
             self.output(process_id, "PyROS ERROR: process " + process_id + " does not exist.")
 
     def ps_comamnd(self, command_id, _arguments):
-        for process_id in self.processes:
-            process = self.get_process_process(process_id)
-            if process is not None:
-                return_code = process.returncode
-                if return_code is None:
-                    status = "running"
-                    return_code = "-"
-                    if "old" in self.processes[process_id] and self.processes[process_id]["old"]:
-                        status = "running-old"
-                else:
-                    status = "stopped"
-                    return_code = str(return_code)
-    
+        for record in self.processes.records():
+            process_id = record.process_id
+            if record.state == ProcessState.RUNNING:
+                status = "running-old" if record.old else "running"
+                return_code = "-"
+            elif record.state == ProcessState.STOPPED:
+                status = "stopped"
+                return_code = str(record.process.returncode)
             else:
                 status = "new"
                 return_code = ""
-    
+
             filename = self.process_filename(process_id)
     
             file_len = "-"
@@ -739,63 +1041,166 @@ class PyrosDaemon:
                 file_date = str(file_stat.st_mtime)
     
             last_ping = "-"
-            if "lastPing" in self.processes[process_id]:
-                last_ping = str(self.processes[process_id]["lastPing"])
-    
+            if record.last_ping is not None:
+                last_ping = str(record.last_ping)
+
+            cpu = "-"
+            rss = "-"
+            if record.state == ProcessState.RUNNING and record.resources is not None:
+                cpu = f"{record.resources.cpu:.1f}"
+                rss = str(record.resources.rss)
+
             self.system_output(command_id,
-                               "{0} {1} {2} {3} {4} {5} {6}".format(
+                               "{0} {1} {2} {3} {4} {5} {6} {7} {8}".format(
                                    self.complex_process_id(process_id),
-                                   self.get_process_type_name(process_id),
+                                   record.type_name(),
                                    status,
                                    return_code,
                                    file_len,
                                    file_date,
-                                   last_ping))
-    
+                                   last_ping,
+                                   cpu,
+                                   rss))
+    
+    def metrics_command(self, command_id, _arguments):
+        for line in self.metrics.lines():
+            self.system_output(command_id, line)
+
+    def prometheus_metrics(self):
+        lines = prometheus_lines(self.metrics)
+        records = self.processes.records()
+
+        def process_metric(name, metric_type, value):
+            lines.append(f"# TYPE pyros_process_{name} {metric_type}")
+            for _record in records:
+                _value = value(_record)
+                if _value is not None:
+                    lines.append(f"pyros_process_{name}{{process=\"{prometheus_label(self.complex_process_id(_record.process_id))}\",type=\"{_record.type.value}\"}} {_value}")
+
+        def resource(attribute):
+            return lambda _record: getattr(_record.resources, attribute) if _record.state == ProcessState.RUNNING and _record.resources is not None else None
+
+        process_metric("running", "gauge", lambda _record: 1 if _record.state == ProcessState.RUNNING else 0)
+        process_metric("restarts_total", "counter", lambda _record: _record.restarts)
+        process_metric("output_lines_total", "counter", lambda _record: _record.output_lines)
+        process_metric("output_suppressed_total", "counter", lambda _record: _record.output_suppressed)
+        process_metric("cpu_percent", "gauge", resource("cpu"))
+        process_metric("rss_bytes", "gauge", resource("rss"))
+        process_metric("vsz_bytes", "gauge", resource("vsz"))
+        process_metric("swap_bytes", "gauge", resource("swap"))
+        # I/O of processes that have exited is not counted any more - seen as counter reset
+        process_metric("read_bytes_total", "counter", resource("read_bytes"))
+        process_metric("write_bytes_total", "counter", resource("write_bytes"))
+        process_metric("threads", "gauge", resource("threads"))
+        process_metric("processes", "gauge", resource("processes"))
+        return "\n".join(lines) + "\n"
+
+    def _timed(self, name, received):
+        self.metrics.histogram("latency." + name).record((time.perf_counter() - received) * 1000000)
+
     def services_command(self, command_id, _arguments):
-        for service_id in self.processes:
-            if self.is_service(service_id):
-                self.system_output(command_id, service_id)
+        for service_id in self.processes.services:
+            self.system_output(command_id, service_id)
+
+    def shutdown_processes(self, excludes, report) -> list:
+        # All processes are asked to stop at once. Process groups still running get SIGTERM after
+        # thread.kill.timeout and SIGKILL after twice that, both capped so everything is done within shutdown.timeout.
+        started = time.monotonic()
+        escalations = [
+            (started + min(self.thread_kill_timeout, self.shutdown_timeout / 2), signal.SIGTERM, "terminated"),
+            (started + min(self.thread_kill_timeout * 2, self.shutdown_timeout * 3 / 4), signal.SIGKILL, "killed"),
+            (started + self.shutdown_timeout, None, None)
+        ]
+
+        stopping = {}
+        for process_id in self.processes.running:
+            record = self.processes.get(process_id)
+            if record is not None and record.state == ProcessState.RUNNING and process_id not in excludes:
+                if record.stopping is not None:
+                    # Shutdown takes over from stop/restart in progress
+                    self.scheduler.cancel(record.stopping.timer)
+                    record.stopping = None
+                stopping[record.process_id] = record
+                self.client.publish("exec/" + record.process_id + "/system", "stop")
+
+        stopped = {}
+        how = "stopped"
+
+        def collect_stopped():
+            for process_id, stopping_record in stopping.items():
+                if process_id not in stopped and stopping_record.state != ProcessState.RUNNING:
+                    stopped[process_id] = (time.monotonic() - started, how)
+            return len(stopped) == len(stopping)
+
+        with self.process_exit_condition:
+            for escalate_at, signal_number, escalation in escalations:
+                if self.process_exit_condition.wait_for(collect_stopped, max(0.0, escalate_at - time.monotonic())) or signal_number is None:
+                    break
+
+                how = escalation
+                for process_id, record in stopping.items():
+                    if process_id not in stopped:
+                        self._signal_process_group(record.process, signal_number)
+
+        not_stopped = []
+        for process_id in stopping:
+            if process_id in stopped:
+                duration, how_stopped = stopped[process_id]
+                report(f"{process_id} {how_stopped} in {duration * 1000:.0f}ms")
+            else:
+                not_stopped.append(process_id)
+                report(f"{process_id} did not stop in {self.shutdown_timeout}s")
+        return not_stopped
 
-    def stop_pyros_command(self, command_id, arguments):
-    
-        def stop_all_processes(_command_id, excludes):
+    def _shutdown(self, excludes, command_id=None):
+        self.important("Stopping PyROS...")
+        if len(excludes) > 0:
+            self.important("    excluding processes " + ", ".join(excludes))
 
-            def are_all_stopped():
-                for _pId in self.processes:
-                    if _pId not in excludes and self.is_running(_pId):
-                        return False
-                return True
-    
-            for process_id in self.processes:
-                if process_id not in excludes and self.is_running(process_id):
-                    self.important("    Stopping process " + process_id)
-                    self.stop_process(process_id)
-    
-            self.important("Stopping PyROS...")
-            self.important("    excluding self.processes " + ", ".join(excludes))
-            _now = time.time()
-            while not are_all_stopped() and time.time() - _now < self.thread_kill_timeout * 2:
-                time.sleep(0.02)
-    
-            not_stopped = []
-            for _processId in self.processes:
-                if _processId not in excludes and self.is_running(_processId):
-                    not_stopped.append(_processId)
-    
-            if len(not_stopped) > 0:
-                self.important("    Not all self.processes stopped; " + ", ".join(not_stopped))
-    
-            self.important("    sending feedback that we will stop (topic system/" + _command_id + ")")
-    
-            self.system_output(_command_id, "stopped")
-    
-            time.sleep(2)
-            self.do_exit = True
-    
+        if command_id is not None:
+            not_stopped = self.shutdown_processes(excludes, lambda line: self.system_output(command_id, line))
+        else:
+            not_stopped = self.shutdown_processes(excludes, lambda line: self.important("    " + line))
+
+        if len(not_stopped) > 0:
+            self.important("    Not all processes stopped; " + ", ".join(not_stopped))
+
+        zygote = self.zygote
+        if zygote is not None:
+            zygote.stop()
+
+        if command_id is not None:
+            self.important("    sending feedback that we will stop (topic system/" + command_id + ")")
+            # noinspection PyBroadException
+            try:
+                # End of output only after the report; clients stop reading at it
+                self.system_output(command_id, "stopped")
+                self.system_output_eof(command_id).wait_for_publish(DEFAULT_PUBLISH_TIMEOUT)
+            except Exception:
+                pass
+
+        self.exit_event.set()
+
+    def stop_pyros_command(self, command_id, arguments):
         if command_id == "pyros.py:" + (self.this_cluster_id if self.this_cluster_id is not None else "master"):
-            thread = threading.Thread(target=stop_all_processes, args=(command_id, arguments), daemon=True)
-            thread.start()
+            if not self.shutting_down:
+                self.shutting_down = True
+                thread = threading.Thread(target=self._shutdown, args=(arguments, command_id), daemon=True)
+                thread.start()
+                # _shutdown sends end of output
+                return
+        self.system_output_eof(command_id)
+
+    def _signal_received(self, signal_number, _frame):
+        if self.shutting_down:
+            # Second signal - don't wait for processes any more
+            self.exit_event.set()
+            return
+
+        self.important("Received " + signal.Signals(signal_number).name)
+        self.shutting_down = True
+        thread = threading.Thread(target=self._shutdown, args=([],), daemon=True)
+        thread.start()
 
     def process_command(self, process_id, message):
         self.trace("Processing received comamnd " + message)
@@ -810,7 +1215,7 @@ class PyrosDaemon:
         elif "remove" == command:
             self.remove_process(process_id)
         elif "logs" == command:
-            self.read_log(process_id)
+            self.read_log(process_id, message[len(command):])
         elif "make-service" == command:
             self.make_service_process(process_id)
         elif "unmake-service" == command:
@@ -839,20 +1244,121 @@ class PyrosDaemon:
         elif command == "services":
             self.services_command(command_id, arguments)
         elif command == "stop":
+            # Sends end of output itself once processes are stopped
             self.stop_pyros_command(command_id, arguments)
+            return
+        elif command == "metrics":
+            self.metrics_command(command_id, arguments)
         else:
             self.system_output(command_id, "Command " + command_line + " is not implemented")
 
         self.system_output_eof(command_id)
 
+    def install_routes(self, mqtt_client):
+        # Each subscription gets its own handler so paho's topic matcher does the dispatch;
+        # anything not matched by a route ends up in on_message
+        for topic, key, handler in self.routes:
+            mqtt_client.message_callback_add(topic, self._route(key, handler))
+
+    def subscribe_routes(self, mqtt_client):
+        for topic, _, _ in self.routes:
+            mqtt_client.subscribe(topic, 0)
+
+    def _route(self, key_function, handler):
+        # MQTT thread only hands message over to command executor - commands for the same
+        # process are handled in order, for different processes in parallel
+        def on_routed_message(_mqtt_client, _data, msg):
+            received = time.perf_counter()
+            key = key_function(msg)
+            if key is not None:
+                self.command_executor.submit(key, self._handle, handler, key, msg, received)
+        return on_routed_message
+
+    def _handle(self, handler, key, msg, received):
+        try:
+            handler(key, msg, received)
+        except Exception as exception:
+            self.important("ERROR: Got exception on message; " + str(exception) + "\n" + ''.join(traceback.format_tb(exception.__traceback__)))
+
+    def _process_key(self, msg):
+        # exec/[<cluster_id>:]<process_id>/...
+        return self.local_process_id(msg.topic.split("/", 2)[1])
+
+    @staticmethod
+    def _system_key(msg):
+        # system/<command_id>
+        return msg.topic[7:]
+
+    def local_process_id(self, topic_process_id):
+        # Process id from '[<cluster_id>:]<process_id>' or None if it is for another cluster
+        try:
+            return self._local_process_ids[topic_process_id]
+        except KeyError:
+            pass
+
+        split = topic_process_id.split(":")
+        cluster_id, process_id = ("master", split[0]) if len(split) == 1 else (split[0], split[1])
+        if cluster_id != (self.this_cluster_id if self.this_cluster_id is not None else "master"):
+            process_id = None
+
+        if len(self._local_process_ids) >= MAX_CACHED_PROCESS_IDS:
+            self._local_process_ids = {}
+        self._local_process_ids[topic_process_id] = process_id
+        return process_id
+
+    def _on_process_code(self, process_id, msg, received):
+        # exec/<process_id>/process
+        payload = str(msg.payload, 'utf-8')
+        self.store_code(process_id, payload)
+        self._timed("store_code", received)
+
+    def _on_extra_code(self, process_id, msg, received):
+        # exec/<process_id>/process/<name>; '#' matches exec/<process_id>/process as well
+        split = msg.topic.split("/", 3)
+        if len(split) == 4:
+            self.store_extra_code(process_id, split[3], msg.payload)
+            self._timed("store_code", received)
+
+    def _on_upload(self, process_id, msg, _received):
+        # exec/<process_id>/upload
+        self.make_process_dir(process_id)
+        self.upload_receiver.receive(process_id, self.process_dir(process_id), msg.payload)
+
+    def _expire_uploads(self):
+        # Expired on process' command key so it doesn't run along with the process' upload messages
+        for process_id in self.upload_receiver.idle_processes():
+            self.command_executor.submit(process_id, self.upload_receiver.expire, process_id)
+        self.scheduler.schedule(max(1.0, self.upload_receiver.timeout / 4), self._expire_uploads)
+
+    def _on_process_command(self, process_id, msg, received):
+        # exec/<process_id>
+        if process_id in self.processes:
+            payload = str(msg.payload, 'utf-8')
+            self.process_command(process_id, payload)
+            command = payload.split(" ")[0]
+            if command in TIMED_COMMANDS:
+                self._timed(command, received)
+        else:
+            self.output(process_id, "No such process '" + process_id + "'")
+
+    def _on_stop_response(self, process_id, msg, _received):
+        # exec/<process_id>/system/stop
+        payload = str(msg.payload, 'utf-8')
+        if payload == "stopped" and process_id in self.processes:
+            self.processes[process_id].stop_response = True
+
+    def _on_system_command(self, command_id, msg, received):
+        # system/<command_id>
+        payload = str(msg.payload, 'utf-8')
+        self.process_system_command(command_id, payload)
+        command = payload.split(" ")[0]
+        if command in TIMED_SYSTEM_COMMANDS:
+            self._timed(command, received)
+
     def on_connect(self, mqtt_client, _data, _flags, rc):
         try:
             if rc == 0:
-                mqtt_client.subscribe("system/+", 0)
-                mqtt_client.subscribe("exec/+", 0)
-                mqtt_client.subscribe("exec/+/process", 0)
-                mqtt_client.subscribe("exec/+/process/#", 0)
-                mqtt_client.subscribe("exec/+/system/stop", 0)
+                self.subscribe_routes(mqtt_client)
             else:
                 self.important("ERROR: Connection returned error result: " + str(rc))
                 # noinspection PyProtectedMember
@@ -861,90 +1367,87 @@ class PyrosDaemon:
             self.important("ERROR: Got exception on connect; " + str(exception))
 
     def on_message(self, _mqtt_client, _data, msg):
-        def split_process_id(_process_id):
-            _split = _process_id.split(":")
-            if len(_split) == 1:
-                return "master", _process_id
-        
-            return _split[0], _split[1]
-        
-        def check_cluster_id(_cluster_id):
-            if self.this_cluster_id is None:
-                return _cluster_id == 'master'
-            else:
-                return self.this_cluster_id == _cluster_id
-        
-        try:
-            # payload = str(msg.payload, 'utf-8')
-            topic = msg.topic
-        
-            if topic.startswith("exec/") and topic.endswith("/process"):
-                process_id = topic[5:len(topic) - 8]
-                cluster_id, process_id = split_process_id(process_id)
-                if check_cluster_id(cluster_id):
-                    payload = str(msg.payload, 'utf-8')
-                    self.store_code(process_id, payload)
-            elif topic.startswith("exec/"):
-                split = topic[5:].split("/")
-                if len(split) == 1:
-                    process_id = topic[5:]
-                    cluster_id, process_id = split_process_id(process_id)
-                    if check_cluster_id(cluster_id):
-                        if process_id in self.processes:
-                            payload = str(msg.payload, 'utf-8')
-                            self.process_command(process_id, payload)
-                        else:
-                            self.output(process_id, "No such process '" + process_id + "'")
-                elif len(split) >= 3 and split[1] == "process":
-                    process_id = split[0]
-                    cluster_id, process_id = split_process_id(process_id)
-                    if check_cluster_id(cluster_id):
-                        name = "/".join(split[2:])
-                        self.store_extra_code(process_id, name, msg.payload)
-                elif len(split) == 3 and split[1] == "system" and split[2] == "stop":
-                    process_id = split[0]
-                    cluster_id, process_id = split_process_id(process_id)
-                    if check_cluster_id(cluster_id):
-                        payload = str(msg.payload, 'utf-8')
-                        if payload == "stopped":
-                            self.processes[process_id]['stop_response'] = True
-        
-            elif topic.startswith("system/"):
-                command_id = topic[7:]
-                payload = str(msg.payload, 'utf-8')
-                self.process_system_command(command_id, payload)
-            else:
-                self.important("ERROR: No such topic " + topic)
-        except Exception as exception:
-            self.important("ERROR: Got exception on message; " + str(exception) + "\n" + ''.join(traceback.format_tb(exception.__traceback__)))
+        self.important("ERROR: No such topic " + msg.topic)
 
     def startup_services(self):
+        service_boot = ServiceBoot(self._boot_start, self._boot_done, self._boot_report, self.scheduler,
+                                   self.boot_concurrency, self.boot_ready_timeout)
+        uses_zygote = False
+        recover(self.code_dir_name)
         programs_dirs = os.listdir(self.code_dir_name)
         for program_dir in programs_dirs:
             if os.path.isdir(self.process_dir(program_dir)):
                 if os.path.exists(self.process_filename(program_dir)):
                     properties = self.load_service_file(program_dir)
-                    if "type" not in properties:
-                        properties["type"] = "process"
-    
-                    if "exec" not in properties:
-                        properties["exec"] = "python3"
-    
-                    self.processes[program_dir] = {"type": properties["type"], "exec": properties["exec"]}
-                    if self.is_service(program_dir):
-                        if "enabled" in properties and properties["enabled"] == "True":
-                            self.processes[program_dir]["enabled"] = "True"
-                        else:
-                            self.processes[program_dir]["enabled"] = "False"
-    
-                        if self.processes[program_dir]["enabled"] == "True":
-                            self.start_process(program_dir)
-
-    def test_for_agents(self, current_time):
-        for process_id in self.processes:
-            if self.is_agent(process_id) and self.is_running(process_id):
-                if "lastPing" not in self.processes[process_id] or self.processes[process_id]["lastPing"] < current_time - self.agents_kill_timeout:
-                    self.stop_process(process_id)
+                    record = ProcessRecord(program_dir,
+                                           ProcessType.from_name(properties.get("type", "process")),
+                                           properties.get("exec", "python3"))
+                    record.enabled = properties.get("enabled") == "True"
+                    self.processes.add(record)
+                    self.configure_logs(program_dir, properties)
+                    if self.is_service(program_dir) and record.enabled:
+                        service_boot.add(program_dir, properties)
+                    if self.uses_zygote(record, properties):
+                        uses_zygote = True
+
+        if uses_zygote:
+            # Warm it up before services need it
+            self.get_zygote()
+
+        if len(service_boot.services) > 0:
+            self.service_boot = service_boot
+            service_boot.boot()
+            threading.Thread(target=self._wait_for_boot, args=(service_boot,), daemon=True).start()
+
+    def _wait_for_boot(self, service_boot):
+        service_boot.finished.wait()
+        self.service_boot = None
+        failed = [service.process_id for service in service_boot.services.values() if service.state == BootState.FAILED]
+        self.important(f"Booted {len(service_boot.services) - len(failed)} service(s) in {time.monotonic() - service_boot.started_at:.3f}s"
+                       + ("; failed: " + ", ".join(sorted(failed)) if len(failed) > 0 else ""))
+
+    def _boot_status_topic(self, process_id):
+        return "exec/" + self.complex_process_id(process_id) + "/status"
+
+    def _boot_start(self, service):
+        if service.ready == READY_STATUS:
+            topic = self._boot_status_topic(service.process_id)
+            service_boot = self.service_boot
+
+            def on_status(_mqtt_client, _data, msg):
+                service_boot.status(service.process_id, msg.payload.decode("utf-8", errors="replace"))
+
+            self.client.message_callback_add(topic, on_status)
+            self.client.subscribe(topic, 0)
+
+        self.info("Booting service " + service.process_id)
+        self.start_process(service.process_id)
+
+    def _boot_done(self, service):
+        if service.ready == READY_STATUS and service.started_at is not None:
+            topic = self._boot_status_topic(service.process_id)
+            self.client.unsubscribe(topic)
+            self.client.message_callback_remove(topic)
+
+    def _boot_report(self, process_id, message):
+        self.important(message)
+        self.output(process_id, message)
+
+    def _resource_roots(self):
+        return {record.process.pid: record.process_id for record in self.processes.records()
+                if record.state == ProcessState.RUNNING and record.process is not None}
+
+    def _resources_sampled(self, process_id, sample):
+        record = self.processes.get(process_id)
+        if record is not None:
+            record.resources = sample
+            self.client.publish("exec/" + self.complex_process_id(process_id) + "/resources", str(sample))
+
+    def _agent_expired(self, process_id):
+        # Agent that is not running is watched again when it starts
+        if self.is_agent(process_id) and self.is_running(process_id):
+            self.info("PyROS: agent " + process_id + " was not pinged for " + str(self.agent_watchdog.timeout) + "s; stopping it")
+            self.stop_process(process_id)
 
     def _connect_mqtt(self):
         _connect_retries = 0
@@ -981,29 +1484,44 @@ class PyrosDaemon:
 
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.install_routes(self.client)
+        self.client.on_publish = self.on_publish
 
         self._connect_mqtt()
 
+        signal.signal(signal.SIGINT, self._signal_received)
+        signal.signal(signal.SIGTERM, self._signal_received)
+
+        self.scheduler.start()
+        self.command_executor.start()
+        self._expire_uploads()
+        self.resource_sampler.start()
+        if self.metrics_server.enabled():
+            # noinspection PyBroadException
+            try:
+                self.metrics_server.start()
+            except Exception as exception:
+                self.important("PyROS ERROR: cannot start metrics server; " + str(exception))
+        self.log_writer.start()
+        self.code_compiler.start()
+        self.output_reactor.child_reaper.start_signal_fallback()
+        self.output_reactor.start()
+        self.client.loop_start()
+
         self.important("Started PyROS.")
 
         self.startup_services()
 
-        last_checked_agents = time.time()
+        try:
+            self.exit_event.wait()
+        except KeyboardInterrupt:
+            pass
 
-        while not self.do_exit:
-            try:
-                for it in range(0, 10):
-                    time.sleep(0.009)
-                    self.client.loop(0.001)
-                now = time.time()
-                if now - last_checked_agents > self.agents_check_timeout:
-                    last_checked_agents = now
-                    self.test_for_agents(now)
-
-            except SystemExit:
-                self.do_exit = True
-            except Exception as e:
-                self.important("ERROR: Got exception in discovery loop; " + str(e))
+        self.client.loop_stop()
+        self.metrics_server.stop()
+        self.scheduler.stop()
+        # Processes are stopped by now; their last lines are still to be written to disk
+        self.log_writer.stop()
 
         self.important("PyROS stopped.")
 
@@ -0,0 +1,176 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import os
+import time
+
+
+DEFAULT_RESOURCES_INTERVAL = 5.0
+
+PROC = "/proc"
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _read(path):
+    # Files are opened only for the read so nothing is kept open for processes that die
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.read(fd, 4096)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def _stat_fields(pid):
+    # Fields after '(comm)' as comm can contain spaces and parentheses; field n of proc(5) is at [n - 3]
+    stat = _read(PROC + "/" + pid + "/stat")
+    if stat is None:
+        return None
+    return stat[stat.rfind(b")") + 2:].split(b" ")
+
+
+def _field(content, name):
+    start = content.find(name)
+    if start < 0:
+        return 0
+    start += len(name)
+    end = content.find(b"\n", start)
+    return int(content[start:end if end >= 0 else len(content)].split()[0])
+
+
+class ResourceSample:
+    __slots__ = ["timestamp", "cpu", "rss", "vsz", "swap", "read_bytes", "write_bytes", "threads", "processes"]
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+        self.cpu = 0.0
+        self.rss = 0
+        self.vsz = 0
+        self.swap = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.threads = 0
+        self.processes = 0
+
+    def __str__(self):
+        return (f"cpu={self.cpu:.1f} rss={self.rss} vsz={self.vsz} swap={self.swap} read={self.read_bytes}"
+                f" write={self.write_bytes} threads={self.threads} procs={self.processes}")
+
+
+class ResourceSampler:
+    # Samples CPU, memory, I/O and thread counts of managed processes together with all their
+    # descendants each 'interval' seconds. All pids are read from /proc in one pass per tick;
+    # a process belongs to a managed one if it is in its session (processes are started in
+    # new sessions) or is its descendant.
+    # 'roots' returns dict of pid to process id; 'on_sample' is called with process id and sample.
+    def __init__(self, scheduler, roots, on_sample, interval=DEFAULT_RESOURCES_INTERVAL):
+        self.scheduler = scheduler
+        self.roots = roots
+        self.on_sample = on_sample
+        self.interval = interval
+        self.timer = None
+        self._ticks = {}
+
+    def start(self):
+        if self.interval > 0 and self.timer is None:
+            self.timer = self.scheduler.schedule(self.interval, self._tick)
+
+    def stop(self):
+        self.scheduler.cancel(self.timer)
+        self.timer = None
+
+    def _tick(self):
+        try:
+            for process_id, sample in self.sample():
+                self.on_sample(process_id, sample)
+        finally:
+            self.timer = self.scheduler.schedule(self.interval, self._tick)
+
+    def sample(self):
+        roots = {str(pid): process_id for pid, process_id in self.roots().items()}
+        if len(roots) == 0:
+            self._ticks = {}
+            return []
+
+        now = time.monotonic()
+        stats = {}
+        for pid in os.listdir(PROC):
+            if pid.isdigit():
+                fields = _stat_fields(pid)
+                if fields is not None:
+                    stats[pid] = fields
+
+        owners = {}
+
+        def owner(_pid):
+            if _pid in owners:
+                return owners[_pid]
+            owners[_pid] = None
+            _fields = stats.get(_pid)
+            if _pid in roots:
+                result = _pid
+            elif _fields is None:
+                result = None
+            elif _fields[3].decode() in roots:
+                result = _fields[3].decode()
+            else:
+                result = owner(_fields[1].decode())
+            owners[_pid] = result
+            return result
+
+        samples = {}
+        ticks = {}
+        for pid, fields in stats.items():
+            root = owner(pid)
+            if root is None:
+                continue
+
+            sample = samples.get(root)
+            if sample is None:
+                sample = samples[root] = ResourceSample(time.time())
+                ticks[root] = 0
+
+            # utime + stime, and for managed process also times of its waited for children
+            ticks[root] += int(fields[11]) + int(fields[12])
+            if pid == root:
+                ticks[root] += int(fields[13]) + int(fields[14])
+            sample.threads += int(fields[17])
+            sample.vsz += int(fields[20])
+            sample.rss += int(fields[21]) * PAGE_SIZE
+            sample.processes += 1
+
+            status = _read(PROC + "/" + pid + "/status")
+            if status is not None:
+                sample.swap += _field(status, b"VmSwap:") * 1024
+            io = _read(PROC + "/" + pid + "/io")
+            if io is not None:
+                sample.read_bytes += _field(io, b"read_bytes:")
+                sample.write_bytes += _field(io, b"write_bytes:")
+
+        result = []
+        previous_ticks = self._ticks
+        self._ticks = {}
+        for root, sample in samples.items():
+            key = (root, roots[root])
+            self._ticks[key] = (now, ticks[root])
+            if key in previous_ticks:
+                then, previous = previous_ticks[key]
+                if now > then:
+                    sample.cpu = max(0, ticks[root] - previous) * 100.0 / CLOCK_TICKS / (now - then)
+            result.append((roots[root], sample))
+        return result
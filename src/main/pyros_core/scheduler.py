@@ -0,0 +1,89 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+
+class Timer:
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class Scheduler:
+    def __init__(self):
+        self.thread = None
+        self._timers = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def schedule(self, delay, callback, *args):
+        timer = Timer(time.monotonic() + delay, callback, args)
+        with self._condition:
+            heapq.heappush(self._timers, (timer.deadline, next(self._sequence), timer))
+            if self._timers[0][2] is timer:
+                self._condition.notify()
+        return timer
+
+    def call_soon(self, callback, *args):
+        return self.schedule(0, callback, *args)
+
+    @staticmethod
+    def cancel(timer):
+        if timer is not None:
+            timer.cancelled = True
+
+    def _next_due(self):
+        with self._condition:
+            while not self._stopped:
+                while len(self._timers) > 0 and self._timers[0][2].cancelled:
+                    heapq.heappop(self._timers)
+
+                if len(self._timers) == 0:
+                    self._condition.wait()
+                else:
+                    delay = self._timers[0][0] - time.monotonic()
+                    if delay <= 0:
+                        return heapq.heappop(self._timers)[2]
+                    self._condition.wait(delay)
+        return None
+
+    def _run(self):
+        while True:
+            timer = self._next_due()
+            if timer is None:
+                return
+            if timer.cancelled:
+                continue
+
+            # noinspection PyBroadException
+            try:
+                timer.callback(*timer.args)
+            except Exception as exception:
+                print("ERROR: Got exception in scheduled callback; " + str(exception) + "\n" + ''.join(traceback.format_tb(exception.__traceback__)))
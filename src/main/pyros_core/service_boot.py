@@ -0,0 +1,214 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import threading
+import time
+
+from collections import deque
+from enum import Enum
+
+
+DEFAULT_BOOT_CONCURRENCY = 4
+DEFAULT_READY_TIMEOUT = 30.0
+
+READY_STARTED = "started"
+READY_STATUS = "status"
+READY_LINE = "line"
+
+READY_STATUS_MESSAGE = "ready"
+
+
+class BootState(Enum):
+    WAITING = "waiting"
+    STARTING = "starting"
+    READY = "ready"
+    FAILED = "failed"
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(",") if item.strip() != ""]
+
+
+class BootService:
+    __slots__ = ["process_id", "after", "requires", "ready", "ready_line", "ready_timeout",
+                 "waiting_for", "dependents", "state", "timer", "started_at"]
+
+    def __init__(self, process_id, properties, ready_timeout):
+        self.process_id = process_id
+        self.requires = set(_split_list(properties.get("requires", "")))
+        self.after = set(_split_list(properties.get("after", ""))) | self.requires
+        self.ready_line = properties.get("ready.line")
+        self.ready = properties.get("ready", READY_LINE if self.ready_line is not None else READY_STARTED)
+        if self.ready not in (READY_STARTED, READY_STATUS, READY_LINE) or (self.ready == READY_LINE and self.ready_line is None):
+            self.ready = READY_STARTED
+        try:
+            self.ready_timeout = float(properties.get("ready.timeout", ready_timeout))
+        except ValueError:
+            self.ready_timeout = ready_timeout
+        self.waiting_for = set()
+        self.dependents = []
+        self.state = BootState.WAITING
+        self.timer = None
+        self.started_at = None
+
+
+class ServiceBoot:
+    # Starts services in order given by 'after' and 'requires' properties of their .process files.
+    # A service is started once all services it depends on are ready - independent services are
+    # started in parallel, at most 'concurrency' of them being started (not yet ready) at a time.
+    # A service that failed (exited or didn't get ready in time) prevents start of services that 'require' it.
+    def __init__(self, start, done, report, scheduler, concurrency=DEFAULT_BOOT_CONCURRENCY, ready_timeout=DEFAULT_READY_TIMEOUT):
+        self.start = start
+        self.done = done
+        self.report = report
+        self.scheduler = scheduler
+        self.concurrency = max(1, concurrency)
+        self.ready_timeout = ready_timeout
+        self.services = {}
+        self.started_at = None
+        self.finished = threading.Event()
+        self._queue = deque()
+        self._starting = 0
+        self._remaining = 0
+        self._lock = threading.RLock()
+
+    def add(self, process_id, properties):
+        self.services[process_id] = BootService(process_id, properties, self.ready_timeout)
+
+    def boot(self):
+        with self._lock:
+            self.started_at = time.monotonic()
+            self._remaining = len(self.services)
+
+            for service in sorted(self.services.values(), key=lambda s: s.process_id):
+                for dependency in sorted(service.after):
+                    if dependency in self.services:
+                        service.waiting_for.add(dependency)
+                        self.services[dependency].dependents.append(service.process_id)
+
+            self._break_cycles()
+
+            for process_id in sorted(self.services):
+                service = self.services[process_id]
+                missing = [dependency for dependency in sorted(service.requires) if dependency not in self.services]
+                if len(missing) > 0:
+                    self._finish(service, BootState.FAILED, "requires " + ", ".join(missing) + " which is not an enabled service")
+                elif service.state == BootState.WAITING and len(service.waiting_for) == 0:
+                    self._queue.append(service)
+
+            self._start_queued()
+            if self._remaining == 0:
+                self.finished.set()
+
+    def _break_cycles(self):
+        # Kahn's algorithm; whatever can't be ordered is part of (or after) a cycle
+        in_degree = {process_id: len(service.waiting_for) for process_id, service in self.services.items()}
+        queue = deque(process_id for process_id, degree in in_degree.items() if degree == 0)
+        while len(queue) > 0:
+            for dependent in self.services[queue.popleft()].dependents:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    queue.append(dependent)
+
+        unordered = set(process_id for process_id, degree in in_degree.items() if degree > 0)
+
+        # Peel off services that only come after a cycle so just ones in cycles are left
+        out_degree = {process_id: len([d for d in self.services[process_id].dependents if d in unordered]) for process_id in unordered}
+        queue = deque(process_id for process_id, degree in out_degree.items() if degree == 0)
+        while len(queue) > 0:
+            process_id = queue.popleft()
+            unordered.discard(process_id)
+            for dependency in self.services[process_id].waiting_for:
+                if dependency in unordered:
+                    out_degree[dependency] -= 1
+                    if out_degree[dependency] == 0:
+                        queue.append(dependency)
+
+        if len(unordered) > 0:
+            for process_id in sorted(unordered):
+                self.report(process_id, "PyROS WARNING: dependency cycle between services " + ", ".join(sorted(unordered)) + "; ignoring dependencies between them")
+            for process_id in unordered:
+                service = self.services[process_id]
+                service.waiting_for -= unordered
+                service.dependents = [dependent for dependent in service.dependents if dependent not in unordered]
+
+    def _start_queued(self):
+        while len(self._queue) > 0 and self._starting < self.concurrency:
+            service = self._queue.popleft()
+            service.state = BootState.STARTING
+            service.started_at = time.monotonic()
+            service.timer = self.scheduler.schedule(service.ready_timeout, self._ready_timeout, service.process_id)
+            self._starting += 1
+            self.start(service)
+
+    def _finish(self, service, state, reason=None):
+        if service.state in (BootState.READY, BootState.FAILED):
+            return
+
+        if service.state == BootState.STARTING:
+            self._starting -= 1
+            self.scheduler.cancel(service.timer)
+            service.timer = None
+        service.state = state
+        self._remaining -= 1
+
+        if state == BootState.FAILED:
+            self.report(service.process_id, "PyROS ERROR: service " + service.process_id + " failed to boot; " + reason)
+        self.done(service)
+
+        for dependent_id in service.dependents:
+            dependent = self.services[dependent_id]
+            if dependent.state != BootState.WAITING:
+                continue
+            if state == BootState.FAILED and service.process_id in dependent.requires:
+                self._finish(dependent, BootState.FAILED, "requires " + service.process_id + " which failed to boot")
+            else:
+                dependent.waiting_for.discard(service.process_id)
+                if len(dependent.waiting_for) == 0:
+                    self._queue.append(dependent)
+
+    def _starting_service(self, process_id):
+        service = self.services.get(process_id)
+        return service if service is not None and service.state == BootState.STARTING else None
+
+    def _update(self, process_id, state, reason=None):
+        with self._lock:
+            service = self._starting_service(process_id)
+            if service is None:
+                return
+            self._finish(service, state, reason)
+            self._start_queued()
+            if self._remaining == 0:
+                self.finished.set()
+
+    def _ready_timeout(self, process_id):
+        service = self._starting_service(process_id)
+        if service is not None:
+            self._update(process_id, BootState.FAILED, f"not ready in {service.ready_timeout}s")
+
+    def started(self, process_id):
+        service = self._starting_service(process_id)
+        if service is not None and service.ready == READY_STARTED:
+            self._update(process_id, BootState.READY)
+
+    def line(self, process_id, line):
+        service = self._starting_service(process_id)
+        if service is not None and service.ready == READY_LINE and service.ready_line.encode("utf-8") in line:
+            self._update(process_id, BootState.READY)
+
+    def status(self, process_id, status):
+        service = self._starting_service(process_id)
+        if service is not None and service.ready == READY_STATUS and status.strip() == READY_STATUS_MESSAGE:
+            self._update(process_id, BootState.READY)
+
+    def failed(self, process_id, reason):
+        self._update(process_id, BootState.FAILED, reason)
@@ -0,0 +1,318 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import hashlib
+import json
+import os
+import time
+
+from pyros_core.archive_installer import archive_path
+from pyros_core.code_manifest import CodeManifest, MANIFEST_FILENAME
+
+
+PART_SUFFIX = ".part"
+META_SUFFIX = ".part.meta"
+
+READ_SIZE = 65536
+
+DEFAULT_UPLOAD_TIMEOUT = 600.0
+MAX_UPLOADS_PER_PROCESS = 16
+
+# Messages on 'exec/<id>/upload' are a json header line followed by data:
+#   {"op": "begin", "name": n, "size": s, "sha256": h, "chunk": c}  - starts or resumes upload of a file
+#   {"op": "chunk", "name": n, "seq": i, "sha256": h} + data          - i-th chunk of c bytes (last can be shorter)
+#   {"op": "end", "name": n}                                        - whole file checked and moved in place
+#   {"op": "put", "name": n, "sha256": h} + data                    - whole (small) file in one message
+#   {"op": "manifest", "name": ""} + json of names to sha256        - asks which of those files need uploading
+# With "archive": true in begin or put header, the file is a tar archive of the whole process' directory.
+# Replies on 'exec/<id>/status' are 'upload-ack <next chunk> <name>' and 'upload-error <name>; <reason>',
+# 'stored <name>' once file is in place and 'upload-missing <json list of names>' for manifest.
+OP_BEGIN = "begin"
+OP_CHUNK = "chunk"
+OP_END = "end"
+OP_PUT = "put"
+OP_MANIFEST = "manifest"
+
+
+class UploadError(Exception):
+    pass
+
+
+class Upload:
+    __slots__ = ["name", "process_dir", "path", "archive", "size", "sha256", "chunk_size", "next_seq", "received", "hasher", "file",
+                 "last_active"]
+
+    def __init__(self, name, process_dir, path, archive, size, sha256, chunk_size):
+        self.name = name
+        self.process_dir = process_dir
+        self.path = path
+        self.archive = archive
+        self.size = size
+        self.sha256 = sha256
+        self.chunk_size = chunk_size
+        self.next_seq = 0
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.file = None
+        self.last_active = time.monotonic()
+
+    def chunks(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def matches(self, size, sha256, chunk_size):
+        return self.size == size and self.sha256 == sha256 and self.chunk_size == chunk_size
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def discard(self):
+        self.close()
+        for suffix in [PART_SUFFIX, META_SUFFIX]:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+class UploadReceiver:
+    # Streams uploaded files to '<name>.part' next to their final place, checking each chunk and
+    # then whole file against their sha256 before file is renamed in place. Along with the part file
+    # '<name>.part.meta' is kept, so an upload can be resumed from the last whole chunk on disk even
+    # after the daemon restarted. Messages of one process must not be received concurrently
+    # (nor with 'expire' or 'forget' of the same process); different processes can be.
+    # 'stored' is called with process id, name and path of each completed file; 'report' with process id and status.
+    # Archives are kept next to process' directory and 'installed' is called with process id, name and path instead.
+    # Uploads not continued for 'timeout' seconds are discarded by 'expire' along with their part files.
+    def __init__(self, stored, report, installed, timeout=DEFAULT_UPLOAD_TIMEOUT):
+        self.stored = stored
+        self.report = report
+        self.installed = installed
+        self.timeout = timeout
+        self._uploads = {}
+        self._manifests = {}
+
+    @staticmethod
+    def path(process_dir, name):
+        # Uploaded files can't end up outside of process' directory
+        process_dir = os.path.abspath(process_dir)
+        path = os.path.abspath(os.path.join(process_dir, name))
+        if (not path.startswith(process_dir + os.sep) or path.endswith(PART_SUFFIX) or path.endswith(META_SUFFIX)
+                or path == os.path.join(process_dir, MANIFEST_FILENAME)):
+            raise UploadError("invalid name")
+        return path
+
+    def upload_path(self, process_dir, name, archive):
+        return archive_path(process_dir) if archive else self.path(process_dir, name)
+
+    def manifest(self, process_id, process_dir):
+        manifest = self._manifests.get(process_id)
+        if manifest is None:
+            manifest = self._manifests[process_id] = CodeManifest(process_dir)
+        return manifest
+
+    def receive(self, process_id, process_dir, payload):
+        end_of_header = payload.find(b"\n")
+        try:
+            header = json.loads(payload[:end_of_header if end_of_header >= 0 else len(payload)])
+            name = header["name"]
+        except (ValueError, KeyError, TypeError):
+            self.report(process_id, "upload-error ?; invalid header")
+            return
+        data = memoryview(payload)[end_of_header + 1:] if end_of_header >= 0 else memoryview(b"")
+
+        # noinspection PyBroadException
+        try:
+            op = header.get("op")
+            archive = header.get("archive") is True
+            if op == OP_BEGIN:
+                self._begin(process_id, process_dir, name, archive, int(header["size"]), header["sha256"], int(header["chunk"]))
+            elif op == OP_CHUNK:
+                self._chunk(process_id, name, int(header["seq"]), header["sha256"], data)
+            elif op == OP_END:
+                self._end(process_id, name)
+            elif op == OP_PUT:
+                self._put(process_id, process_dir, name, archive, header["sha256"], data)
+            elif op == OP_MANIFEST:
+                self._missing(process_id, process_dir, json.loads(bytes(data)))
+            else:
+                raise UploadError("unknown op " + str(op))
+        except UploadError as upload_error:
+            self.report(process_id, f"upload-error {name}; {upload_error}")
+        except (KeyError, ValueError, TypeError) as header_error:
+            self.report(process_id, f"upload-error {name}; invalid header {header_error}")
+        except OSError as os_error:
+            self._abort(process_id, name)
+            self.report(process_id, f"upload-error {name}; {os_error}")
+
+    def idle_processes(self, now=None):
+        # Processes with abandoned uploads; each is to be expired along with other messages of the process
+        now = time.monotonic() if now is None else now
+        return {key[0] for key, upload in list(self._uploads.items()) if now - upload.last_active > self.timeout}
+
+    def expire(self, process_id, now=None):
+        now = time.monotonic() if now is None else now
+        for key, upload in [(key, upload) for key, upload in list(self._uploads.items()) if key[0] == process_id]:
+            if now - upload.last_active > self.timeout:
+                del self._uploads[key]
+                upload.discard()
+
+    def forget(self, process_id):
+        for key in [key for key in list(self._uploads) if key[0] == process_id]:
+            self._uploads.pop(key).close()
+        self._manifests.pop(process_id, None)
+
+    def _missing(self, process_id, process_dir, files):
+        # Names of files from given manifest which are not stored with the same content
+        if not isinstance(files, dict):
+            raise UploadError("invalid manifest")
+        manifest = self.manifest(process_id, process_dir)
+        missing = []
+        for name, sha256 in files.items():
+            try:
+                path = self.path(process_dir, name)
+            except UploadError:
+                self.report(process_id, f"upload-error {name}; invalid name")
+                continue
+            if manifest.sha256(name, path) != sha256:
+                missing.append(name)
+        manifest.save()
+        self.report(process_id, "upload-missing " + json.dumps(missing))
+
+    def _ack(self, process_id, upload):
+        self.report(process_id, f"upload-ack {upload.next_seq} {upload.name}")
+
+    def _abort(self, process_id, name):
+        upload = self._uploads.pop((process_id, name), None)
+        if upload is not None:
+            upload.close()
+
+    def _begin(self, process_id, process_dir, name, archive, size, sha256, chunk_size):
+        path = self.upload_path(process_dir, name, archive)
+        if size < 0 or chunk_size <= 0:
+            raise UploadError("invalid size")
+
+        upload = self._uploads.get((process_id, name))
+        if upload is not None and (upload.archive != archive or not upload.matches(size, sha256, chunk_size)):
+            self._abort(process_id, name)
+            upload = None
+
+        if upload is None:
+            uploads = [(key, upload) for key, upload in list(self._uploads.items()) if key[0] == process_id]
+            if len(uploads) >= MAX_UPLOADS_PER_PROCESS:
+                # Too many unfinished uploads; the one left alone the longest goes
+                key, oldest = min(uploads, key=lambda item: item[1].last_active)
+                del self._uploads[key]
+                oldest.discard()
+
+            upload = Upload(name, process_dir, path, archive, size, sha256, chunk_size)
+            if not self._resume(upload):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                upload.file = open(path + PART_SUFFIX, "wb")
+                with open(path + META_SUFFIX, "wt") as meta_file:
+                    json.dump({"size": size, "sha256": sha256, "chunk": chunk_size}, meta_file)
+            self._uploads[(process_id, name)] = upload
+
+        upload.last_active = time.monotonic()
+        self._ack(process_id, upload)
+
+    @staticmethod
+    def _resume(upload):
+        # Carries on from whole chunks of previous upload of the same content
+        part_path = upload.path + PART_SUFFIX
+        try:
+            with open(upload.path + META_SUFFIX, "rt") as meta_file:
+                meta = json.load(meta_file)
+            if not upload.matches(meta["size"], meta["sha256"], meta["chunk"]):
+                return False
+            part_size = os.path.getsize(part_path)
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+        upload.next_seq = min(part_size, upload.size) // upload.chunk_size
+        upload.received = upload.next_seq * upload.chunk_size
+        upload.file = open(part_path, "r+b")
+        upload.file.truncate(upload.received)
+        remaining = upload.received
+        while remaining > 0:
+            data = upload.file.read(min(READ_SIZE, remaining))
+            if len(data) == 0:
+                break
+            upload.hasher.update(data)
+            remaining -= len(data)
+        upload.file.seek(upload.received)
+        return True
+
+    def _chunk(self, process_id, name, seq, sha256, data):
+        upload = self._uploads.get((process_id, name))
+        if upload is None:
+            raise UploadError("upload not started")
+
+        upload.last_active = time.monotonic()
+        expected_len = min(upload.chunk_size, upload.size - upload.received)
+        if seq == upload.next_seq and len(data) == expected_len and hashlib.sha256(data).hexdigest() == sha256:
+            upload.file.write(data)
+            upload.hasher.update(data)
+            upload.received += len(data)
+            upload.next_seq += 1
+        # Otherwise (duplicate, out of order or damaged chunk) sender is told which chunk is next
+        self._ack(process_id, upload)
+
+    def _end(self, process_id, name):
+        upload = self._uploads.get((process_id, name))
+        if upload is None:
+            raise UploadError("upload not started")
+        if upload.received != upload.size:
+            self._ack(process_id, upload)
+            return
+
+        del self._uploads[(process_id, name)]
+        upload.file.flush()
+        os.fsync(upload.file.fileno())
+        upload.close()
+        if upload.hasher.hexdigest() != upload.sha256:
+            os.remove(upload.path + PART_SUFFIX)
+            os.remove(upload.path + META_SUFFIX)
+            raise UploadError("checksum mismatch")
+
+        os.replace(upload.path + PART_SUFFIX, upload.path)
+        os.remove(upload.path + META_SUFFIX)
+        self._completed(process_id, upload.process_dir, name, upload.path, upload.archive, upload.sha256)
+
+    def _completed(self, process_id, process_dir, name, path, archive, sha256):
+        if archive:
+            # Whole directory is replaced; manifest is built again from files when asked for
+            self._manifests.pop(process_id, None)
+            self.installed(process_id, name, path)
+        else:
+            self.manifest(process_id, process_dir).stored(name, path, sha256)
+            self.stored(process_id, name, path)
+
+    def _put(self, process_id, process_dir, name, archive, sha256, data):
+        path = self.upload_path(process_dir, name, archive)
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise UploadError("checksum mismatch")
+
+        self._abort(process_id, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path + PART_SUFFIX, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(path + PART_SUFFIX, path)
+        except OSError:
+            if os.path.exists(path + PART_SUFFIX):
+                os.remove(path + PART_SUFFIX)
+            raise
+        if os.path.exists(path + META_SUFFIX):
+            os.remove(path + META_SUFFIX)
+        self._completed(process_id, process_dir, name, path, archive, sha256)
@@ -0,0 +1,210 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import array
+import itertools
+import json
+import os
+import resource
+import signal
+import socket
+import subprocess
+import threading
+
+from pyros_core.child_reaper import ChildExit
+
+
+DEFAULT_ZYGOTE_PRELOAD = "paho.mqtt.client"
+DEFAULT_ZYGOTE_EXEC = "python3"
+ZYGOTE_START_TIMEOUT = 30.0
+SPAWN_TIMEOUT = 5.0
+
+ZYGOTE_SERVER_MODULE = "pyros_core.zygote_server"
+MAX_MESSAGE_SIZE = 1024 * 1024  # as in zygote_server
+
+
+class ZygoteProcess:
+    # Stands in for subprocess.Popen for processes forked by zygote
+    def __init__(self, pid, stdout, stderr):
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class Zygote:
+    # Daemon's side of zygote_server. Processes are spawned from any thread but the reactor's
+    # while replies and exits are read by the reactor. It also acts as reaper for processes it spawned.
+    def __init__(self, reactor, executable=DEFAULT_ZYGOTE_EXEC, preload=()):
+        self.reactor = reactor
+        self.executable = executable
+        self.preload = list(preload)
+        self.process = None
+        self._socket = None
+        self._ids = itertools.count()
+        self._pending = {}
+        self._started = threading.Event()
+        self._watchers = {}
+        self._exits = {}
+        self._lock = threading.Lock()
+
+    def is_running(self):
+        return self._socket is not None
+
+    def start(self, env):
+        # Run as module from wherever pyros_core is imported from, which might be a zip file. Zygote server
+        # is not imported by this module so importing pyros_core in zygote doesn't import it before it runs.
+        package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(env)
+        env["PYTHONPATH"] = package_path + ":" + env["PYTHONPATH"] if "PYTHONPATH" in env else package_path
+
+        daemon_socket, zygote_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = subprocess.Popen([self.executable, "-u", "-m", ZYGOTE_SERVER_MODULE, str(zygote_socket.fileno())] + self.preload,
+                                            env=env,
+                                            pass_fds=[zygote_socket.fileno()],
+                                            start_new_session=True)
+        except Exception:
+            daemon_socket.close()
+            raise
+        finally:
+            zygote_socket.close()
+
+        self._socket = daemon_socket
+        self.reactor.add_reader(daemon_socket.fileno(), self._receive)
+        if not self._started.wait(ZYGOTE_START_TIMEOUT):
+            raise TimeoutError(f"zygote didn't start in {ZYGOTE_START_TIMEOUT}s")
+        if self._socket is None:
+            raise ChildProcessError("zygote exited before it was ready")
+
+    def spawn(self, argv, cwd, env, path):
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        try:
+            with self._lock:
+                if self._socket is None:
+                    raise ConnectionError("zygote is not running")
+                request_id = next(self._ids)
+                reply = {"event": threading.Event()}
+                self._pending[request_id] = reply
+                request = {"id": request_id, "argv": argv, "cwd": cwd, "env": env, "path": path}
+                # As socket.send_fds, which is only in python 3.9+
+                self._socket.sendmsg([json.dumps(request).encode("utf-8")],
+                                     [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [stdout_write, stderr_write]))])
+        except Exception:
+            for fd in [stdout_read, stderr_read]:
+                os.close(fd)
+            raise
+        finally:
+            os.close(stdout_write)
+            os.close(stderr_write)
+
+        if not reply["event"].wait(SPAWN_TIMEOUT) or "pid" not in reply:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            os.close(stdout_read)
+            os.close(stderr_read)
+            raise ChildProcessError("zygote failed to start process; " + reply.get("error", "no response"))
+
+        return ZygoteProcess(reply["pid"], open(stdout_read, "rb", buffering=0), open(stderr_read, "rb", buffering=0))
+
+    def watch(self, process, callback):
+        # Only from reactor's thread (reaper interface as ChildReaper.watch)
+        if process.pid in self._exits:
+            self._deliver(process, callback, self._exits.pop(process.pid))
+        else:
+            self._watchers[process.pid] = (process, callback)
+
+    @staticmethod
+    def _deliver(process, callback, child_exit):
+        process.returncode = child_exit.returncode
+        callback(child_exit)
+
+    def _receive(self):
+        try:
+            message = self._socket.recv(MAX_MESSAGE_SIZE)
+        except OSError:
+            message = b""
+
+        if len(message) == 0:
+            self._closed()
+            return
+
+        message = json.loads(message)
+        if "exit" in message:
+            child_exit = ChildExit(message["exit"], message["returncode"], resource.struct_rusage(message["rusage"]))
+            if child_exit.pid in self._watchers:
+                self._deliver(*self._watchers.pop(child_exit.pid), child_exit)
+            else:
+                self._exits[child_exit.pid] = child_exit
+        elif "preloaded" in message:
+            self._started.set()
+        else:
+            with self._lock:
+                reply = self._pending.pop(message["id"], None)
+            if reply is not None:
+                reply.update(message)
+                reply["event"].set()
+
+    def _closed(self):
+        self.reactor.remove_reader(self._socket.fileno())
+        with self._lock:
+            self._socket.close()
+            self._socket = None
+            for reply in self._pending.values():
+                reply["error"] = "zygote exited"
+                reply["event"].set()
+            self._pending.clear()
+        # Zygote that exits before it is ready fails start() at once
+        self._started.set()
+
+        try:
+            self.process.wait(1.0)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+        # Processes zygote left behind can't be reaped by us; pidfd still tells when they are gone
+        for pid, (process, callback) in list(self._watchers.items()):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except (AttributeError, OSError):
+                self._deliver(process, callback, ChildExit(pid, None, None))
+                continue
+
+            def orphan_exited(_pidfd=pidfd, _process=process, _callback=callback, _pid=pid):
+                self.reactor.remove_reader(_pidfd)
+                os.close(_pidfd)
+                self._deliver(_process, _callback, ChildExit(_pid, None, None))
+
+            self.reactor.add_reader_now(pidfd, orphan_exited)
+        self._watchers.clear()
+
+    def stop(self, timeout=1.0):
+        # Zygote exits once it sees daemon's end of socket closed; processes it started keep running
+        with self._lock:
+            if self._socket is not None:
+                self._socket.shutdown(socket.SHUT_RDWR)
+        if self.process is not None:
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
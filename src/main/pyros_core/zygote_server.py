@@ -0,0 +1,183 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+# Pre-warmed python process forking processes for PyROS. It is run as a module
+# (python3 -m pyros_core.zygote_server <socket fd> <modules>) so it must not depend on the rest of pyros_core.
+#
+# Requests come from the daemon over a SOCK_SEQPACKET socket as json with stdout and
+# stderr pipe ends passed along as fds. Replies are json: {"id", "pid"} or {"id", "error"}
+# for requests and {"exit": pid, "returncode", "rusage"} when a forked process exits.
+
+import array
+import atexit
+import importlib
+import io
+import json
+import os
+import runpy
+import selectors
+import signal
+import socket
+import sys
+import traceback
+
+
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+BASE_PATH = []
+
+
+# os.waitstatus_to_exitcode and socket.recv_fds are only in python 3.9+
+
+def exit_code_of(status):
+    # Same as Popen.returncode: exit status or negative signal number
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def recv_fds(sock, size, max_fds):
+    fds = array.array("i")
+    message, ancillary_data, _flags, _address = sock.recvmsg(size, socket.CMSG_LEN(max_fds * fds.itemsize))
+    for level, kind, data in ancillary_data:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    return message, list(fds)
+
+
+def preload(modules):
+    for module in modules:
+        # noinspection PyBroadException
+        try:
+            importlib.import_module(module)
+        except Exception as exception:
+            print(f"PyROS zygote: cannot preload {module}; {exception}", file=sys.stderr)
+
+
+def run_child(request, fds, closing_fds):
+    exit_code = 1
+    # noinspection PyBroadException
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.setsid()
+
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        for fd in [null_fd] + fds + closing_fds:
+            os.close(fd)
+
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.path[:] = request["path"] + BASE_PATH
+        sys.argv = request["argv"]
+
+        # Same as python3 -u
+        sys.stdin = io.TextIOWrapper(io.FileIO(0, "r", closefd=False))
+        sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False), write_through=True)
+        sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False), write_through=True)
+
+        try:
+            runpy.run_path(os.path.join(request["cwd"], request["argv"][0]), run_name="__main__")
+            exit_code = 0
+        except SystemExit as system_exit:
+            if system_exit.code is None:
+                exit_code = 0
+            elif isinstance(system_exit.code, int):
+                exit_code = system_exit.code
+            else:
+                print(system_exit.code, file=sys.stderr)
+        except BaseException:
+            traceback.print_exc()
+
+        atexit._run_exitfuncs()
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        # noinspection PyBroadException
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        # noinspection PyProtectedMember
+        os._exit(exit_code)
+
+
+def send(sock, message):
+    sock.send(json.dumps(message).encode("utf-8"))
+
+
+def serve(sock, modules):
+    preload(modules)
+
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.signal(signal.SIGCHLD, lambda _signum, _frame: None)
+    signal.set_wakeup_fd(wakeup_write)
+
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(wakeup_read, selectors.EVENT_READ)
+
+    send(sock, {"preloaded": modules})
+
+    while True:
+        for key, _events in selector.select():
+            if key.fileobj is sock:
+                message, fds = recv_fds(sock, MAX_MESSAGE_SIZE, 2)
+                if len(message) == 0:
+                    # Daemon has gone
+                    return
+                request = json.loads(message)
+                try:
+                    pid = os.fork()
+                except OSError as exception:
+                    send(sock, {"id": request["id"], "error": str(exception)})
+                    pid = None
+
+                if pid == 0:
+                    run_child(request, fds, [sock.fileno(), wakeup_read, wakeup_write])
+
+                for fd in fds:
+                    os.close(fd)
+                if pid is not None:
+                    send(sock, {"id": request["id"], "pid": pid})
+            else:
+                try:
+                    while os.read(wakeup_read, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+                while True:
+                    try:
+                        pid, status, rusage = os.wait4(-1, os.WNOHANG)
+                    except ChildProcessError:
+                        break
+                    if pid == 0:
+                        break
+                    send(sock, {"exit": pid, "returncode": exit_code_of(status), "rusage": list(rusage)})
+
+
+if __name__ == "__main__":
+    # Current directory and path pyros_core is imported from must not be seen by preloaded modules nor by forked processes
+    sys.path.pop(0)
+    package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if package_path in sys.path:
+        sys.path.remove(package_path)
+    BASE_PATH = list(sys.path)
+    serve(socket.socket(fileno=int(sys.argv[1])), [module for module in sys.argv[2:] if module != ""])
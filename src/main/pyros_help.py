@@ -31,6 +31,7 @@ print("   alias      sets, removes or displays hostname/address aliases used for
 print("")
 print("system wide commands")
 print("   ps         lists all processes")
+print("   metrics    shows PyROS daemon's own metrics")
 # print("   service    lists services only")
 print("")
 print("process specific commands")
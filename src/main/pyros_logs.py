@@ -10,6 +10,7 @@
 #
 #################################################################################
 
+import shlex
 import sys
 
 from pyros_common import CommonCommand
@@ -18,12 +19,18 @@ from pyros_common import CommonCommand
 class PyrosLog(CommonCommand):
     def __init__(self):
         super(PyrosLog, self).__init__(__name__)
-        self.parser.add_argument("-a", "--all", action='store_true', default=False, help="reprint last 1000 log lines")
+        self.parser.add_argument("-a", "--all", action='store_true', default=False, help="reprint log lines daemon keeps in its history")
+        self.parser.add_argument("-n", "--lines", type=int, help="reprint only last N log lines (last N matching lines if filter is used)")
+        self.parser.add_argument("--since", help="reprint log lines since given time; seconds since epoch or relative time like 30s, 10m, 2h or 1d")
+        self.parser.add_argument("--from", dest="from_offset", type=int, help="reprint log lines starting from given offset")
+        self.parser.add_argument("--grep", help="reprint only log lines matching given regular expression")
+        self.parser.add_argument("--match", help="reprint only log lines containing given text")
         self.parser.add_argument("process_id", help="process id. "
                                                     "Argument <processId> can be '%' which will mean all output of all processes. "
                                                     "It cannot be used in conjunction with -a option.")
         self.everything = False
         self.all = False
+        self.logs_arguments = ""
         self.process_id = None
 
     def execute_command(self, client):
@@ -32,7 +39,7 @@ class PyrosLog(CommonCommand):
         else:
             print("Showing process " + self.process_id + " output:")
             if self.all:
-                client.publish("exec/" + self.process_id, "logs")
+                client.publish("exec/" + self.process_id, "logs" + self.logs_arguments)
         self.timeout_count = 0
         return True
 
@@ -47,6 +54,10 @@ class PyrosLog(CommonCommand):
         return True
 
     def process_status(self, line, pid):
+        if line.startswith("PyROS: logs end "):
+            if self.verbose_level > 0:
+                print("** End of log history; next offset is " + line[16:])
+            return True
         if line.startswith("PyROS: exit"):
             print("** Process " + pid + " exited.")
             return self.everything
@@ -57,9 +68,14 @@ class PyrosLog(CommonCommand):
         self.all = args.all
         self.process_id = args.process_id
 
+        for option, value in [("--tail", args.lines), ("--since", args.since), ("--from", args.from_offset), ("--grep", args.grep), ("--match", args.match)]:
+            if value is not None:
+                self.logs_arguments += " " + option + " " + shlex.quote(str(value))
+                self.all = True
+
         if self.process_id == "%":
             if self.all:
-                print("ERROR: Cannot use option -a with % (everything).")
+                print("ERROR: Cannot use option -a, -n, --since, --from, --grep or --match with % (everything).")
                 sys.exit(1)
             self.process_id = "+"
             self.everything = True
@@ -0,0 +1,49 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+from pyros_common import CommonCommand
+
+
+class PyrosMetrics(CommonCommand):
+    def __init__(self):
+        super(PyrosMetrics, self).__init__(__name__)
+
+    def process_line(self, line):
+        if line.endswith("\n"):
+            line = line[:len(line) - 1]
+
+        split = line.split(" ", 1)
+        if len(split) < 2:
+            split.append("")
+
+        if split[0] == "rss.bytes":
+            try:
+                split[1] = str(round(int(split[1]) / (1024.0 * 1024.0), 2)) + "MB"
+            except:
+                pass
+        elif split[0].startswith("latency."):
+            split[1] = split[1] + " (ms)"
+
+        print("{0!s:<24} {1}".format(*split))
+
+    def execute_command(self, client, commandId):
+        client.publish("system/" + commandId, "metrics")
+        return True
+
+    def run(self):
+        self.process_common_args_for_remote_command()
+        self.print_out_command(self.execute_command, self.process_line,
+                               "{0:<24} {1}".format("name", "value"), "")
+
+
+PyrosMetrics().run()
@@ -58,8 +58,23 @@ class PyrosPS(CommonCommand):
         else:
             split.append("")
 
+        if len(split) < 8:
+            split.append("")
+
+        if len(split) >= 9:
+            try:
+                rss = int(split[8])
+                if rss > 2 * 1024 * 1024:
+                    split[8] = str(round(rss / (1024.0 * 1024.0), 1)) + "MB"
+                else:
+                    split[8] = str(round(rss / 1024.0, 1)) + "KB"
+            except:
+                pass
+        else:
+            split.append("")
+
         # print("split=" + str(split))
-        print("{0!s:<20} {1:<18} {2:<15} {3:<7} {4:<10} {5:<15} {6:<15}".format(*split))
+        print("{0!s:<20} {1:<18} {2:<15} {3:<7} {4:<10} {5:<15} {6:<15} {7:<6} {8:<10}".format(*split))
 
     def execute_command(self, client, commandId):
         client.publish("system/" + commandId, "ps")
@@ -68,8 +83,8 @@ class PyrosPS(CommonCommand):
     def run(self):
         self.process_common_args_for_remote_command()
         self.print_out_command(self.execute_command, self.process_line,
-                               "{0:<20} {1:<18} {2:<15} {3:<7} {4:<10} {5:<15} {6:<15}".format(
-                               "name", "type", "status", "rc", "len", "date", "pinged"), "")
+                               "{0:<20} {1:<18} {2:<15} {3:<7} {4:<10} {5:<15} {6:<15} {7:<6} {8:<10}".format(
+                               "name", "type", "status", "rc", "len", "date", "pinged", "cpu%", "rss"), "")
 
 
 PyrosPS().run()
@@ -12,12 +12,57 @@
 
 
 import argparse
+import gzip
+import hashlib
+import json
 import os
-import time
+import tarfile
+import tempfile
 
 from pyros_common import CommonCommand
 
 
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_WINDOW = 8
+
+
+def file_sha256(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def make_archive(archive_filename, files):
+    # Same files make the same archive (no time in gzip header, no owners), so an interrupted upload can be resumed
+    def reset_owner(tarinfo):
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = ""
+        return tarinfo
+
+    with open(archive_filename, "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                for name, filename in sorted(files.items()):
+                    tar.add(filename, arcname=name, recursive=False, filter=reset_owner)
+
+
+class FileUpload:
+    def __init__(self, name, filename, chunk_size, archive=False):
+        self.name = name
+        self.filename = filename
+        self.archive = archive
+        self.size = os.path.getsize(filename)
+        self.sha256 = file_sha256(filename)
+        self.chunk_size = chunk_size
+        self.chunks = (self.size + chunk_size - 1) // chunk_size
+        self.next_seq = None
+        self.acked = 0
+        self.outstanding = 0
+        self.ended = False
+
+
 class PyrosUpload(CommonCommand):
     def __init__(self):
         super(PyrosUpload, self).__init__(__name__)
@@ -25,6 +70,9 @@ class PyrosUpload(CommonCommand):
         self.parser.add_argument("-r", "--restart", action="store_true", default=False, help="restarts uploaded service.")
         self.parser.add_argument("-x", "--exec", help="sets executable to be used to start program. If omitted 'python3' is used by default.")
         self.parser.add_argument("-f", "--tail", action="store_true", default=False, help="'tail' messages out of process.")
+        self.parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="size of chunks files are uploaded in. Smaller files are sent in one message.")
+        self.parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="number of chunks sent before waiting for acknowledgement.")
+        self.parser.add_argument("--archive", action="store_true", default=False, help="uploads main file and extra files in one archive which replaces all of process' files at once.")
         self.parser.add_argument("process_id", help="id process is going to be known from this point on.")
         self.parser.add_argument("file", nargs='?', help="main file name to be uploaded.")
         group = self.parser.add_argument_group()
@@ -40,58 +88,48 @@ class PyrosUpload(CommonCommand):
 
         self.extra_files = []
 
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.window = DEFAULT_WINDOW
+        self.archive = False
+        self.archive_filename = None
+        self.archive_files = {}
+
         self.had_start = False
         self.pyros_client = None
         self.files = []
+        self.candidates = {}
+        self.manifest_pending = False
+        self.uploads = []
+        self.upload = None
 
     def execute_command(self, client):
         def send_file(dest_path, filename):
-            if self.verbose_level >= 1:
-                print(f"Sending file '{filename}' to '{dest_path}'")
-            with open(filename, "rb") as f:
-                content = f.read()
-
-                extra_name = os.path.join(dest_path, os.path.split(filename)[1])
-                self.files.append(extra_name)
-
-                if self.verbose_level >= 2:
-                    print(f"Sending file content to exec/{self.process_id}/process/{extra_name}, content len {len(content)}")
-                client.publish(f"exec/{self.process_id}/process/{extra_name}", content)
-                time.sleep(0.1)
+            # Files are only sent if daemon doesn't have them already (see send_missing)
+            extra_name = os.path.join(dest_path, os.path.split(filename)[1])
+            if self.archive:
+                self.archive_files[extra_name] = filename
+            else:
+                self.candidates[extra_name] = FileUpload(extra_name, filename, self.chunk_size)
 
         def process_dir(dest_path, dir_path):
             for f in os.listdir(dir_path):
                 if not f.endswith('__pycache__'):
-                    if os.path.isdir(f):
+                    if os.path.isdir(os.path.join(dir_path, f)):
                         process_dir(os.path.join(dest_path, f), os.path.join(dir_path, f))
                     else:
                         send_file(dest_path, os.path.join(dir_path, f))
 
         self.pyros_client = client
 
-        if self.filename is not None:
+        if self.filename is not None and not self.archive:
             with open(self.filename) as file:
                 file_content = file.read()
 
             if self.verbose_level >= 2:
                 print(f"Sending file content to exec/{self.process_id}/process")
             client.publish(f"exec/{self.process_id}/process", file_content)
-            time.sleep(0.1)
 
-            if self.service:
-                if self.verbose_level >= 2:
-                    print(f"Sending exec/{self.process_id}, make-service")
-                    print(f"Sending exec/{self.process_id}, make-service")
-                client.publish(f"exec/{self.process_id}", "enable-service")
-                time.sleep(0.1)
-                client.publish(f"exec/{self.process_id}", "enable-service")
-                time.sleep(0.1)
-
-            if self.executable is not None:
-                if self.verbose_level >= 2:
-                    print(f"Sending exec/{self.process_id}, set-executable")
-                client.publish(f"exec/{self.process_id}", f"set-executable {self.executable}")
-                time.sleep(0.1)
+            self.send_settings()
 
         if self.extra_files is not None:
             for extra_file in self.extra_files:
@@ -100,8 +138,116 @@ class PyrosUpload(CommonCommand):
                 else:
                     send_file("", extra_file)
 
+        if self.archive:
+            self.send_archive()
+            return True
+
+        if len(self.candidates) > 0:
+            # Daemon replies with files it doesn't have the same
+            self.manifest_pending = True
+            manifest = {name: upload.sha256 for name, upload in self.candidates.items()}
+            self.send_upload_message({"op": "manifest", "name": ""}, json.dumps(manifest).encode("utf-8"))
+
+        return len(self.files) > 0 or self.manifest_pending
+
+    def send_settings(self):
+        if self.service:
+            if self.verbose_level >= 2:
+                print(f"Sending exec/{self.process_id}, make-service")
+                print(f"Sending exec/{self.process_id}, make-service")
+            self.pyros_client.publish(f"exec/{self.process_id}", "enable-service")
+            self.pyros_client.publish(f"exec/{self.process_id}", "enable-service")
+
+        if self.executable is not None:
+            if self.verbose_level >= 2:
+                print(f"Sending exec/{self.process_id}, set-executable")
+            self.pyros_client.publish(f"exec/{self.process_id}", f"set-executable {self.executable}")
+
+    def send_archive(self):
+        # All files in one archive; daemon replaces process' directory with its content once it has all of it
+        files = dict(self.archive_files)
+        files[self.process_id + "_main.py"] = self.filename
+        make_archive(self.archive_filename, files)
+        upload = FileUpload(self.process_id + ".tar.gz", self.archive_filename, self.chunk_size, archive=True)
+        if self.verbose_level >= 1:
+            print(f"Sending {len(files)} files in archive of {upload.size} bytes")
+        if upload.size <= self.chunk_size:
+            with open(upload.filename, "rb") as f:
+                self.send_upload_message({"op": "put", "name": upload.name, "sha256": upload.sha256, "archive": True}, f.read())
+        else:
+            self.uploads.append(upload)
+            self.start_next_upload()
+
+    def send_upload_message(self, header, data=b""):
+        self.pyros_client.publish(f"exec/{self.process_id}/upload", json.dumps(header).encode("utf-8") + b"\n" + data)
+
+    def send_missing(self, missing):
+        if self.verbose_level >= 1:
+            print(f"Sending {len(missing)} of {len(self.candidates)} files")
+        for name in missing:
+            upload = self.candidates[name]
+            if self.verbose_level >= 1:
+                print(f"Sending file '{upload.filename}' to '{name}'")
+            self.files.append(name)
+            if upload.size <= self.chunk_size:
+                # Small files go at once, in one message each
+                with open(upload.filename, "rb") as f:
+                    content = f.read()
+                if self.verbose_level >= 2:
+                    print(f"Sending file content to exec/{self.process_id}/upload for {name}, content len {len(content)}")
+                self.send_upload_message({"op": "put", "name": name, "sha256": upload.sha256}, content)
+            else:
+                self.uploads.append(upload)
+        self.start_next_upload()
+
+    def all_stored(self):
+        if self.restart:
+            if self.verbose_level >= 2:
+                print(f"Sending exec/{self.process_id}, set-restart")
+            self.pyros_client.publish(f"exec/{self.process_id}", "restart")
+            return True
         return False
 
+    def start_next_upload(self):
+        if self.upload is None and len(self.uploads) > 0:
+            self.upload = self.uploads.pop(0)
+            if self.verbose_level >= 2:
+                print(f"Uploading {self.upload.name} in {self.upload.chunks} chunks")
+            self.upload.outstanding = 1
+            self.send_upload_message({"op": "begin", "name": self.upload.name, "size": self.upload.size,
+                                      "sha256": self.upload.sha256, "chunk": self.upload.chunk_size, "archive": self.upload.archive})
+
+    def upload_acked(self, name, next_seq):
+        # Each message sent gets exactly one ack with next chunk daemon expects. When all sent chunks
+        # are acknowledged but daemon still expects an earlier one, chunks from that one are sent again.
+        upload = self.upload
+        if upload is None or upload.name != name:
+            return
+        upload.outstanding -= 1
+        if upload.next_seq is None:
+            # Begin acknowledged - daemon might already have some chunks from earlier upload
+            if self.verbose_level >= 1 and next_seq > 0:
+                print(f"Resuming upload of {name} from chunk {next_seq} of {upload.chunks}")
+            upload.next_seq = next_seq
+        upload.acked = max(upload.acked, next_seq)
+        if upload.outstanding <= 0 and upload.next_seq > upload.acked:
+            upload.next_seq = upload.acked
+
+        if upload.acked >= upload.chunks:
+            if not upload.ended:
+                upload.ended = True
+                self.send_upload_message({"op": "end", "name": name})
+            return
+
+        with open(upload.filename, "rb") as f:
+            while upload.next_seq < upload.chunks and upload.next_seq < upload.acked + self.window:
+                f.seek(upload.next_seq * upload.chunk_size)
+                data = f.read(upload.chunk_size)
+                self.send_upload_message({"op": "chunk", "name": name, "seq": upload.next_seq,
+                                          "sha256": hashlib.sha256(data).hexdigest()}, data)
+                upload.next_seq += 1
+                upload.outstanding += 1
+
     def process_out(self, line, _pid):
         if line.endswith("\n"):
             line = line[:len(line) - 1]
@@ -111,18 +257,36 @@ class PyrosUpload(CommonCommand):
         return True
 
     def process_status(self, line, pid):
-        if line.startswith("stored "):
+        if line.startswith("upload-ack "):
+            next_seq, name = line[11:].split(" ", 1)
+            self.upload_acked(name, int(next_seq))
+        elif line.startswith("upload-missing "):
+            self.manifest_pending = False
+            self.send_missing([name for name in json.loads(line[15:]) if name in self.candidates])
+            if len(self.files) == 0:
+                return self.all_stored()
+        elif line.startswith("upload-error "):
+            print(f"ERROR: Failed to upload {line[13:]}")
+            return False
+        elif line.startswith("installed "):
+            if self.verbose_level >= 1:
+                print(f"Installed {line[10:]}")
+            self.upload = None
+            self.send_settings()
+            return self.all_stored()
+        elif line.startswith("stored "):
             file = line[7:]
+            if "; compile error: " in file:
+                file, error = file.split("; compile error: ", 1)
+                print(f"Compile error in '{file}': {error}")
+            if self.upload is not None and self.upload.name == file:
+                self.upload = None
+                self.start_next_upload()
             if file in self.files:
                 i = self.files.index(file)
                 del self.files[i]
-                if len(self.files) == 0:
-                    if self.restart:
-                        if self.verbose_level >= 2:
-                            print(f"Sending exec/{self.process_id}, set-restart")
-                        self.pyros_client.publish("exec/{self.process_id}", "restart")
-                    else:
-                        return False
+                if len(self.files) == 0 and not self.manifest_pending:
+                    return self.all_stored()
         elif self.restart and line.startswith("PyROS: started"):
             self.had_start = True
             if self.tail:
@@ -139,15 +303,28 @@ class PyrosUpload(CommonCommand):
         self.tail = args.tail
         self.process_id = args.process_id
         self.executable = args.exec
+        self.chunk_size = max(1, args.chunk_size)
+        self.window = max(1, args.window)
+        self.archive = args.archive
 
         self.process_id = args.process_id
         self.filename = args.file
 
         self.extra_files = args.extra
 
-        self.files = [self.process_id + ".py"]
+        if self.archive:
+            if self.filename is None:
+                self.parser.error("--archive needs main file")
+            archive_file, self.archive_filename = tempfile.mkstemp(suffix=".tar.gz")
+            os.close(archive_file)
+        else:
+            self.files = [self.process_id + "_main.py"] if self.filename is not None else []
 
-        self.process_command(self.process_id, self.execute_command, self.process_out, self.process_status)
+        try:
+            self.process_command(self.process_id, self.execute_command, self.process_out, self.process_status)
+        finally:
+            if self.archive_filename is not None:
+                os.remove(self.archive_filename)
 
 
 PyrosUpload().run()
@@ -0,0 +1,64 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import threading
+import time
+import unittest
+
+from pyros_core.agent_watchdog import AgentWatchdog
+from pyros_core.scheduler import Scheduler
+
+
+class TestAgentWatchdog(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        self.expired = []
+        self.expired_event = threading.Event()
+        self.watchdog = AgentWatchdog(self.scheduler, self.on_expired, timeout=0.05)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def on_expired(self, process_id):
+        self.expired.append(process_id)
+        self.expired_event.set()
+
+    def test_agent_expires_without_ping(self):
+        self.watchdog.watch("a", None)
+        self.assertTrue(self.expired_event.wait(2.0))
+        self.assertEqual(["a"], self.expired)
+        self.assertEqual(0, len(self.watchdog))
+
+    def test_ping_moves_deadline(self):
+        self.watchdog.timeout = 0.2
+        self.watchdog.watch("a", time.time())
+        self.watchdog.watch("b", time.time())
+        time.sleep(0.1)
+        self.watchdog.watch("a", time.time())
+        self.assertTrue(self.expired_event.wait(2.0))
+        self.assertEqual(["b"], self.expired)
+        self.assertEqual(1, len(self.watchdog))
+
+    def test_forgotten_agent_not_expired(self):
+        self.watchdog.watch("a", None)
+        self.watchdog.watch("b", time.time() + 0.1)
+        self.watchdog.forget("a")
+        self.assertTrue(self.expired_event.wait(2.0))
+        self.assertEqual(["b"], self.expired)
+
+    def test_stale_entries_compacted(self):
+        self.watchdog.timeout = 60
+        for _ in range(1000):
+            self.watchdog.watch("a", time.time())
+        self.assertLess(len(self.watchdog._heap), 100)
@@ -0,0 +1,106 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from pyros_core.archive_installer import install_archive, recover, ArchiveError, STAGING_SUFFIX, OLD_SUFFIX
+
+
+class TestArchiveInstaller(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.process_dir = os.path.join(self.dir, "p")
+        os.mkdir(self.process_dir)
+        self.write("old.py", "old")
+        self.write(".process", "type=service")
+        self.archive = os.path.join(self.dir, "archive.tar.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write(self, name, content, directory=None):
+        with open(os.path.join(directory or self.process_dir, name), "wt") as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(os.path.join(self.process_dir, name), "rt") as f:
+            return f.read()
+
+    def make_archive(self, files, symlink=None):
+        with tarfile.open(self.archive, "w:gz") as tar:
+            for name, content in files.items():
+                data = content.encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            if symlink is not None:
+                info = tarfile.TarInfo(symlink)
+                info.type = tarfile.SYMTYPE
+                info.linkname = "/etc/passwd"
+                tar.addfile(info)
+
+    def test_install_replaces_files_and_keeps_process_file(self):
+        self.make_archive({"main.py": "new", "lib/util.py": "util"})
+        files = install_archive(self.archive, self.process_dir)
+        self.assertEqual(["lib/util.py", "main.py"], sorted(files))
+        self.assertEqual([".process", "lib", "main.py"], sorted(os.listdir(self.process_dir)))
+        self.assertEqual("type=service", self.read(".process"))
+        self.assertEqual(["archive.tar.gz", "p"], sorted(os.listdir(self.dir)))
+
+    def test_failed_install_leaves_old_files(self):
+        for files, symlink in [({"../escape.py": "x"}, None), ({"main.py": "new"}, "link")]:
+            self.make_archive(files, symlink)
+            with self.assertRaises(ArchiveError):
+                install_archive(self.archive, self.process_dir)
+            self.assertEqual("old", self.read("old.py"))
+            self.assertEqual(["archive.tar.gz", "p"], sorted(os.listdir(self.dir)))
+
+    def test_corrupt_archive(self):
+        with open(self.archive, "wb") as f:
+            f.write(b"not an archive")
+        with self.assertRaises(ArchiveError):
+            install_archive(self.archive, self.process_dir)
+        self.assertEqual("old", self.read("old.py"))
+
+    def test_failed_prepare_leaves_old_files(self):
+        def prepare(_staging, _files):
+            raise OSError("compile failed")
+
+        self.make_archive({"main.py": "new"})
+        with self.assertRaises(OSError):
+            install_archive(self.archive, self.process_dir, prepare)
+        self.assertEqual("old", self.read("old.py"))
+        self.assertEqual(["archive.tar.gz", "p"], sorted(os.listdir(self.dir)))
+
+    def test_recover_interrupted_swap(self):
+        # Stopped between two renames - only old directory is left
+        old = os.path.join(self.dir, ".p" + OLD_SUFFIX)
+        os.rename(self.process_dir, old)
+        os.mkdir(os.path.join(self.dir, ".q" + STAGING_SUFFIX))
+        recover(self.dir)
+        self.assertEqual("old", self.read("old.py"))
+        self.assertEqual(["p"], os.listdir(self.dir))
+
+    def test_recover_finished_swap(self):
+        # Stopped after both renames - old directory is just removed
+        old = os.path.join(self.dir, ".p" + OLD_SUFFIX)
+        os.mkdir(old)
+        self.write("stale.py", "stale", old)
+        recover(self.dir)
+        self.assertEqual("old", self.read("old.py"))
+        self.assertEqual(["p"], os.listdir(self.dir))
@@ -0,0 +1,66 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import os
+import subprocess
+import time
+import unittest
+
+from pyros_core.child_reaper import ChildReaper, exit_code_of
+
+
+class FakeReactor:
+    def __init__(self):
+        self.readers = {}
+
+    def add_reader(self, fd, callback):
+        self.readers[fd] = callback
+
+    def add_reader_now(self, fd, callback):
+        self.readers[fd] = callback
+
+    def remove_reader(self, fd):
+        del self.readers[fd]
+
+
+class TestExitCode(unittest.TestCase):
+    def test_exit_status(self):
+        process = subprocess.Popen(["sh", "-c", "exit 3"])
+        _pid, status = os.waitpid(process.pid, 0)
+        self.assertEqual(3, exit_code_of(status))
+
+    def test_signal(self):
+        process = subprocess.Popen(["sh", "-c", "kill -TERM $$"])
+        _pid, status = os.waitpid(process.pid, 0)
+        self.assertEqual(-15, exit_code_of(status))
+
+
+class TestChildReaper(unittest.TestCase):
+    def test_reaps_without_pidfd(self):
+        reaper = ChildReaper(FakeReactor())
+        reaper.use_pidfd = False
+        exits = []
+        process = subprocess.Popen(["sh", "-c", "exit 5"])
+        reaper.watch(process, exits.append)
+
+        deadline = time.monotonic() + 5.0
+        while len(exits) == 0 and time.monotonic() < deadline:
+            # What SIGCHLD through the wakeup pipe would do
+            for pid in list(reaper._watched):
+                reaper._reap(pid)
+            time.sleep(0.01)
+
+        self.assertEqual(1, len(exits))
+        self.assertEqual(process.pid, exits[0].pid)
+        self.assertEqual(5, exits[0].returncode)
+        self.assertEqual(5, process.returncode)
+        self.assertEqual({}, reaper._watched)
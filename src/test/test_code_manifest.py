@@ -0,0 +1,73 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyros_core.code_manifest import CodeManifest, MANIFEST_FILENAME
+
+
+class TestCodeManifest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "main.py")
+        self.write(b"print('hello')")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write(self, data):
+        with open(self.path, "wb") as f:
+            f.write(data)
+        return hashlib.sha256(data).hexdigest()
+
+    def test_hash_kept_between_loads(self):
+        manifest = CodeManifest(self.dir)
+        sha256 = manifest.sha256("main.py", self.path)
+        self.assertEqual(hashlib.sha256(b"print('hello')").hexdigest(), sha256)
+        manifest.save()
+        self.assertFalse(manifest.dirty)
+
+        manifest = CodeManifest(self.dir)
+        self.assertEqual(sha256, manifest.entries["main.py"][0])
+        self.assertEqual(sha256, manifest.sha256("main.py", self.path))
+        self.assertFalse(manifest.dirty)
+
+    def test_changed_file_hashed_again(self):
+        manifest = CodeManifest(self.dir)
+        manifest.sha256("main.py", self.path)
+        sha256 = self.write(b"print('changed file')")
+        self.assertEqual(sha256, manifest.sha256("main.py", self.path))
+
+    def test_stored_file_not_read(self):
+        manifest = CodeManifest(self.dir)
+        manifest.stored("main.py", self.path, "known")
+        self.assertEqual("known", manifest.sha256("main.py", self.path))
+
+    def test_removed_file_forgotten(self):
+        manifest = CodeManifest(self.dir)
+        manifest.sha256("main.py", self.path)
+        manifest.dirty = False
+        os.remove(self.path)
+        self.assertIsNone(manifest.sha256("main.py", self.path))
+        self.assertNotIn("main.py", manifest.entries)
+        self.assertTrue(manifest.dirty)
+
+    def test_invalid_manifest_ignored(self):
+        for content in ["not json", "[1, 2]", "{\"main.py\": 1}", "{\"main.py\": [\"sha\"]}"]:
+            with open(os.path.join(self.dir, MANIFEST_FILENAME), "wt") as f:
+                f.write(content)
+            self.assertEqual({}, CodeManifest(self.dir).entries)
@@ -0,0 +1,58 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import threading
+import unittest
+
+from pyros_core.command_executor import CommandExecutor
+
+
+class TestCommandExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = CommandExecutor(workers=4)
+        self.executor.start()
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def record(self, key, value, event=None):
+        with self.lock:
+            self.calls.append((key, value))
+        if event is not None:
+            event.set()
+
+    def test_same_key_runs_in_order(self):
+        done = threading.Event()
+        for i in range(100):
+            self.executor.submit("p", self.record, "p", i, done if i == 99 else None)
+        self.assertTrue(done.wait(2.0))
+        self.assertEqual([("p", i) for i in range(100)], self.calls)
+
+    def test_blocked_key_does_not_block_others(self):
+        release = threading.Event()
+        done = threading.Event()
+        self.executor.submit("slow", release.wait, 2.0)
+        self.executor.submit("slow", self.record, "slow", 1)
+        self.executor.submit("fast", self.record, "fast", 1, done)
+        self.assertTrue(done.wait(2.0))
+        self.assertEqual([("fast", 1)], self.calls)
+        release.set()
+
+    def test_failing_command_does_not_stop_key(self):
+        def fail():
+            raise ValueError("expected")
+
+        done = threading.Event()
+        self.executor.submit("p", fail)
+        self.executor.submit("p", self.record, "p", 1, done)
+        self.assertTrue(done.wait(2.0))
+        self.assertEqual([("p", 1)], self.calls)
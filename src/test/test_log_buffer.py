@@ -0,0 +1,55 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import unittest
+
+from pyros_core.log_buffer import LogRingBuffer, RECORD_HEADER
+
+
+class TestLogRingBuffer(unittest.TestCase):
+    def test_records_with_offsets(self):
+        buffer = LogRingBuffer(1024)
+        buffer.append("a", timestamp=1.0)
+        buffer.extend(["b", "c"], timestamp=2.0)
+        self.assertEqual([(0, 1.0, "a"), (1, 2.0, "b"), (2, 2.0, "c")], list(buffer.records()))
+        self.assertEqual(["b", "c"], [line for _, _, line in buffer.records(1)])
+        self.assertEqual(3, len(buffer))
+
+    def test_oldest_evicted_when_full(self):
+        buffer = LogRingBuffer((RECORD_HEADER.size + 3) * 4)
+        for i in range(10):
+            buffer.append(f"{i:03}")
+        self.assertEqual(["006", "007", "008", "009"], list(buffer.lines()))
+        self.assertEqual(6, buffer.first_offset)
+        self.assertEqual(10, buffer.next_offset)
+
+    def test_records_wrap_around_buffer_end(self):
+        buffer = LogRingBuffer((RECORD_HEADER.size + 4) * 2 + 5)
+        buffer.extend(["aaaa", "bbbb"])
+        buffer.append("cccc")
+        buffer.append("dddd")
+        self.assertEqual(["cccc", "dddd"], list(buffer.lines()))
+
+    def test_long_line_truncated(self):
+        buffer = LogRingBuffer(RECORD_HEADER.size + 4)
+        buffer.append("123456")
+        self.assertEqual(["1234"], list(buffer.lines()))
+
+    def test_capacity_too_small(self):
+        with self.assertRaises(ValueError):
+            LogRingBuffer(RECORD_HEADER.size)
+
+    def test_continues_from_first_offset(self):
+        buffer = LogRingBuffer(1024, first_offset=5)
+        buffer.append("a")
+        self.assertEqual([5], [offset for offset, _, _ in buffer.records()])
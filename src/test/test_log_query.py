@@ -0,0 +1,49 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import unittest
+
+from pyros_core.log_buffer import LogRingBuffer
+from pyros_core.log_query import LogQuery, parse_since
+
+
+class TestLogQuery(unittest.TestCase):
+    def setUp(self):
+        self.buffer = LogRingBuffer(4096)
+        for i in range(10):
+            self.buffer.append(f"{'even' if i % 2 == 0 else 'odd'} {i}", timestamp=100.0 + i)
+
+    def select(self, arguments):
+        return [line for _, _, line in LogQuery.parse(arguments).select(self.buffer)]
+
+    def test_tail(self):
+        self.assertEqual(["even 8", "odd 9"], self.select("-n 2"))
+        self.assertEqual([], self.select("--tail 0"))
+
+    def test_tail_of_matching_lines(self):
+        self.assertEqual(["odd 7", "odd 9"], self.select("--match odd -n 2"))
+        self.assertEqual(["even 6", "even 8"], self.select("--grep '^even [0-9]$' -n 2"))
+
+    def test_since_and_from(self):
+        self.assertEqual(["even 8", "odd 9"], self.select("--since 108"))
+        self.assertEqual(["odd 7"], self.select("--from 7 -n 3 --match 7"))
+
+    def test_invalid_arguments(self):
+        for arguments in ["-n", "-n -1", "--grep '('", "--colour red"]:
+            with self.assertRaises(ValueError):
+                LogQuery.parse(arguments)
+
+    def test_parse_since(self):
+        self.assertEqual(1000.0 - 90, parse_since("90s", now=1000.0))
+        self.assertEqual(1000.0 - 7200, parse_since("2h", now=1000.0))
+        self.assertEqual(123.5, parse_since("123.5"))
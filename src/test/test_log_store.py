@@ -0,0 +1,93 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyros_core.log_store import SegmentedLog, LogWriter, SEGMENT_SUFFIX
+
+
+class TestSegmentedLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def new_log(self, **kwargs):
+        return SegmentedLog(os.path.join(self.dir, "p"), **kwargs)
+
+    def segments(self):
+        return sorted(f for f in os.listdir(os.path.join(self.dir, "p")) if f.endswith(SEGMENT_SUFFIX))
+
+    def test_records_from_offset(self):
+        log = self.new_log(segment_size=64, index_interval=16)
+        for i in range(20):
+            log.append(float(i), f"line {i}".encode("utf-8"))
+        log.flush()
+        self.assertEqual([(i, float(i), f"line {i}") for i in range(20)], list(log.records()))
+        self.assertEqual([13, 14], [offset for offset, _, _ in log.records(13)][:2])
+        log.close()
+
+    def test_old_segments_removed(self):
+        log = self.new_log(segment_size=20, max_segments=2)
+        for i in range(10):
+            log.append(float(i), b"0123456789")
+        log.flush()
+        self.assertEqual(2, len(self.segments()))
+        self.assertEqual([8, 9], [offset for offset, _, _ in log.records()])
+        log.close()
+
+    def test_offset_for_time(self):
+        log = self.new_log(index_interval=1)
+        for i in range(10):
+            log.append(float(i), b"x")
+        log.flush()
+        self.assertEqual(4, log.offset_for_time(5.0))
+        self.assertEqual(0, log.offset_for_time(0.0))
+        log.close()
+
+    def test_recovers_after_partial_write(self):
+        log = self.new_log()
+        log.append(1.0, b"first")
+        log.append(2.0, b"second")
+        log.close()
+        segment = os.path.join(self.dir, "p", self.segments()[-1])
+        os.truncate(segment, os.path.getsize(segment) - 2)
+
+        log = self.new_log()
+        self.assertEqual(1, log.next_offset)
+        log.append(3.0, b"third")
+        log.flush()
+        self.assertEqual([(0, 1.0, "first"), (1, 3.0, "third")], list(log.records()))
+        log.close()
+
+
+class TestLogWriter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_stop_writes_queued_lines(self):
+        log = SegmentedLog(os.path.join(self.dir, "p"))
+        writer = LogWriter(fsync_interval=60.0)
+        writer.start()
+        writer.append(log, 1.0, b"a")
+        writer.extend(log, 2.0, [b"b", b"c"])
+        writer.stop()
+        self.assertEqual(["a", "b", "c"], [line for _, _, line in log.records()])
+        log.close()
@@ -0,0 +1,94 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import re
+import unittest
+
+from pyros_core.metrics import Histogram, Metrics, SUB_BUCKET_HALF, prometheus_label, prometheus_lines
+from pyros_core.process_registry import ProcessRecord
+from pyros_core.pyros_core import PyrosDaemon
+from pyros_core.resource_sampler import ResourceSample
+
+# Sample line of text exposition format
+METRIC_LINE = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*(\{.*\})? -?[0-9.e+-]+$")
+
+
+def types(lines):
+    return {line.split(" ")[2]: line.split(" ")[3] for line in lines if line.startswith("# TYPE ")}
+
+
+class TestHistogram(unittest.TestCase):
+    def test_small_values_exact(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.record(value)
+        self.assertEqual([50, 90, 99, 100], histogram.percentiles([50.0, 90.0, 99.0, 99.9]))
+        self.assertEqual(1, histogram.min)
+        self.assertEqual(100, histogram.max)
+        self.assertEqual(50.5, histogram.mean())
+
+    def test_relative_error(self):
+        histogram = Histogram()
+        for value in [1000, 12345, 999999, 123456789]:
+            histogram.record(value)
+        for percentile, value in zip([25.0, 50.0, 75.0, 100.0], [1000, 12345, 999999, 123456789]):
+            reported = histogram.percentiles([percentile])[0]
+            self.assertGreaterEqual(reported, value)
+            self.assertLessEqual(reported - value, value / SUB_BUCKET_HALF)
+
+    def test_empty(self):
+        self.assertEqual([0, 0], Histogram().percentiles([50.0, 99.0]))
+
+
+class TestPrometheus(unittest.TestCase):
+    def test_lines(self):
+        metrics = Metrics()
+        metrics.gauge("rss.bytes", lambda: 1024)
+        metrics.counter("errors").inc(2)
+        metrics.meter("output.lines").mark(3)
+        metrics.histogram("latency.start").record(1500)
+        lines = prometheus_lines(metrics)
+
+        self.assertIn("pyros_rss_bytes 1024", lines)
+        self.assertIn("pyros_errors_total 2", lines)
+        self.assertIn("pyros_output_lines_total 3", lines)
+        self.assertIn("pyros_latency_start_seconds_count 1", lines)
+        self.assertEqual({"pyros_uptime_seconds": "gauge", "pyros_rss_bytes": "gauge", "pyros_errors_total": "counter",
+                          "pyros_output_lines_total": "counter", "pyros_latency_start_seconds": "summary"}, types(lines))
+        for line in lines:
+            self.assertTrue(line.startswith("# ") or METRIC_LINE.match(line), line)
+
+    def test_label(self):
+        self.assertEqual("a\\\"b\\\\c\\n", prometheus_label("a\"b\\c\n"))
+
+    def test_process_metrics(self):
+        daemon = PyrosDaemon()
+        record = ProcessRecord("p1")
+        daemon.processes.add(record)
+        daemon.processes.set_running(record, None)
+        record.resources = ResourceSample(0)
+        record.resources.rss = 2048
+        record.resources.read_bytes = 10
+
+        lines = daemon.prometheus_metrics().splitlines()
+        metric_types = types(lines)
+        self.assertEqual("counter", metric_types["pyros_process_read_bytes_total"])
+        self.assertEqual("counter", metric_types["pyros_process_write_bytes_total"])
+        self.assertEqual("gauge", metric_types["pyros_process_rss_bytes"])
+        self.assertIn("pyros_rss_bytes", metric_types)
+        self.assertIn("pyros_process_read_bytes_total{process=\"p1\",type=\"process\"} 10", lines)
+        self.assertIn("pyros_process_rss_bytes{process=\"p1\",type=\"process\"} 2048", lines)
+        for name, metric_type in metric_types.items():
+            if metric_type == "counter":
+                self.assertTrue(name.endswith("_total"), name)
+            else:
+                self.assertFalse(name.endswith("_total"), name)
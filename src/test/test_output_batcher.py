@@ -0,0 +1,66 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import threading
+import unittest
+
+from pyros_core.output_batcher import OutputBatcher
+from pyros_core.scheduler import Scheduler
+
+
+class TestOutputBatcher(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        self.payloads = []
+        self.published = threading.Event()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def publish(self, payload):
+        self.payloads.append(payload)
+        self.published.set()
+
+    def test_flushed_after_interval(self):
+        batcher = OutputBatcher(self.publish, self.scheduler, 0.01, 1000)
+        batcher.add(b"a")
+        batcher.extend([b"b", b"c"])
+        self.assertTrue(self.published.wait(2.0))
+        self.assertEqual([b"a\nb\nc"], self.payloads)
+
+    def test_payload_not_over_size(self):
+        batcher = OutputBatcher(self.publish, self.scheduler, 10.0, 10)
+        batcher.extend([b"1234", b"1234", b"1234", b"12", b"1"])
+        batcher.flush()
+        self.assertEqual([b"1234\n1234", b"1234\n12\n1"], self.payloads)
+        for payload in self.payloads:
+            self.assertLessEqual(len(payload), 10)
+
+    def test_published_when_size_reached(self):
+        batcher = OutputBatcher(self.publish, self.scheduler, 10.0, 9)
+        batcher.extend([b"1234", b"1234"])
+        self.assertEqual([b"1234\n1234"], self.payloads)
+
+    def test_long_line_alone(self):
+        batcher = OutputBatcher(self.publish, self.scheduler, 10.0, 5)
+        batcher.extend([b"12", b"1234567890", b"3"])
+        batcher.flush()
+        self.assertEqual([b"12", b"1234567890", b"3"], self.payloads)
+
+    def test_rest_published_after_interval(self):
+        batcher = OutputBatcher(self.publish, self.scheduler, 0.01, 5)
+        batcher.extend([b"12345", b"6"])
+        self.assertEqual([b"12345"], self.payloads)
+        self.published.clear()
+        self.assertTrue(self.published.wait(2.0))
+        self.assertEqual([b"12345", b"6"], self.payloads)
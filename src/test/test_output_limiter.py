@@ -0,0 +1,116 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import threading
+import unittest
+
+from pyros_core.output_limiter import OutputLimiter, PublishBacklog, MAX_MID, POLICY_DROP, POLICY_SAMPLE
+
+
+class TestOutputLimiter(unittest.TestCase):
+    def test_unlimited(self):
+        limiter = OutputLimiter()
+        lines = [b"a", b"b"]
+        self.assertEqual((lines, []), limiter.split(lines, False))
+
+    def test_lines_rate(self):
+        limiter = OutputLimiter(lines_rate=10, policy=POLICY_DROP)
+        passed, over = limiter.split([b"x"] * 15, False)
+        self.assertEqual(10, len(passed))
+        self.assertEqual(5, len(over))
+        self.assertEqual(5, limiter.take_suppressed())
+        self.assertEqual(0, limiter.take_suppressed())
+
+    def test_bytes_rate(self):
+        limiter = OutputLimiter(bytes_rate=10, policy=POLICY_DROP)
+        passed, over = limiter.split([b"12345", b"12345", b"1"], False)
+        self.assertEqual([b"12345", b"12345"], passed)
+        self.assertEqual([b"1"], over)
+
+    def test_sample(self):
+        limiter = OutputLimiter(lines_rate=1, policy=POLICY_SAMPLE, sample=3)
+        passed, over = limiter.split([b"x"] * 7, False)
+        # first within the rate, then each 3rd of 6 over the rate
+        self.assertEqual(3, len(passed))
+        self.assertEqual(4, len(over))
+
+    def test_congested(self):
+        limiter = OutputLimiter()
+        passed, over = limiter.split([b"a", b"b"], True)
+        self.assertEqual([], passed)
+        self.assertEqual(2, len(over))
+
+    def test_split_from_many_threads(self):
+        limiter = OutputLimiter(lines_rate=1000, policy=POLICY_DROP)
+        results = []
+
+        def split():
+            for _ in range(100):
+                results.append(limiter.split([b"x"] * 10, False))
+
+        threads = [threading.Thread(target=split) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        passed = sum(len(result[0]) for result in results)
+        over = sum(len(result[1]) for result in results)
+        self.assertEqual(8000, passed + over)
+        self.assertEqual(over, limiter.take_suppressed())
+        # Bucket holds a second worth of lines, refilled at most by time the test took
+        self.assertLess(passed, 2000 + 1000 * 5)
+
+
+class TestPublishBacklog(unittest.TestCase):
+    def test_backlog(self):
+        backlog = PublishBacklog(limit=10)
+        backlog.sent(5)
+        self.assertEqual(5, len(backlog))
+        self.assertFalse(backlog.congested())
+        backlog.sent(12)
+        self.assertTrue(backlog.congested())
+        backlog.published(12)
+        self.assertEqual(0, len(backlog))
+
+    def test_wrap(self):
+        backlog = PublishBacklog(limit=10)
+        backlog.published(MAX_MID - 2)
+        backlog.sent(MAX_MID - 2)
+        backlog.sent(3)
+        self.assertEqual(5, len(backlog))
+        backlog.published(1)
+        self.assertEqual(2, len(backlog))
+        backlog.published(3)
+        self.assertEqual(0, len(backlog))
+
+    def test_out_of_order_sent(self):
+        backlog = PublishBacklog()
+        backlog.sent(11)
+        backlog.sent(10)
+        self.assertEqual(11, len(backlog))
+
+    def test_untracked_published_after_sent(self):
+        backlog = PublishBacklog(limit=10)
+        backlog.sent(20)
+        # Output dropped on disconnect is never published; later status is
+        backlog.published(25)
+        self.assertEqual(0, len(backlog))
+        self.assertFalse(backlog.congested())
+
+    def test_many_untracked_messages(self):
+        backlog = PublishBacklog()
+        backlog.sent(100)
+        backlog.published(100)
+        backlog.published(40100)
+        backlog.sent(40105)
+        self.assertEqual(5, len(backlog))
@@ -0,0 +1,46 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import unittest
+
+from pyros_core.process_registry import ProcessRecord, ProcessRegistry, ProcessState, ProcessType
+
+
+class TestProcessRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = ProcessRegistry()
+
+    def test_indexes_follow_type_and_state(self):
+        record = self.registry.add(ProcessRecord("s"))
+        self.registry.add(ProcessRecord("p"))
+        self.registry.set_type(record, ProcessType.SERVICE)
+        self.registry.set_running(record, None)
+        self.assertEqual(frozenset({"s"}), self.registry.services)
+        self.assertEqual(frozenset({"s"}), self.registry.running)
+
+        self.registry.set_stopped(record)
+        self.assertEqual(frozenset(), self.registry.running)
+        self.assertEqual(ProcessState.STOPPED, record.state)
+
+        self.registry.remove("s")
+        self.assertEqual(frozenset(), self.registry.services)
+        self.assertEqual(["p"], list(self.registry))
+
+    def test_snapshot_not_changed_by_writers(self):
+        record = self.registry.add(ProcessRecord("p"))
+        snapshot = self.registry.snapshot()
+        self.registry.set_running(record, None)
+        self.registry.add(ProcessRecord("q"))
+        self.assertEqual(frozenset(), snapshot.running)
+        self.assertEqual(["p"], list(snapshot.records))
+        self.assertEqual(frozenset({"p"}), self.registry.running)
@@ -0,0 +1,56 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import threading
+import unittest
+
+from pyros_core.scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        self.called = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def call(self, name, last=False):
+        self.called.append(name)
+        if last:
+            self.done.set()
+
+    def test_timers_run_in_deadline_order(self):
+        self.scheduler.schedule(0.05, self.call, "late", True)
+        self.scheduler.schedule(0.01, self.call, "early")
+        self.scheduler.call_soon(self.call, "soon")
+        self.assertTrue(self.done.wait(2.0))
+        self.assertEqual(["soon", "early", "late"], self.called)
+
+    def test_cancelled_timer_not_called(self):
+        timer = self.scheduler.schedule(0.01, self.call, "cancelled")
+        Scheduler.cancel(timer)
+        self.scheduler.schedule(0.02, self.call, "last", True)
+        self.assertTrue(self.done.wait(2.0))
+        self.assertEqual(["last"], self.called)
+
+    def test_failing_callback_does_not_stop_scheduler(self):
+        def fail():
+            raise ValueError("expected")
+
+        self.scheduler.call_soon(fail)
+        self.scheduler.schedule(0.01, self.call, "after", True)
+        self.assertTrue(self.done.wait(2.0))
+        self.assertEqual(["after"], self.called)
@@ -0,0 +1,95 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+
+import unittest
+
+from pyros_core.scheduler import Scheduler
+from pyros_core.service_boot import ServiceBoot, BootState
+
+
+class TestServiceBoot(unittest.TestCase):
+    def setUp(self):
+        # Scheduler is never started so ready timeouts do not fire
+        self.started = []
+        self.done = []
+        self.reports = []
+        self.boot = self.new_boot()
+
+    def new_boot(self, concurrency=4):
+        return ServiceBoot(
+            lambda service: self.started.append(service.process_id),
+            lambda service: self.done.append((service.process_id, service.state)),
+            lambda process_id, message: self.reports.append((process_id, message)),
+            Scheduler(), concurrency=concurrency)
+
+    def test_started_in_dependency_order(self):
+        self.boot.add("c", {"after": "b"})
+        self.boot.add("b", {"requires": "a"})
+        self.boot.add("a", {})
+        self.boot.add("x", {})
+        self.boot.boot()
+        self.assertEqual(["a", "x"], self.started)
+
+        self.boot.started("a")
+        self.assertEqual(["a", "x", "b"], self.started)
+        self.boot.started("b")
+        self.boot.started("c")
+        self.assertFalse(self.boot.finished.is_set())
+        self.boot.started("x")
+        self.assertTrue(self.boot.finished.is_set())
+        self.assertEqual(["a", "x", "b", "c"], self.started)
+
+    def test_concurrency_limit(self):
+        self.boot = self.new_boot(concurrency=2)
+        for process_id in ["a", "b", "c"]:
+            self.boot.add(process_id, {"ready": "status"})
+        self.boot.boot()
+        self.assertEqual(["a", "b"], self.started)
+        self.boot.status("b", "ready")
+        self.assertEqual(["a", "b", "c"], self.started)
+
+    def test_ready_line(self):
+        self.boot.add("a", {"ready.line": "listening"})
+        self.boot.add("b", {"after": "a"})
+        self.boot.boot()
+        self.boot.started("a")
+        self.boot.line("a", b"starting")
+        self.assertEqual(["a"], self.started)
+        self.boot.line("a", b"listening on 8080")
+        self.assertEqual(["a", "b"], self.started)
+
+    def test_failed_requirement_fails_dependents(self):
+        self.boot.add("a", {})
+        self.boot.add("b", {"requires": "a"})
+        self.boot.add("c", {"after": "a"})
+        self.boot.add("d", {"requires": "missing"})
+        self.boot.boot()
+        self.boot.failed("a", "exited")
+        self.assertEqual(["a", "c"], self.started)
+        self.assertEqual(BootState.FAILED, self.boot.services["b"].state)
+        self.assertEqual(BootState.FAILED, self.boot.services["d"].state)
+        self.assertEqual(["a", "b", "d"], sorted(process_id for process_id, _ in self.reports))
+
+    def test_cycle_broken(self):
+        self.boot.add("a", {"after": "c"})
+        self.boot.add("b", {"after": "a"})
+        self.boot.add("c", {"after": "b"})
+        self.boot.add("d", {"after": "c"})
+        self.boot.boot()
+        self.assertEqual(["a", "b", "c"], sorted(self.started))
+        self.assertEqual(["a", "b", "c"], sorted(process_id for process_id, _ in self.reports))
+        for process_id in ["a", "b", "c"]:
+            self.boot.started(process_id)
+        self.assertEqual("d", self.started[-1])
+        self.boot.started("d")
+        self.assertTrue(self.boot.finished.is_set())
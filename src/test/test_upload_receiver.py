@@ -0,0 +1,176 @@
+################################################################################
+# Copyright (C) 2016-2020 Abstract Horizon
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License v2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#    Daniel Sendula - initial API and implementation
+#
+#################################################################################
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pyros_core.upload_receiver import UploadReceiver, MAX_UPLOADS_PER_PROCESS
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def message(header, data=b""):
+    return json.dumps(header).encode("utf-8") + b"\n" + data
+
+
+class TestUploadReceiver(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.process_dir = os.path.join(self.dir, "p")
+        os.mkdir(self.process_dir)
+        self.stored = []
+        self.statuses = []
+        self.installed = []
+        self.receiver = self.new_receiver()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def new_receiver(self):
+        return UploadReceiver(lambda process_id, name, path: self.stored.append(name),
+                              lambda process_id, status: self.statuses.append(status),
+                              lambda process_id, name, path: self.installed.append(path))
+
+    def receive(self, header, data=b"", receiver=None):
+        (receiver or self.receiver).receive("p", self.process_dir, message(header, data))
+        return self.statuses[-1] if len(self.statuses) > 0 else None
+
+    def begin(self, name, data, chunk, receiver=None):
+        return self.receive({"op": "begin", "name": name, "size": len(data), "sha256": sha256(data), "chunk": chunk}, receiver=receiver)
+
+    def chunk(self, name, data, seq, chunk, receiver=None):
+        part = data[seq * chunk:(seq + 1) * chunk]
+        return self.receive({"op": "chunk", "name": name, "seq": seq, "sha256": sha256(part)}, part, receiver=receiver)
+
+    def read(self, name):
+        with open(os.path.join(self.process_dir, name), "rb") as f:
+            return f.read()
+
+    def test_put(self):
+        self.receive({"op": "put", "name": "lib/a.py", "sha256": sha256(b"x = 1\n")}, b"x = 1\n")
+        self.assertEqual(["lib/a.py"], self.stored)
+        self.assertEqual(b"x = 1\n", self.read("lib/a.py"))
+
+    def test_put_checksum_mismatch(self):
+        status = self.receive({"op": "put", "name": "a.py", "sha256": sha256(b"other")}, b"x")
+        self.assertEqual("upload-error a.py; checksum mismatch", status)
+        self.assertFalse(os.path.exists(os.path.join(self.process_dir, "a.py")))
+
+    def test_put_failure_leaves_no_part_file(self):
+        # Can't replace a non empty directory with a file
+        os.makedirs(os.path.join(self.process_dir, "a.py", "x"))
+        status = self.receive({"op": "put", "name": "a.py", "sha256": sha256(b"x")}, b"x")
+        self.assertTrue(status.startswith("upload-error a.py; "))
+        self.assertFalse(os.path.exists(os.path.join(self.process_dir, "a.py.part")))
+
+    def test_chunked(self):
+        data = os.urandom(1000)
+        self.assertEqual("upload-ack 0 big.bin", self.begin("big.bin", data, 300))
+        for seq in range(4):
+            self.assertEqual(f"upload-ack {seq + 1} big.bin", self.chunk("big.bin", data, seq, 300))
+        self.receive({"op": "end", "name": "big.bin"})
+        self.assertEqual(["big.bin"], self.stored)
+        self.assertEqual(data, self.read("big.bin"))
+        self.assertEqual(["big.bin"], [f for f in os.listdir(self.process_dir) if f.startswith("big")])
+
+    def test_damaged_and_out_of_order_chunks(self):
+        data = os.urandom(1000)
+        self.begin("big.bin", data, 300)
+        self.chunk("big.bin", data, 0, 300)
+        self.assertEqual("upload-ack 1 big.bin", self.chunk("big.bin", data, 2, 300))
+        status = self.receive({"op": "chunk", "name": "big.bin", "seq": 1, "sha256": sha256(b"other")}, data[300:600])
+        self.assertEqual("upload-ack 1 big.bin", status)
+
+    def test_end_before_all_chunks(self):
+        data = os.urandom(1000)
+        self.begin("big.bin", data, 300)
+        self.chunk("big.bin", data, 0, 300)
+        self.assertEqual("upload-ack 1 big.bin", self.receive({"op": "end", "name": "big.bin"}))
+        self.assertEqual([], self.stored)
+
+    def test_resume_after_restart(self):
+        data = os.urandom(1000)
+        self.begin("big.bin", data, 300)
+        self.chunk("big.bin", data, 0, 300)
+        self.chunk("big.bin", data, 1, 300)
+
+        # Daemon restarted (its files closed on exit) - new receiver finds part file
+        self.receiver.forget("p")
+        receiver = self.new_receiver()
+        self.assertEqual("upload-ack 2 big.bin", self.begin("big.bin", data, 300, receiver))
+        self.chunk("big.bin", data, 2, 300, receiver)
+        self.chunk("big.bin", data, 3, 300, receiver)
+        self.receive({"op": "end", "name": "big.bin"}, receiver=receiver)
+        self.assertEqual(data, self.read("big.bin"))
+
+    def test_changed_content_starts_again(self):
+        data = os.urandom(1000)
+        self.begin("big.bin", data, 300)
+        self.chunk("big.bin", data, 0, 300)
+        self.assertEqual("upload-ack 0 big.bin", self.begin("big.bin", os.urandom(1000), 300))
+
+    def test_path_traversal(self):
+        for name in ["../x.py", "/etc/passwd", "a/../../x.py", "a.py.part", "a.py.part.meta", ".manifest"]:
+            status = self.receive({"op": "put", "name": name, "sha256": sha256(b"x")}, b"x")
+            self.assertEqual(f"upload-error {name}; invalid name", status)
+        self.assertEqual([], self.stored)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "x.py")))
+
+    def test_invalid_header(self):
+        self.receiver.receive("p", self.process_dir, b"not json\n")
+        self.assertEqual("upload-error ?; invalid header", self.statuses[-1])
+        self.assertTrue(self.receive({"op": "begin", "name": "a"}).startswith("upload-error a; invalid header"))
+        self.assertEqual("upload-error a; unknown op x", self.receive({"op": "x", "name": "a"}))
+
+    def test_manifest(self):
+        self.receive({"op": "put", "name": "a.py", "sha256": sha256(b"a")}, b"a")
+        manifest = {"a.py": sha256(b"a"), "b.py": sha256(b"b"), "../c.py": sha256(b"c")}
+        status = self.receive({"op": "manifest", "name": ""}, json.dumps(manifest).encode("utf-8"))
+        self.assertEqual(["b.py"], json.loads(status[len("upload-missing "):]))
+        self.assertIn("upload-error ../c.py; invalid name", self.statuses)
+
+    def test_invalid_manifest(self):
+        for manifest in [b"[]", b"\"x\"", b"1"]:
+            self.assertEqual("upload-error ; invalid manifest", self.receive({"op": "manifest", "name": ""}, manifest))
+
+    def test_archive_installed(self):
+        self.receive({"op": "put", "name": "p.tar.gz", "sha256": sha256(b"archive"), "archive": True}, b"archive")
+        self.assertEqual([], self.stored)
+        self.assertEqual(1, len(self.installed))
+        self.assertEqual(os.path.join(self.dir, ".p.archive"), self.installed[0])
+
+    def test_expire(self):
+        data = os.urandom(1000)
+        self.begin("big.bin", data, 300)
+        self.chunk("big.bin", data, 0, 300)
+        self.assertEqual(set(), self.receiver.idle_processes())
+
+        later = time.monotonic() + self.receiver.timeout + 1
+        self.assertEqual({"p"}, self.receiver.idle_processes(later))
+        self.receiver.expire("p", later)
+        self.assertEqual(set(), self.receiver.idle_processes(later))
+        self.assertEqual([], [f for f in os.listdir(self.process_dir) if f.startswith("big.bin")])
+        self.assertEqual("upload-error big.bin; upload not started", self.chunk("big.bin", data, 1, 300))
+
+    def test_uploads_per_process_capped(self):
+        for i in range(MAX_UPLOADS_PER_PROCESS + 1):
+            self.begin(f"f{i}.bin", b"12345", 2)
+        self.assertEqual(MAX_UPLOADS_PER_PROCESS, len(self.receiver._uploads))
+        self.assertNotIn(("p", "f0.bin"), self.receiver._uploads)
+        self.assertFalse(os.path.exists(os.path.join(self.process_dir, "f0.bin.part")))